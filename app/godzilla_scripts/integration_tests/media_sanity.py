@@ -7,20 +7,21 @@ __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 import copy
 import os
 import sys
+import threading
 import time
 from collections import OrderedDict
 from pprint import pformat
 from uuid import uuid4
 # platform modules
 from middleware.arguments import GodzillaIntegrationTestArgument
-from platform_libraries.compare import local_md5sum, md5sum
+from platform_libraries.compare import local_md5sum
 from platform_libraries.constants import Godzilla
 from platform_libraries.popcorn import PopcornTest
-from platform_libraries.pyutils import ignore_unknown_codec, retry, save_to_file
+from platform_libraries.pyutils import ignore_unknown_codec, retry
 from platform_libraries.common_utils import execute_local_cmd
 # test modules
 from transcoding_tests.lib.converter import (
-    FileAPIResponseConverter, FFmpegInfoConverter, TranscodingSettingInformation
+    FileAPIResponseConverter, FFmpegInfoConverter, StreamVideoConverter, TranscodingSettingInformation
 )
 from transcoding_tests.lib.transcoding_settings import (
     API_TRANSCODING_SETTINGS, get_pretranscoding_resolution
@@ -104,6 +105,8 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         self.transcoding_request_timeout = 60*5
         self.retry_time_video_playlist = 6
         self.retry_time_video_segment = 5
+        self.segment_workers = 1
+        self.segment_inflight_mb = 64
         MOUNT_PATH = Godzilla.MOUNT_PATH
 
     def test(self):
@@ -286,17 +289,20 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         self.log.info('*** Start Data Comaprsion...'.format(test_info['index']))
 
         self.file_id = test_info['rest_resp']['id']
-        # Get file
-        content = self.uut_owner.get_file_content_v3(file_id=self.file_id).content
-        # Verify MD5sum
-        remote_md5 = md5sum(content)
+        # Get file, chunks are hashed as they arrive and then dropped.
+        report = self.uut_owner.download_file(file_id=self.file_id, hash_algorithm='md5', api_version='v3')
+        self.log.info('Download: {}'.format(report))
+        remote_md5 = report.digest
         self.log.info('MD5 of remote file: {}'.format(remote_md5))
 
         # NOTE: Only first match
         if self.local_data_path: # On local.
             stdout, stderr = execute_local_cmd("find . -name '{}' -type f".format(test_info['rest_info']['name']))
         else: # In USB.
-            stdout, stderr = self.ssh_client.execute_cmd("find {} -name '{}' -type f".format(self.MOUNT_PATH, test_info['rest_info']['name']))
+            # List USB files once for all sub-tests instead of running "find" for each file.
+            if not getattr(self, 'usb_files', None):
+                self.usb_files = self.ssh_client.hasher.list_files([self.MOUNT_PATH])
+            stdout = '\n'.join(path for path in self.usb_files if path.split('/')[-1] == test_info['rest_info']['name'])
         if not stdout:
             raise self.err.TestFailure('Source file: {} not found.'.format(test_info['rest_info']['name']))
         files = stdout.splitlines()
@@ -304,8 +310,11 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         if self.local_data_path: # On local.
             source_md5 = local_md5sum(files[0])
         else: # In USB.
-            stdout, stderr = self.ssh_client.execute_cmd("md5sum '{}'".format(files[0]))
-            source_md5 = stdout.split()[0]
+            # Cached digest is reused if the source file is not changed.
+            record = self.ssh_client.hasher.hash_files([files[0]], algorithm='md5').get(files[0])
+            if not record: # Removed after listed.
+                raise self.err.TestFailure('Failed to get MD5 of source file: {}, it may be removed.'.format(files[0]))
+            source_md5 = record.digest
         self.log.info('MD5 of source file: {}'.format(source_md5))
 
         if remote_md5 != source_md5:
@@ -361,27 +370,53 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         #else:
         #    self._test_video_segment(test_info=self.global_dict['test_info'], M3U8_content=self.global_dict['sub_test_results'][3])
 
+    def get_segment_fetcher(self, test_info):
+        return SegmentFetcher(
+            testcase=self, file_id=test_info['rotated_rest_info']['id'], workers=self.segment_workers,
+            max_inflight_bytes=self.segment_inflight_mb*1024*1024,
+            keep_folder=self.env.output_folder if self.keep_video else None)
+
+    def save_segment_for_tracing(self, segment):
+        """ Save the beginning of segment which is kept in memory, since segment is not saved to disk. """
+        if not segment or not segment.content_head:
+            return
+        save_path = os.path.join(self.env.output_folder, uuid4().hex+'.ts')
+        self.log.warning('Save the first {} bytes of stream to {} for tracing'.format(len(segment.content_head), save_path))
+        with open(save_path, 'wb') as f:
+            f.write(segment.content_head)
+
     def _test_pretranscoding_with_video_segment(self, test_info, M3U8_content):
         self.log.info('*** Start Video Segment Test (Sub-test #{})...'.format(test_info['index']))
-        
-        # Verify each video link.
-        for segment_index, video_link in enumerate(self.split_video_link(M3U8_content), 1):
+        fetcher = self.get_segment_fetcher(test_info)
+        if fetcher.prefetch: # Check once before segments are prefetched.
+            # HLS session expires if it has no request to a sequment over about 20s.
+            self.handle_existing_FFmpeg_process(timeout=10)
+
+        # Video segments are fetched and piped to ffprobe in background, and verified here in order.
+        for prefetched in fetcher.iter_segments(self.split_video_link(M3U8_content)):
+            segment_index, video_link = prefetched.index, prefetched.link
             try:
-                # HLS session expires if it has no request to a sequment over about 20s.
-                #self.handle_existing_FFmpeg_process()
                 self.log.warning('Verify link of video segment #{}: {}'.format(segment_index, video_link))
                 vsir = VideoSequmentInfoReplacement(info_dict=test_info['ts_info'])
+                attempts = []
                 try:
                     def verify_video_segment():
+                        segment = None
                         try:
-                            # HLS session expires if it has no request to a sequment over about 20s.
-                            self.handle_existing_FFmpeg_process(timeout=10) # Check for each retry.
-                            video_response = self._send_request(file_id=test_info['rotated_rest_info']['id'], video_link=video_link)
-                            self.log.info('Elapsed Time: {} sec.'.format(video_response.elapsed.total_seconds()))
-                            save_to_file(iter_obj=video_response.iter_content(chunk_size=1024), file_name=self.local_file)
+                            if fetcher.prefetch and not attempts: # Use the prefetched segment at the first time.
+                                attempts.append(prefetched)
+                                segment = prefetched.get()
+                            else:
+                                fetcher.wait_pending() # Not to count FFmpeg processes of prefetched segments.
+                                # HLS session expires if it has no request to a sequment over about 20s.
+                                self.handle_existing_FFmpeg_process(timeout=10) # Check for each retry.
+                                segment = VideoSegment(segment_index, video_link)
+                                attempts.append(segment)
+                                fetcher.fetch(segment)
+                            self.log.info('Elapsed Time: {} sec.'.format(segment.response.elapsed.total_seconds()))
                             # Replace video information by video segment information for verification.
                             test_info['ts_info'] = vsir.replace_by_url(url=video_link)
-                            self.verify_transcoding_header(video_response, test_info)
+                            self.verify_transcoding_header(segment.response, test_info, content_head=segment.content_head)
 
                             # Per KDP-2368 and change resolution
                             # Match one of resolution
@@ -393,22 +428,15 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
                                 try:
                                     self.log.info('Expect video segment is in {}'.format(resolution))
                                     test_info['ts_info'] = vsir.replace_resolution(resolution=resolution)
-                                    self.verify_transcoding_content(test_info)
+                                    self.verify_transcoding_content(test_info, transcoded_stream=segment.stream_info)
                                     content_verify_success = True
                                     break
                                 except Exception as e:
                                     self.log.warning(e)
                             if not content_verify_success: raise self.err.TestFailure(e)
                         except Exception as e:
-                            if os.path.exists(self.local_file): # For tracing bug.
-                                save_path = os.path.join(self.env.output_folder, uuid4().hex+'.ts')
-                                self.log.warning('Move stream file to {} for tracing'.format(save_path))
-                                os.rename(self.local_file, save_path)
+                            self.save_segment_for_tracing(segment or attempts[-1])
                             raise
-                        finally:
-                            if os.path.exists(self.local_file):
-                                if self.keep_video: self.keep_video()
-                                else: os.remove(self.local_file)
 
                     retry( # Retry for tracing issues.
                         func=verify_video_segment,
@@ -429,29 +457,38 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
 
     def _test_video_segment(self, test_info, M3U8_content):
         self.log.info('*** Start Video Segment Test (Sub-test #{})...'.format(test_info['index']))
+        fetcher = self.get_segment_fetcher(test_info)
+        if fetcher.prefetch: # Check once before segments are prefetched.
+            self.handle_existing_FFmpeg_process()
+            rebooted = self.reboot_device_if_zombie_found()
         # Verify each video link.
-        for segment_index, video_link in enumerate(self.split_video_link(M3U8_content), 1):
+        for prefetched in fetcher.iter_segments(self.split_video_link(M3U8_content)):
+            segment_index, video_link = prefetched.index, prefetched.link
             try:
-                self.handle_existing_FFmpeg_process()
-                rebooted = self.reboot_device_if_zombie_found()
+                if not fetcher.prefetch: # Check before each segment.
+                    self.handle_existing_FFmpeg_process()
+                    rebooted = self.reboot_device_if_zombie_found()
                 self.log.warning('Verify link of video segment #{}: {}'.format(segment_index, video_link))
 
                 vsir = VideoSequmentInfoReplacement(info_dict=test_info['ts_info'])
                 try:
                     # Do video transcoding (retry 10 times for reboot process).
                     if rebooted: self.log.info('The next RestSDK call could retry {} times cause it invoked after device rebooted...'.format(self.retry_time_video_segment))
-                    video_response = retry(
-                        func=self._send_request,
-                        file_id=test_info['rotated_rest_info']['id'], video_link=video_link,
+                    attempts = [prefetched] if fetcher.prefetch else []
+                    def fetch_segment():
+                        if attempts: # Use the prefetched segment at the first time.
+                            return attempts.pop().get()
+                        return fetcher.fetch(VideoSegment(segment_index, video_link))
+                    segment = retry(
+                        func=fetch_segment,
                         excepts=(requests.HTTPError, TypeError, AttributeError), delay=10, max_retry=self.retry_time_video_segment, log=self.log.warning
                     )
-                    self.log.info('Elapsed Time: {} sec.'.format(video_response.elapsed.total_seconds()))
-                    save_to_file(iter_obj=video_response.iter_content(chunk_size=1024), file_name=self.local_file)
+                    self.log.info('Elapsed Time: {} sec.'.format(segment.response.elapsed.total_seconds()))
                     # Replace video information by video segment information for verification.
                     test_info['ts_info'] = vsir.replace_by_url(url=video_link)
-                    self.verify_transcoding_header(video_response, test_info)
+                    self.verify_transcoding_header(segment.response, test_info, content_head=segment.content_head)
                     try:
-                        self.verify_transcoding_content(test_info)
+                        self.verify_transcoding_content(test_info, transcoded_stream=segment.stream_info)
                     except Exception as check_err:
                         # For Improve Video Start Time(KAM200-2371), the first three segment are 720p.
                         if segment_index > 3:
@@ -464,11 +501,8 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
                             raise self.err.TestFailure(check_err)
                         self.log.warning('It is a pre-transcoding segment and it should be 720p...')
                         test_info['ts_info'] = vsir.replace_resolution(resolution='720p')
-                        self.verify_transcoding_content(test_info)
+                        self.verify_transcoding_content(test_info, transcoded_stream=segment.stream_info)
                 finally:
-                    if os.path.exists(self.local_file):
-                        if self.keep_video: self.keep_video()
-                        else: os.remove(self.local_file)
                     # Recover back video information.
                     test_info['ts_info'] = vsir.get_original_dict()
                     self.log.warning('Verify link of video segment #{} is done'.format(segment_index))
@@ -480,6 +514,156 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
     def handle_existing_FFmpeg_process(self, delay=5, timeout=60*70, time_to_kill=60*60):
         super(MediaSanityTest, self).handle_existing_FFmpeg_process(delay, timeout, time_to_kill)
 
+#
+# Streaming Video Segment Verification
+#
+class ByteBudget(object):
+    """ Cap of bytes held by all segment fetchers at the same time. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.available = max_bytes
+        self.cond = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self.max_bytes)
+        with self.cond:
+            while self.available < size:
+                self.cond.wait()
+            self.available -= size
+        return size
+
+    def release(self, size):
+        with self.cond:
+            self.available += size
+            self.cond.notify_all()
+
+
+class VideoSegment(object):
+    """ One video segment which is fetched and probed. """
+
+    def __init__(self, index, link):
+        self.index = index
+        self.link = link
+        self.response = None
+        self.stream_info = None # Converted ffprobe information.
+        self.content_head = '' # The beginning of content for logging and tracing.
+        self.size = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def get(self):
+        """ Wait for fetching and return self, or raise the error of fetching. """
+        self.done.wait()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self
+
+
+class SegmentFetcher(object):
+    """ Fetch video segments with several workers, and pipe each segment into ffprobe as it arrives,
+    so no segment is saved on disk or kept in memory. Bytes held by all the workers are capped by max_inflight_bytes.
+    With one worker, segments are not prefetched and the caller fetches each of them by fetch().
+    """
+    HEAD_SIZE = 1024*1024 # Bytes of content kept in memory for tracing.
+
+    def __init__(self, testcase, file_id, workers=2, max_inflight_bytes=64*1024*1024, chunk_size=256*1024,
+            keep_folder=None):
+        """
+        :param workers: Number of segments fetched at the same time.
+        :param keep_folder: Save all segments to this folder if it's specified.
+        """
+        self.testcase = testcase
+        self.log = testcase.log
+        self.file_id = file_id
+        self.workers = max(1, workers)
+        self.prefetch = self.workers > 1
+        self.chunk_size = min(chunk_size, max_inflight_bytes)
+        self.budget = ByteBudget(max_inflight_bytes)
+        self.keep_folder = keep_folder
+        self.pending = []
+
+    def _iter_chunks(self, response):
+        chunks = response.iter_content(chunk_size=self.chunk_size)
+        while True:
+            # Budget of a chunk is released after it's written to ffprobe.
+            held = self.budget.acquire(self.chunk_size)
+            try:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+            finally:
+                self.budget.release(held)
+
+    def fetch(self, segment):
+        """ Fetch segment and fill its information, return segment. """
+        keep_file = None
+        try:
+            segment.response = self.testcase._send_request(file_id=self.file_id, video_link=segment.link, stream=True)
+            if self.keep_folder:
+                keep_file = open(os.path.join(self.keep_folder, 'segment_{}_{}.ts'.format(segment.index, uuid4().hex[:8])), 'wb')
+            head = []
+            def on_chunk(chunk):
+                head_size = sum(len(data) for data in head)
+                if head_size < self.HEAD_SIZE:
+                    head.append(chunk[:self.HEAD_SIZE-head_size])
+                if keep_file:
+                    keep_file.write(chunk)
+            try:
+                converter = StreamVideoConverter(self._iter_chunks(segment.response), logging=self.log, on_chunk=on_chunk)
+            finally:
+                segment.content_head = ''.join(head)
+            segment.size = converter.size
+            segment.stream_info = converter.convert()
+            self.log.info('Video segment #{}: {} bytes'.format(segment.index, segment.size))
+            return segment
+        finally:
+            if segment.response is not None:
+                segment.response.close()
+            if keep_file:
+                keep_file.close()
+
+    def _fetch_in_background(self, segment):
+        try:
+            self.fetch(segment)
+        except:
+            segment.error = sys.exc_info()
+        finally:
+            segment.done.set()
+
+    def iter_segments(self, links):
+        """ Yield VideoSegment of each link in order, and the next segments are fetched meanwhile.
+        Call get() of the segment to wait for its result. Segments are not fetched if prefetch is disabled.
+        """
+        if not self.prefetch:
+            for index, link in enumerate(links, 1):
+                yield VideoSegment(index, link)
+            return
+        links = enumerate(links, 1)
+        def submit():
+            index, link = next(links, (None, None))
+            if link is None:
+                return
+            segment = VideoSegment(index, link)
+            thread = threading.Thread(target=self._fetch_in_background, args=(segment,))
+            thread.daemon = True
+            thread.start()
+            self.pending.append(segment)
+
+        for _ in xrange(self.workers):
+            submit()
+        while self.pending:
+            segment = self.pending.pop(0)
+            submit()
+            yield segment
+
+    def wait_pending(self):
+        """ Wait for the segments which are being fetched in background. """
+        for segment in list(self.pending):
+            segment.done.wait()
+
+
 class VideoSequmentInfoReplacement(object):
     """ Utility to change global video information temporally for verify video segment. """
 
@@ -532,6 +716,8 @@ if __name__ == '__main__':
     parser.add_argument('-rtt', '--retry_time_transcode', help='Retry time for transcoding call', type=int, metavar='MAX', default=0)
     parser.add_argument('-rtvp', '--retry_time_video_playlist', help='Retry time for playlist call', type=int, metavar='MAX', default=6)
     parser.add_argument('-rtvs', '--retry_time_video_segment', help='Retry time for video segment call', type=int, metavar='MAX', default=5)
+    parser.add_argument('-sw', '--segment_workers', help='Number of video segments fetched at the same time, segments are prefetched in background if it is more than 1', type=int, metavar='NUMBER', default=1)
+    parser.add_argument('-simb', '--segment_inflight_mb', help='Max MB of video segment data held in memory', type=int, metavar='MB', default=64)
     parser.add_argument('-kv', '--keep_video', help='keep all transcoded video', action='store_true', default=False)
     parser.add_argument('-wfpr', '--wait_for_pretranscoding_ready', help='keep all transcoded video', action='store_true', default=False)
 
@@ -671,19 +671,29 @@ class RESTSDKTranscoding(VideoTranscoding):
         self.log.warning('Move stream file to {} for tracing'.format(save_path))
         os.rename(self.local_file, save_path)
 
-    def verify_transcoding_header(self, response, test_info):
+    def verify_transcoding_header(self, response, test_info, content_head=None):
+        """
+        :param content_head: Beginning of response content for logging, read from self.local_file if it's None.
+        """
         self.log.info("Response Header: \n{}".format(pformat(response.headers)))
         container = test_info['ts_info']['container']
         if API_MIMETYPE.get(container, '').lower() != response.headers.get('Content-Type', '').lower():
             self.log.info('Verify header: FAILED.')
-            self.uut_owner.log_response(response, logger=self.log.warning)
-            with open(self.local_file) as f:
-                self.log.warning('Response content(one line): {}'.format(f.readline()))
+            self.uut_owner.log_response(response, logger=self.log.warning, show_content=content_head is None)
+            if content_head is not None:
+                self.log.warning('Response content(one line): {}'.format(content_head.split('\n', 1)[0]))
+            else:
+                with open(self.local_file) as f:
+                    self.log.warning('Response content(one line): {}'.format(f.readline()))
             raise self.err.TestFailure('Response header is incorrect.')
         self.log.info('Verify header: PASSED.')
 
-    def verify_transcoding_content(self, test_info):
-        transcoded_stream = VideoConverter(path=self.local_file, logging=self.log).convert()
+    def verify_transcoding_content(self, test_info, transcoded_stream=None):
+        """
+        :param transcoded_stream: Converted information of the stream, probe self.local_file if it's None.
+        """
+        if transcoded_stream is None:
+            transcoded_stream = VideoConverter(path=self.local_file, logging=self.log).convert()
         test_info['converted_info'] = transcoded_stream
 
         # Convert all inforamtion to the same data format.
@@ -88,12 +88,16 @@ class GetVideoPlaylistTest(GetVideoStreamTest):
             link = link_part.lstrip('.')
             yield link
 
-    def _send_request(self, file_id, video_link):
-        """ Send video stream request via restAPI lib. """
+    def _send_request(self, file_id, video_link, stream=False):
+        """ Send video stream request via restAPI lib.
+
+        :param stream: Not to read response content until it's iterated.
+        """
         port = self.uut_owner.get_current_restsdk_port()
         response = self.uut_owner.send_request(
             method='GET',
             url='http://{0}:{1}/sdk/v2/files/{2}{3}'.format(self.uut_owner.uut_ip, port, file_id, video_link),
+            stream=stream
         )
         if response.status_code != 200:
             self.uut_owner.error('Fail to execute get video stream.', response)
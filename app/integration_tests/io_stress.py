@@ -252,12 +252,17 @@ class StressIOTest(TestCase):
                     # Todo: (3/3) find how to share data and let the other user use their id to get owner's file
                     # content, elapsed = self.USER_LIST[index].get_file_content(self.FILE_DOWNLOAD_ID_LIST[index])
                     download_start_time = time.time()
-                    content = self.USER_LIST[0].get_file_content_v3(self.FILE_DOWNLOAD_ID_LIST[index]).content
-                    with open(os.path.join(self.LOCAL_DOWNLOAD_FOLDER, 'user_{}'.format(user_num), file), 'wb') as f:
-                        f.write(content)
+                    # Save and hash content in one pass, size of the uploaded file is expected.
+                    report = self.USER_LIST[0].download_file(self.FILE_DOWNLOAD_ID_LIST[index],
+                        sink=os.path.join(self.LOCAL_DOWNLOAD_FOLDER, 'user_{}'.format(user_num), file),
+                        size=os.path.getsize(os.path.join(self.LOCAL_UPLOAD_FOLDER, file)))
                     download_elapsed_time = time.time() - download_start_time
                     self.log.info("### User{0}: Download file: {1} complete. Time elapsed: {2} ###".format(user_num, file, download_elapsed_time))
-                    checksum = _local_md5_checksum(os.path.join(self.LOCAL_DOWNLOAD_FOLDER, 'user_{}'.format(user_num), file))
+                    if not report.is_complete():
+                        self.log.error("### User{0}: Download file: {1} size is {2}, expected size is {3} ###".format(
+                            user_num, file, report.size, report.expected_size))
+                        test_passed = False
+                    checksum = report.digest
                     result = _compare_md5_checksum(user_num, file, self.FILE_MD5_LIST[index], checksum)
                     if not result:
                         test_passed = False
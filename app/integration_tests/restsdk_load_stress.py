@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# std modules
+import json
+import sys
+
+# platform modules
+from middleware.arguments import InputArgumentParser
+from middleware.test_case import TestCase
+from platform_libraries.load_generator import LoadGenerator, LoadScenario, RestSDKOperations
+from platform_libraries.restAPI import RestAPI
+from platform_libraries.restsdk_walker import BulkDeleter
+
+
+class RestSDKLoadStress(TestCase):
+
+    TEST_SUITE = 'RestSDK_Stress_Tests'
+    TEST_NAME = 'RestSDK_Load_Generator'
+
+    def init(self):
+        self.clients = [self.uut_owner]
+        for idx in xrange(int(self.extra_users)):
+            user = RestAPI(uut_ip=self.env.uut_ip, env=self.env.cloud_env,
+                username='wdctest_stress_load_{0}+qawdc@test.com'.format(idx), password='Test1234')
+            self.clients.append(user)
+        self.operations = None
+
+    def before_test(self):
+        self.log.info('Upload {} seed files for each user'.format(self.seed_files))
+        file_ids = {}
+        for client in self.clients:
+            file_ids[client.username] = [
+                client.create_file('load_seed_{}'.format(idx), file_content='0' * int(self.upload_size),
+                    resolve_name_conflict=True)
+                for idx in xrange(int(self.seed_files))
+            ]
+        self.operations = RestSDKOperations(file_ids=file_ids, upload_size=int(self.upload_size))
+
+    def test(self):
+        scenario = LoadScenario(self.operations.get_operations(), mix=json.loads(self.mix), rate=float(self.rate),
+            duration=int(self.duration), arrival=self.arrival)
+        report = LoadGenerator(scenario, clients=self.clients, max_in_flight=int(self.max_in_flight)).run()
+        result = report.to_dict()
+        self.data.test_result['offered_rate'] = result['offered_rate']
+        self.data.test_result['achieved_rate'] = result['achieved_rate']
+        self.data.test_result['dropped'] = result['dropped']
+        self.data.test_result['errors'] = result['errors']
+        for name, stats in result['operations'].iteritems():
+            for key in ('p50', 'p95', 'p99', 'max'):
+                self.data.test_result['{}_{}'.format(name, key)] = stats['response_time'][key]
+            self.data.test_result['{}_errors'.format(name)] = stats['errors']
+        if result['errors']:
+            raise self.err.TestFailure('{} requests failed'.format(result['errors']))
+
+    def after_test(self):
+        if not self.operations:
+            return
+        for client in self.clients:
+            ids = self.operations.file_ids.get(client.username, []) + self.operations.uploaded_ids.get(client.username, [])
+            BulkDeleter(client).delete(set(ids))
+
+
+if __name__ == '__main__':
+    parser = InputArgumentParser("""\
+        *** Open-loop load test of RestSDK with a mix of search/download/upload/share requests ***
+        """)
+    parser.add_argument('--rate', help='Requests per second', default='100')
+    parser.add_argument('--duration', help='Seconds to generate load', default='300')
+    parser.add_argument('--arrival', help='Arrival intervals', choices=['poisson', 'constant'], default='poisson')
+    parser.add_argument('--mix', help='Weights of operations in JSON',
+        default='{"download": 60, "search": 25, "upload": 10, "share": 5}')
+    parser.add_argument('--max_in_flight', help='Max concurrent requests', default='1000')
+    parser.add_argument('--extra_users', help='Number of users besides owner', default='0')
+    parser.add_argument('--seed_files', help='Number of files to upload for each user before test', default='20')
+    parser.add_argument('--upload_size', help='Bytes of each uploaded file', default='65536')
+    test = RestSDKLoadStress(parser)
+    resp = test.main()
+    print 'test response: {}'.format(resp)
+    if resp:
+        sys.exit(0)
+    sys.exit(1)
@@ -33,9 +33,16 @@ class CoreInputArgumentParser(ArgumentParser):
         self.add_argument('-ltf', '--loop_times_from', help='Start index of test iterations', metavar='NUMBER', type=int, default=1)
         # Bulitin Feature Settings
         self.add_argument('-dsr', '--disable_save_result', help='Not save test result to file', action='store_true', default=False)
+        self.add_argument('-srs', '--stream_results', help='Append each loop result to JSON-lines journal and test_report.xml when it is done, instead of saving JSON file per iteration and test_report.xml at the end', action='store_true', default=False)
         self.add_argument('-dul', '--disable_upload_logs', help='Not upload output folder to server', action='store_true', default=False)
+        self.add_argument('-aru', '--async_result_upload', help='Upload test results to logstash and Popcorn in background', action='store_true', default=False)
+        self.add_argument('-rsp', '--result_spool_path', help='File to keep test results failed to upload, they are retried later (default: RESULTS_FOLDER/result_spool.jsonl)', metavar='PATH', default=None)
+        self.add_argument('-rft', '--result_flush_timeout', help='Seconds to wait for uploading test results in background at exit', metavar='SECONDS', type=int, default=None)
         self.add_argument('-dpe', '--disable_print_errors', help='Not print test errors at end of test', action='store_true', default=False)
         self.add_argument('-sll', '--stream_log_level', help='Log level of print out message', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'])
+        self.add_argument('-lpl', '--log_pipeline', help='Write logs by background thread, logging calls will not wait for file and screen output', action='store_true', default=False)
+        self.add_argument('-lmb', '--log_max_mb', help='Rotate log file at this size and compress the rotated ones (with --log_pipeline)', metavar='MB', type=int, default=None)
+        self.add_argument('-lrl', '--log_rate_limit', help='Max log records per second of each logger, the exceeded ones lower than WARNING are dropped (with --log_pipeline)', metavar='NUMBER', type=int, default=None)
         self.add_argument('-debug', '--debug_middleware', help='Print debug messages of middleware', action='store_true', default=False)
         self.add_argument('-ref', '--run_even_failure', help='Keep run looping even there is any sub-test failed', action='store_true', default=False)
         # Folders/Files Settings (Maybe these are not necessary )
@@ -203,6 +210,13 @@ class IntegrationTestArgumentExtensions(object):
         self.add_argument('-ec', '--exec_ordering', help='Specify execute odering of sub-tests with a touple index list (index start from 0), example: "(2,4,1,1,3)"', default=None)
 
         self.add_argument('--exec_group', help='Specify execute odering of sub-tests with a touple index list (index start from 0), example: "[(2,4), (1,3)]"', default=None)
+        self.add_argument('-wc', '--weighted_choice', help='Random choice the test cases failed more often more often, works with --duration_db', action='store_true', default=False)
+        self.add_argument('-tb', '--time_budget', help='Random choice test cases to fill the time by estimated test time, works with --duration_db. Acceptable values: "8h", "90m" or seconds', default=None)
+        # Duration estimation feature
+        self.add_argument('-ddb', '--duration_db', help='SQLite file of test elapsed time history, to estimate test time and pack sub-tests on device pool', metavar='PATH', default=None)
+        # Device pool feature
+        self.add_argument('-dp', '--device_pool', nargs='*', help='Run sub-tests in parallel on these devices and UUT, each device is "uut_ip,serial_server_ip,serial_server_port,ssh_user,ssh_password,ssh_port" (empty fields use the values of UUT), example: -dp 10.0.0.2 10.0.0.3,10.0.0.100,20003', metavar='DEVICE', default=None)
+        self.add_argument('-dpf', '--device_pool_file', help='JSON file of device list for --device_pool, each device is a dict of arguments to overwrite, example: [{"uut_ip": "10.0.0.2", "serial_server_port": "20002"}]', metavar='PATH', default=None)
 
 class CoreIntegrationTestArgument(IntegrationTestArgumentExtensions, CoreInputArgumentParser):
     pass
@@ -260,6 +274,19 @@ class KeywordArguments(dict):
                 if not isinstance(value, tuple) or [i for i in value if not isinstance(i, int)] or len(value) != 2:
                     raise ValueError('{} is not correct'.format(name))
 
+        if name in ['time_budget']: # Except: 8h, 90m, 3600
+            if not value:
+                return None
+            if isinstance(value, (int, float)):
+                return value
+            units = {'h': 60*60, 'm': 60, 's': 1}
+            try:
+                if value[-1].lower() in units:
+                    return float(value[:-1]) * units[value[-1].lower()]
+                return float(value)
+            except ValueError:
+                raise ValueError('{} is not correct'.format(name))
+
         if name in ['exec_ordering']:# Except: (2,4)
             if not value:
                 return None
@@ -15,11 +15,14 @@ from platform_libraries.adblib import ADB
 from platform_libraries.btle_client import YodaClient
 from platform_libraries.common_utils import create_logger
 from platform_libraries.ddwrt_client import DDWRTClient
+from platform_libraries.http_stats import HTTPStats, get_http_stats_recorder
 from platform_libraries.nasadmin_client import NasAdminClient
 from platform_libraries.popcorn import gen_popcorn_test, gen_popcorn_report, upload_popcorn_report_to_server
-from platform_libraries.pyutils import retry
+from platform_libraries.pyutils import request_log_stats, retry
 from platform_libraries.powerswitchclient import PowerSwitchClient
 from platform_libraries.restAPI import RestAPI
+from platform_libraries.result_store import LoopResultStore
+from platform_libraries.result_sink import FLUSH_TIMEOUT, get_result_sink
 from platform_libraries.serial_client import SerialClient
 from platform_libraries.test_result import ELKTestResult, ELKLoopingResult, object_to_json_file
 from platform_libraries.ssh_client import SSHClient
@@ -291,37 +294,34 @@ class UUTInformationComponent(TestCaseComponent, dict):
 
     def get_UUT_info_with_SSH(self):
         self.env.log.info('Getting device information with SSH...')
+        ssh_client = self.testcase.ssh_client
+        # Get all fields with one round trip first, and then retry the missing fields one by one.
+        try:
+            batch_data = ssh_client.get_device_info_in_batch()
+        except Exception as e:
+            self.env.log.warning('Failed to get device information in batch: {}'.format(repr(e)))
+            batch_data = {'mac_addresses': {}}
+
+        def get_field(name, func, **kwargs):
+            if batch_data.get(name):
+                return batch_data[name]
+            return retry(
+                func=func, retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning,
+                not_raise_error=True, **kwargs
+            )
+
         data = {}
-        data['firmware'] = retry(
-            func=self.testcase.ssh_client.get_firmware_version,
-            retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-        )
-        data['model'] = retry(
-            func=self.testcase.ssh_client.get_model_name,
-            retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-        )
-        data['environment'] = retry(
-            func=self.testcase.ssh_client.get_device_environment,
-            retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-        )
-        data['config_url'] = retry(
-            func=self.testcase.ssh_client.get_restsdk_configurl,
-            retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-        )
+        data['firmware'] = get_field('firmware', ssh_client.get_firmware_version)
+        data['model'] = get_field('model', ssh_client.get_model_name)
+        data['environment'] = get_field('environment', ssh_client.get_device_environment)
+        data['config_url'] = get_field('config_url', ssh_client.get_restsdk_configurl)
         if data['model'] in ['monarch2', 'pelican2', 'yodaplus2']:   # For KDP
-            data['serial_number'] = retry(
-                func=self.testcase.ssh_client.get_device_serial_number,
-                retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-            )
-            data['mac_address'] = retry(
-                func=self.testcase.ssh_client.get_mac_address, interface= 'wlan0' if data['model'] in ['yodaplus2', 'rocket', 'drax'] else 'eth0',
-                retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-            )
+            data['serial_number'] = get_field('serial_number', ssh_client.get_device_serial_number)
+            interface = 'wlan0' if data['model'] in ['yodaplus2', 'rocket', 'drax'] else 'eth0'
         else:   # For GZA
-            data['mac_address'] = retry(
-                func=self.testcase.ssh_client.get_mac_address, interface= 'egiga0',
-                retry_lambda=lambda ret: not ret, delay=10, max_retry=3, log=self.env.log.warning, not_raise_error=True
-            )
+            interface = 'egiga0'
+        batch_data['mac_address'] = batch_data['mac_addresses'].get(interface)
+        data['mac_address'] = get_field('mac_address', ssh_client.get_mac_address, interface=interface)
 
         return data
 
@@ -388,8 +388,11 @@ class ResultComponent(TestCaseComponent):
         self.init_worksapce()
         self.test_result = None # ELKTestResult object to record the test result on the current iteration.
         self.loop_results = None # ResultList object to append each test iteration result.
+        self.loop_result_store = None # LoopResultStore object to save each test iteration result.
         self.file_prefix = '' # Prefix part of output file name.
         self.upload_logstash = True
+        self.http_stats = HTTPStats() # HTTP stats of entire test.
+        self.init_result_sink()
 
     def init_worksapce(self):
         """ Create working folders if they don't exist. """
@@ -404,6 +407,14 @@ class ResultComponent(TestCaseComponent):
         if not os.path.exists(results_path):
             os.makedirs(results_path)
 
+    def init_result_sink(self):
+        """ Upload results by ResultSink in background if async_result_upload is set. """
+        self.result_sink = None
+        if not getattr(self.env, 'async_result_upload', False):
+            return
+        spool_path = getattr(self.env, 'result_spool_path', None) or '{}/result_spool.jsonl'.format(self.env.results_folder)
+        self.result_sink = get_result_sink().configure(spool_path=os.path.join(self.worksapce, spool_path))
+
     def get_abs_path(self, relative_path):
         if not self.worksapce:
             return relative_path
@@ -415,6 +426,8 @@ class ResultComponent(TestCaseComponent):
         uut = getattr(self.testcase, 'uut')
         if not uut:
             uut = {}
+        # HTTP calls before this iteration only count in stats of entire test.
+        self.http_stats.merge(get_http_stats_recorder().pop())
         # Generate test result.
         self.test_result = ELKTestResult(
             test_suite=self.testcase.TEST_SUITE, test_name=self.testcase.TEST_NAME,
@@ -432,14 +445,65 @@ class ResultComponent(TestCaseComponent):
             test_suite=self.testcase.TEST_SUITE, test_name=self.testcase.TEST_NAME,
             build=uut.get('firmware', ''),  product=uut.get('model', ''), test_jira_id=self.testcase.TEST_JIRA_ID
         )
+        self.init_loop_result_store()
+
+    def init_loop_result_store(self):
+        """ Save each test iteration result when it's appended if stream_results is set. """
+        if self.loop_result_store: self.loop_result_store.close()
+        self.loop_result_store = None
+        if not getattr(self.env, 'stream_results', False) or self.env.disable_save_result:
+            return
+        path_prefix = self.get_abs_path('{0}/{1}{2}'.format(self.env.results_folder, self.file_prefix, self.testcase.TEST_NAME))
+        self.loop_result_store = LoopResultStore(
+            journal_path='{}.jsonl'.format(path_prefix), junit_path=self.get_loop_results_path(),
+            summary_path='{}.summary.json'.format(path_prefix), suite_name=self.testcase.TEST_SUITE
+        )
+        self.loop_results.summary_index = self.loop_result_store.summary
+        self.env.log.info('Stream Loop Results To {}'.format(self.loop_result_store.journal_path))
 
     def append_loop_result(self):
         self.env.log.info('Append Test #{} To Loop Results.'.format(self.env.iteration))
         self.loop_results.append(self.test_result)
+        if self.loop_result_store:
+            try:
+                self.loop_result_store.append(self.test_result)
+            except Exception, e:
+                self.env.log.warning('Saving result to loop result store: {}'.format(e), exc_info=True)
+
+    def collect_http_stats(self):
+        """ Move HTTP stats of current iteration into test result and stats of entire test. """
+        stats = get_http_stats_recorder().pop()
+        self.http_stats.merge(stats)
+        if self.test_result is not None and stats.endpoints:
+            self.test_result['http_stats'] = stats.summary()
+
+    def collect_loop_http_stats(self):
+        """ Put HTTP stats of entire test into loop results. """
+        self.http_stats.merge(get_http_stats_recorder().pop())
+        if self.http_stats.endpoints and isinstance(getattr(self.loop_results, 'additional_dict', None), dict):
+            self.loop_results.additional_dict['http_stats'] = self.http_stats.summary()
+
+    def export_http_stats(self):
+        """ Save mergeable HTTP stats of entire test, stats of processes can be merged by merge_http_stats_files(). """
+        self.http_stats.merge(get_http_stats_recorder().pop())
+        log_stats = request_log_stats.to_dict()
+        if log_stats['logged'] or log_stats['sampled_out']:
+            self.env.log.info('Request Logging: {logged} calls logged, {sampled_out} calls sampled out, '
+                'took {seconds} sec'.format(**log_stats))
+        if not self.http_stats.endpoints:
+            return
+        export_path = self.get_abs_path('{0}/{1}{2}.http_stats.json'.format(
+            self.env.results_folder, self.file_prefix, self.testcase.TEST_NAME))
+        self.http_stats.save(export_path)
+        self.env.log.info('Save HTTP Stats To {}'.format(export_path))
 
     def upload_test_result(self):
         if not self.upload_logstash: return True
         try:
+            if self.result_sink:
+                self.env.log.info('Queue Result For Logstash: {}'.format(self.env.logstash_server_url))
+                self.result_sink.put_logstash(self.test_result.logstash_records(), server_url=self.env.logstash_server_url)
+                return True
             self.env.log.info('Update Result To Logstash: {}'.format(self.env.logstash_server_url))
             self.test_result.upload_to_logstash(server_url=self.env.logstash_server_url)
         except:
@@ -450,6 +514,10 @@ class ResultComponent(TestCaseComponent):
     def upload_loop_result(self):
         if not self.upload_logstash: return True
         try:
+            if self.result_sink:
+                self.env.log.info('Queue Loop Result For Logstash: {}'.format(self.env.logstash_server_url))
+                self.result_sink.put_logstash(self.loop_results.logstash_records(), server_url=self.env.logstash_server_url)
+                return True
             self.env.log.info('Update Loop Result To Logstash: {}'.format(self.env.logstash_server_url))
             self.loop_results.upload_to_logstash(server_url=self.env.logstash_server_url)
         except:
@@ -458,6 +526,8 @@ class ResultComponent(TestCaseComponent):
         return True
 
     def export_test_result(self):
+        if self.env.iteration and self.loop_result_store: # Saved by loop result store.
+            return
         if self.env.iteration: # run in loop
             if getattr(self.testcase, 'test_result_prefix', False) and self.testcase.test_result_prefix:
                 export_path = '{}/{}{}.json'.format(self.env.results_folder, self.testcase.test_result_prefix, self.env.iteration)
@@ -470,12 +540,19 @@ class ResultComponent(TestCaseComponent):
         self.test_result.to_file(export_path)
         self.env.log.info('Save Result To {}'.format(export_path))
 
-    def export_loop_results(self):
+    def get_loop_results_path(self):
         if getattr(self.testcase, 'loop_result_name', False) and self.testcase.loop_result_name:
             export_path = '{}/{}test_report.xml'.format(self.env.results_folder, self.testcase.loop_result_name)
         else:
             export_path = '{}/test_report.xml'.format(self.env.results_folder)
-        export_path = self.get_abs_path(export_path)
+        return self.get_abs_path(export_path)
+
+    def export_loop_results(self):
+        export_path = self.get_loop_results_path()
+        if self.loop_result_store: # Results are already saved.
+            self.loop_result_store.close()
+            self.env.log.info('Loop Results Are Saved In {}'.format(export_path))
+            return
         self.loop_results.to_file(export_path, output_format='junit-xml')
         self.env.log.info('Save Loop Results To {}'.format(export_path))
 
@@ -498,18 +575,40 @@ class ResultComponent(TestCaseComponent):
     def upload_loop_results_to_popcorn(self):
         self.upload_results_to_popcorn(self.loop_results)
 
-    def export_popcorn_report(self, test_results):
+    def _gen_popcorn_report(self, test_results):
         pr = gen_popcorn_report(self.testcase, test_results, self.env.popcorn_skip_error)
+        if self.http_stats.endpoints: pr['httpStats'] = self.http_stats.summary()
+        return pr
+
+    def export_popcorn_report(self, test_results):
+        pr = self._gen_popcorn_report(test_results)
         export_path = '{0}/{1}{2}.popcorn.json'.format(self.env.results_folder, self.file_prefix, self.testcase.TEST_NAME)
         export_path = self.get_abs_path(export_path)
         object_to_json_file(pr, export_path)
         self.env.log.info('Save Popcorn Result To {}'.format(export_path))
 
     def upload_results_to_popcorn(self, test_results):
-        pr = gen_popcorn_report(self.testcase, test_results, self.env.popcorn_skip_error)
+        pr = self._gen_popcorn_report(test_results)
+        if self.result_sink:
+            self.result_sink.put_popcorn(pr, source=self.testcase.POPCORN_SOURCE)
+            self.env.log.info('Results have been queued for popcorn server.')
+            return
         upload_popcorn_report_to_server(data=pr, source=self.testcase.POPCORN_SOURCE)
         self.env.log.info('Results have been uploaded to popcorn server.')
 
+    def flush_results(self):
+        """ Wait for the results queued in ResultSink to be uploaded. """
+        if not self.result_sink:
+            return
+        left = self.result_sink.flush(timeout=getattr(self.env, 'result_flush_timeout', None) or FLUSH_TIMEOUT)
+        stats = self.result_sink.get_stats()
+        if not stats['queued']:
+            return
+        self.env.log.info('Result Uploading: {uploaded} results uploaded by {posts} requests, {spooled} spooled, '
+            '{retried} retried, {dropped} dropped'.format(**stats))
+        if left:
+            self.env.log.warning('{} results are not uploaded, they are kept in {}'.format(left, self.result_sink.spool_path))
+
     def error_callback(self, exception):
         """ Callback function for handling test failed by exception. """
         self.env.debug_middleware and self.env.log.warning('Handle exception by error_callback()')
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+""" Implementation of sub-test scheduling on a pool of devices.
+
+Each device is a dict of arguments to overwrite for the sub-tests run on it, ex:
+    {"uut_ip": "10.0.0.2", "serial_server_ip": "10.0.0.100", "serial_server_port": "20002"}
+An empty dict means the UUT of integration test.
+
+Sub-tests are dealt to the queues of devices in order (or by the longest first packing with estimated time),
+a device runs the first ready sub-test in its own queue, and steals the last ready one from the longest queue of
+other devices when it has nothing to run. A sub-test with test group rules is ready only after the previous
+sub-tests of the matched groups are done.
+"""
+
+# std modules
+import json
+import threading
+from collections import deque
+# middleware modules
+import test_group as TG
+from mtbf import longest_first_packing
+
+
+# Field names of device tuple in command line: "uut_ip,serial_server_ip,serial_server_port,ssh_user,ssh_password,ssh_port"
+DEVICE_FIELDS = ('uut_ip', 'serial_server_ip', 'serial_server_port', 'ssh_user', 'ssh_password', 'ssh_port')
+
+
+#
+# Golbal Utilities
+#
+def parse_device(value):
+    """ Convert device tuple string to dict, empty fields are skipped. """
+    values = value.split(',')
+    if len(values) > len(DEVICE_FIELDS):
+        raise ValueError('Device "{}" has more than {} fields: {}'.format(value, len(DEVICE_FIELDS), DEVICE_FIELDS))
+    device = {}
+    for name, field in zip(DEVICE_FIELDS, values):
+        field = field.strip()
+        if not field:
+            continue
+        device[name] = int(field) if name == 'ssh_port' else field
+    return device
+
+def parse_device_pool(values=None, path=None):
+    """ Return device list from device tuple strings and/or JSON file of a list of device dicts. """
+    devices = []
+    if path:
+        with open(path, 'r') as f:
+            devices.extend(json.load(f))
+    for value in values or []:
+        devices.append(parse_device(value))
+    for device in devices:
+        if not isinstance(device, dict):
+            raise ValueError('Device should be a dict: {}'.format(device))
+    return devices
+
+def get_device_name(device):
+    return device.get('uut_ip') or 'UUT'
+
+def get_dependencies(testcases):
+    """ Return {index: [indexes of previous sub-tests which the test group rules of this sub-test depend on]}. """
+    dependencies = {}
+    for idx, testcase in enumerate(testcases):
+        dependencies[idx] = []
+        if not testcase['group']:
+            continue
+        for prev_idx, prev_testcase in enumerate(testcases[:idx]):
+            if not prev_testcase['group']:
+                continue
+            prev_groups = TG.get_groups(prev_testcase['group'])
+            if any(group.match(prev_groups) for group in testcase['group']):
+                dependencies[idx].append(prev_idx)
+    return dependencies
+
+
+class SubTestScheduler(object):
+    """ Work-stealing queues of sub-test indexes for devices. """
+
+    def __init__(self, testcases, devices, estimate=None):
+        """
+        :param estimate: Function to return estimated seconds of a sub-test. If it's supplied, sub-tests are
+                         dealt by the longest first packing instead of in order.
+        """
+        self.cond = threading.Condition()
+        self.dependencies = get_dependencies(testcases)
+        if estimate:
+            self.queues = [deque(packed) for packed in longest_first_packing(
+                xrange(len(testcases)), len(devices), lambda idx: estimate(testcases[idx]))]
+        else:
+            self.queues = [deque() for _ in devices]
+            for idx in xrange(len(testcases)):
+                self.queues[idx % len(devices)].append(idx)
+        self.running = set()
+        self.done = set()
+        self.stopped = False
+        self.stolen = 0
+
+    def _is_ready(self, idx):
+        return all(dep in self.done for dep in self.dependencies[idx])
+
+    def _pop_ready(self, queue, from_end=False):
+        for idx in (reversed(queue) if from_end else queue):
+            if self._is_ready(idx):
+                queue.remove(idx)
+                return idx
+        return None
+
+    def _steal(self, worker):
+        for queue in sorted(self.queues, key=len, reverse=True):
+            if queue is self.queues[worker]:
+                continue
+            idx = self._pop_ready(queue, from_end=True)
+            if idx is not None:
+                self.stolen += 1
+                return idx
+        return None
+
+    def next(self, worker):
+        """ Wait for a ready sub-test for the given worker, return its index or None if there is nothing to run. """
+        with self.cond:
+            while not self.stopped:
+                idx = self._pop_ready(self.queues[worker])
+                if idx is None:
+                    idx = self._steal(worker)
+                if idx is not None:
+                    self.running.add(idx)
+                    return idx
+                if not any(self.queues):
+                    return None
+                self.cond.wait()
+            return None
+
+    def finish(self, idx):
+        with self.cond:
+            self.running.discard(idx)
+            self.done.add(idx)
+            self.cond.notify_all()
+
+    def stop(self):
+        """ Not to dispatch any sub-test, the running ones keep going. """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def get_pending(self):
+        with self.cond:
+            return sorted(idx for queue in self.queues for idx in queue)
+
+    def get_running(self):
+        with self.cond:
+            return sorted(self.running)
+
+
+class RemoteSubTestLog(object):
+    """ Log replacement of sub-test instance which was run in worker process. """
+
+    def __init__(self, err_msg):
+        self.err_msg = err_msg
+
+    def gen_err_msg(self):
+        return self.err_msg
+
+
+class RemoteSubTestInstance(object):
+    """ Sub-test instance replacement which keeps the data integration test needs after the sub-test was run
+    in worker process.
+    """
+
+    def __init__(self, test_name, err_msg, device):
+        self.TEST_NAME = test_name
+        self.log = RemoteSubTestLog(err_msg)
+        self.device = device
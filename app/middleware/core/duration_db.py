@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+""" Implementation of test duration database.
+
+Elapsed time and pass state of each test run are kept in SQLite, and the statistics of each test name are used
+to estimate how long a test takes and how likely it fails:
+
+    db = DurationDB('durations.db')
+    db.record_results(integration_result) # or db.import_result_files(['output/results/Test-1-A.json'])
+    db.estimate('A') # Average elapsed seconds of passed runs.
+"""
+
+# std modules
+import json
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_ESTIMATE_SEC = 600 # Estimate of the test never run when there is no other data.
+FAILURE_WEIGHT = 4 # Weight of a test always failed is 1 + FAILURE_WEIGHT.
+
+
+class DurationStats(object):
+
+    def __init__(self, test_name, runs, failures, avg_sec, max_sec, min_sec, last_sec):
+        self.test_name = test_name
+        self.runs = runs
+        self.failures = failures
+        self.avg_sec = avg_sec # Of passed runs.
+        self.max_sec = max_sec
+        self.min_sec = min_sec
+        self.last_sec = last_sec # Of the last run no matter it's passed or not.
+
+    def fail_rate(self):
+        # Smoothed, so a test with a few runs is not judged by them only.
+        return float(self.failures) / (self.runs + 1)
+
+    def __repr__(self):
+        return 'DurationStats({}, runs={}, failures={}, avg={}, max={}, min={})'.format(
+            self.test_name, self.runs, self.failures, self.avg_sec, self.max_sec, self.min_sec)
+
+
+class DurationDB(object):
+
+    def __init__(self, db_file, timeout=60*5):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._stats = None # test_name: DurationStats, loaded at the first query.
+        self.conn = sqlite3.connect(db_file, timeout, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS durations (
+                    test_name TEXT, elapsed_sec REAL, test_pass INTEGER, build TEXT, recorded_at REAL
+                );
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS durations_test_name ON durations(test_name);")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    #
+    # Feeding
+    #
+    def record(self, test_name, elapsed_sec, test_pass, build=None):
+        """ Record one run. Skipped runs (test_pass is None) and runs without elapsed time are ignored. """
+        if test_pass is None or not elapsed_sec:
+            return False
+        with self._lock, self.conn:
+            self.conn.execute("INSERT INTO durations VALUES (?, ?, ?, ?, ?);",
+                (test_name, elapsed_sec, 1 if test_pass else 0, build, time.time()))
+            self._stats = None
+        return True
+
+    def record_results(self, results):
+        """ Record each test result in ResultList (e.g. IntegrationResult), return number of recorded runs. """
+        recorded = 0
+        for result in results:
+            if self.record(test_name=result.TEST_NAME, elapsed_sec=getattr(result, 'TEST_ELAPSED_SEC', None),
+                    test_pass=getattr(result, 'TEST_PASS', None), build=result.get('build')):
+                recorded += 1
+        return recorded
+
+    def import_result_files(self, paths):
+        """ Record the JSON result files (or JSON-lines journals of loop results) exported by test cases,
+        return number of recorded runs.
+        """
+        recorded = 0
+        for path in paths:
+            with open(path, 'r') as f:
+                if path.endswith('.jsonl'):
+                    data = [json.loads(line) for line in f if line.strip()]
+                else:
+                    data = json.load(f)
+            for result in (data if isinstance(data, list) else [data]):
+                if 'skipped_message' in result:
+                    continue
+                test_pass = not ('error_message' in result or 'failure_message' in result)
+                if self.record(test_name=result.get('testName'), elapsed_sec=result.get('elapsed_sec'),
+                        test_pass=test_pass, build=result.get('build')):
+                    recorded += 1
+        return recorded
+
+    #
+    # Statistics
+    #
+    def load_stats(self):
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT test_name, COUNT(*), SUM(1 - test_pass),
+                       AVG(CASE WHEN test_pass THEN elapsed_sec END),
+                       MAX(CASE WHEN test_pass THEN elapsed_sec END),
+                       MIN(CASE WHEN test_pass THEN elapsed_sec END),
+                       (SELECT elapsed_sec FROM durations AS d WHERE d.test_name = durations.test_name
+                        ORDER BY recorded_at DESC LIMIT 1)
+                FROM durations GROUP BY test_name;
+            """).fetchall()
+            self._stats = {row[0]: DurationStats(*row) for row in rows}
+        return self._stats
+
+    def get_stats(self, test_name):
+        if self._stats is None: self.load_stats()
+        return self._stats.get(test_name)
+
+    def get_all_stats(self):
+        if self._stats is None: self.load_stats()
+        return self._stats.values()
+
+    def estimate(self, test_name, default=None):
+        """ Return estimated elapsed seconds of test. For the test never passed, return the last elapsed time,
+        or average estimate of all tests if it's never run.
+        """
+        stats = self.get_stats(test_name)
+        if stats:
+            return stats.avg_sec or stats.last_sec
+        if default is not None:
+            return default
+        known = [s.avg_sec for s in self.get_all_stats() if s.avg_sec]
+        return sum(known) / len(known) if known else DEFAULT_ESTIMATE_SEC
+
+    def weight(self, test_name):
+        """ Weight of random choice, the test failed more often is chosen more often. """
+        stats = self.get_stats(test_name)
+        if not stats:
+            return 1 + FAILURE_WEIGHT * 0.5 # The test never run is treated as a half-failed one.
+        return 1 + FAILURE_WEIGHT * stats.fail_rate()
@@ -4,8 +4,16 @@
 __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 
 # std modules
+import datetime
+import multiprocessing
+import sys
+import threading
+import time
+import traceback
 from pprint import pformat
 # platform modules
+from platform_libraries.common_utils import logging_fork_guard, reinit_logging_locks
+from platform_libraries.http_stats import HTTPStats
 from platform_libraries.pyutils import ignore_unknown_codec, NoResult
 from platform_libraries.test_result import ELKTestResult, IntegrationResult, IntegrationLoopingResult
 from platform_libraries.junit_xml import TestSuite
@@ -14,7 +22,9 @@ import test_group as TG
 import middleware.dummy_case as dummy_case
 import middleware.error as error
 from middleware.component import TestCaseComponent, ResultComponent
-from mtbf import choice_generator, gen_testcases, unique_choice_generator, group_generator
+from device_pool import get_device_name, parse_device_pool, RemoteSubTestInstance, SubTestScheduler
+from duration_db import DurationDB
+from mtbf import choice_generator, gen_testcases, unique_choice_generator, group_generator, time_budget_generator
 from test_case import Settings, TestCase
 
 
@@ -50,6 +60,8 @@ class IntegrationExtensions(object):
                 self.device_log('*** Integration:after_test() Is Done.')
 
             self.data.test_result.summarize(print_out=True)
+            if self.duration_db:
+                self.duration_db.record_results(self.data.test_result)
              # always do after_test and export file.
             if not self.env.disable_save_result: self.data.export_test_result()
             self._upload_test_result()
@@ -64,10 +76,17 @@ class IntegrationExtensions(object):
         Execute each sub-test and handle test response.
         """
         def _gen_testcases():
-            if self.env.choice: # Return choice_generator and run sequential.
-                testcases = gen_testcases(choice_generator(self.integration.source_testcases, self.env.choice))
+            # Choose the tests failed more often more often.
+            weight = self._get_subtest_weight if self.env.weighted_choice and self.duration_db else None
+            if self.env.time_budget:
+                testcases = gen_testcases(time_budget_generator(
+                    self.integration.source_testcases, self.env.time_budget, self._estimate_subtest, weight))
+                self.log.info('Choose {} tests to fill {} sec, estimated time: {} sec'.format(
+                    len(testcases), self.env.time_budget, sum(self._estimate_subtest(ts) for ts in testcases)))
+            elif self.env.choice: # Return choice_generator and run sequential.
+                testcases = gen_testcases(choice_generator(self.integration.source_testcases, self.env.choice, weight))
             elif self.env.unique_choice:
-                testcases = gen_testcases(unique_choice_generator(self.integration.source_testcases, self.env.unique_choice))
+                testcases = gen_testcases(unique_choice_generator(self.integration.source_testcases, self.env.unique_choice, weight))
             else: # Return original testcases and run sequential.
                 testcases = self.integration.source_testcases
             # Add the group test cases back to self.integration.source_testcases
@@ -108,9 +127,14 @@ class IntegrationExtensions(object):
         # MTBF featute.
         self.integration.set_testcases(_gen_testcases())
 
+        if self.env.device_pool:
+            self._run_subtests_on_device_pool()
+            return
+
         for self.env.subtest_index, subtest in enumerate(self.integration.testcases, start=1):
             self.log.info('~'*75)
             self.device_log('*** Start sub-test #{}...'.format(self.env.subtest_index), force=True)
+            if self.duration_db: self._log_eta(self.integration.testcases[self.env.subtest_index-1:])
             self.integration.init_subtest(subtest)  # Create instances of sub-test. 
             self.integration.reder_subtest(subtest, self.env.subtest_index) # Add integration test information into sub-test.
             self._before_launch_subtest()
@@ -120,6 +144,147 @@ class IntegrationExtensions(object):
                 if self.env.stop_on_failure:
                     raise self.err.StopTest('Sub-test: {} is failed'.format(subtest['name']))
 
+    #
+    # Device Pool Area
+    #
+    def _run_subtests_on_device_pool(self):
+        """ Run sub-tests on the devices of pool in parallel, each sub-test is run in its own process. """
+        testcases = self.integration.testcases
+        devices = list(self.env.device_pool)
+        if getattr(self.env, 'uut_ip', None) not in [device.get('uut_ip') for device in devices]:
+            devices.insert(0, {}) # UUT of integration test.
+        for subtest in testcases: # Instances are created in worker processes.
+            subtest['instance'] = subtest['result'] = subtest['pass'] = None
+        scheduler = SubTestScheduler(testcases, devices, estimate=self._estimate_subtest if self.duration_db else None)
+        lock = threading.Lock()
+        finished = {} # index: subtest
+        errors = []
+        self.log.info('Run {} sub-tests on {} devices: {}'.format(
+            len(testcases), len(devices), [get_device_name(device) for device in devices]))
+
+        def worker(worker_idx):
+            device = devices[worker_idx]
+            try:
+                while True:
+                    idx = scheduler.next(worker_idx)
+                    if idx is None:
+                        return
+                    subtest = testcases[idx]
+                    try:
+                        self.device_log('*** Start sub-test #{} on {}...'.format(idx+1, get_device_name(device)), force=True)
+                        self._launch_subtest_in_process(subtest, idx+1, device)
+                        self.device_log('*** Sub-test #{} on {} is done: {}'.format(
+                            idx+1, get_device_name(device), subtest['pass']), force=True)
+                        with lock:
+                            finished[idx] = subtest
+                    finally:
+                        scheduler.finish(idx)
+                    if self.duration_db:
+                        self._log_eta([testcases[i] for i in scheduler.get_pending() + scheduler.get_running()], workers=len(devices))
+                    if subtest['pass'] is False and self.env.stop_on_failure:
+                        scheduler.stop()
+            except:
+                errors.append(sys.exc_info())
+                scheduler.stop()
+
+        threads = [threading.Thread(target=worker, args=(worker_idx,)) for worker_idx in xrange(len(devices))]
+        try:
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+        finally:
+            # Merge results in the order of sub-tests, not the order they finished.
+            for idx in sorted(finished):
+                self.data.append_subtest(finished[idx])
+            self.log.info('Device pool: {} sub-tests done, {} stolen by idle devices, {} not run'.format(
+                len(finished), scheduler.stolen, len(scheduler.get_pending())))
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        for idx in sorted(finished):
+            if finished[idx]['pass'] is False and self.env.stop_on_failure:
+                raise self.err.StopTest('Sub-test: {} is failed'.format(finished[idx]['name']))
+
+    def _launch_subtest_in_process(self, subtest, idx, device):
+        """ Run sub-test in a forked process, and update the result to subtest. """
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=self._run_subtest_in_worker, args=(subtest, idx, device, send_conn))
+        # Other workers keep logging while forking.
+        with logging_fork_guard():
+            process.start()
+        send_conn.close()
+        try:
+            payload = recv_conn.recv()
+        except EOFError: # Process is terminated without result.
+            payload = {'name': subtest['name'], 'pass': False,
+                'error': 'Worker process of sub-test #{} exited without result'.format(idx)}
+        finally:
+            recv_conn.close()
+            process.join()
+        if payload.get('error'):
+            self.log.error('Sub-test #{} on {}: {}'.format(idx, get_device_name(device), payload['error']))
+        subtest['name'] = payload['name']
+        subtest['result'] = payload.get('result')
+        subtest['pass'] = payload['pass']
+        subtest['instance'] = RemoteSubTestInstance(
+            test_name=payload['name'], err_msg=payload.get('err_msg') or payload.get('error', ''), device=device)
+        if subtest['result'] is None: # Sub-test crashed before it generated result.
+            result = ELKTestResult(test_suite=self.TEST_SUITE, test_name=subtest['name'],
+                build=self.data.test_result.TEST_BUILD, error_message=payload.get('error'))
+            result.TEST_PASS = False
+            subtest['result'] = result
+
+    def _run_subtest_in_worker(self, subtest, idx, device, conn):
+        """ Entry of worker process. Library instances of integration test are not shared, because the
+        connections they hold belong to parent process, sub-test creates its own ones to the given device.
+        """
+        reinit_logging_locks() # Locks may be held by other threads of parent.
+        payload = {'name': subtest['name'], 'pass': False}
+        try:
+            for name, value in device.iteritems():
+                setattr(self.env, name, value)
+            for lib_name in self.SETTINGS:
+                if getattr(self, lib_name, None) is not None and not isinstance(getattr(self, lib_name), (bool, int, str)):
+                    setattr(self, lib_name, None)
+            self.utils.utils_to_close = [] # Only close the ones created in this process.
+            self.utils.utils_to_update_ip = []
+            self.env.subtest_index = idx
+            self.integration.current_idx = idx - 1 # Test group checks the previous sub-tests only.
+            self.integration.init_subtest(subtest)
+            self.integration.reder_subtest(subtest, idx)
+            self._before_launch_subtest()
+            payload['pass'] = subtest.launch()
+            payload['name'] = subtest['name']
+            payload['result'] = subtest['result']
+            payload['err_msg'] = subtest['instance'].log.gen_err_msg()
+        except:
+            payload['error'] = traceback.format_exc()
+        try:
+            conn.send(payload)
+        except Exception: # Result is not picklable.
+            payload.pop('result', None)
+            payload['error'] = '{}\n{}'.format(payload.get('error', ''), traceback.format_exc())
+            conn.send(payload)
+        finally:
+            conn.close()
+
+    #
+    # Duration Estimation Area
+    #
+    def _get_subtest_name(self, subtest):
+        return (subtest['custom_env'] or {}).get('TEST_NAME') or subtest['name']
+
+    def _estimate_subtest(self, subtest):
+        return self.duration_db.estimate(self._get_subtest_name(subtest))
+
+    def _get_subtest_weight(self, subtest):
+        return self.duration_db.weight(self._get_subtest_name(subtest))
+
+    def _log_eta(self, testcases, workers=1):
+        """ Print estimated time to finish the given sub-tests. """
+        remaining_sec = sum(self._estimate_subtest(subtest) for subtest in testcases) / workers
+        self.log.info('ETA: {} sub-tests left, about {} to finish at {}'.format(
+            len(testcases), datetime.timedelta(seconds=int(remaining_sec)),
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining_sec))))
+
     #
     # MiddleWare Hooks Area
     #
@@ -133,6 +298,8 @@ class IntegrationExtensions(object):
                 msgs = ''
                 for iteration_index, testcases in enumerate(self.integration.loop_testcases, start=1):
                     for subtest_index, subtest in enumerate(testcases, start=1):
+                        if not subtest['instance']: # Not run.
+                            continue
                         err_msg = subtest['instance'].log.gen_err_msg()
                         if err_msg:
                             msgs += '[{3}#{0} {1}]\n{2}\n'.format(
@@ -161,6 +328,12 @@ class IntegrationExtensions(object):
             target_inst.unique_choice = kwargs.get('unique_choice', None)
             target_inst.exec_ordering = kwargs.get('exec_ordering', None)
             target_inst.exec_group = kwargs.get('exec_group', None)
+            target_inst.device_pool = parse_device_pool(kwargs.get('device_pool'), kwargs.get('device_pool_file'))
+            target_inst.duration_db_file = kwargs.get('duration_db', None)
+            target_inst.time_budget = kwargs.get('time_budget', None)
+            target_inst.weighted_choice = kwargs.get('weighted_choice', False)
+            if target_inst.time_budget and not target_inst.duration_db_file:
+                raise ValueError('time_budget needs duration_db to estimate test time')
 
         def init_integration_components(self, of_inst):
             """ Initiate components """
@@ -169,6 +342,7 @@ class IntegrationExtensions(object):
             target_inst.dummy_case = dummy_case
             target_inst.integration = IntegrationComponent(testcase_inst=target_inst)
             target_inst.testgroup = TG
+            target_inst.duration_db = DurationDB(db_file=self.duration_db_file) if self.duration_db_file else None
 
         # Overwrite it replace Overwrite dump_to_dict.
         def _extend_hook_of_dump_to_dict(self, settings):
@@ -177,6 +351,10 @@ class IntegrationExtensions(object):
             settings.pop('choice', None)
             settings.pop('unique_choice', None)
             settings.pop('exec_ordering', None)
+            settings.pop('device_pool', None)
+            settings.pop('duration_db_file', None)
+            settings.pop('time_budget', None)
+            settings.pop('weighted_choice', None)
 
 
 class IntegrationResultComponent(ResultComponent):
@@ -186,8 +364,11 @@ class IntegrationResultComponent(ResultComponent):
         self.init_worksapce()
         self.test_result = None # "IntegrationResult" object to record the test result on the current iteration.
         self.loop_results = None # "ResultList" object to append each test iteration result.
+        self.loop_result_store = None # Not supported, results of sub-tests are not saved one by one.
         self.file_prefix = '' # Prefix part of output file name.
         self.upload_logstash = True
+        self.http_stats = HTTPStats() # HTTP stats of entire test.
+        self.init_result_sink()
 
     def reset_test_result(self):
         self.env.log.info('Reset Test Result.')
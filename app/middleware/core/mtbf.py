@@ -3,9 +3,14 @@
 """
 
 # std modules
+import bisect
+import heapq
 import random
 
 
+MIN_ESTIMATE_SEC = 1 # Min estimated seconds of a test case, not to choose too many cases by a tiny estimate.
+
+
 def gen_total_number(testcases, random_num):
     if isinstance(random_num, int):
         return random_num
@@ -14,29 +19,71 @@ def gen_total_number(testcases, random_num):
     # "all"
     return len(testcases)
 
-def choice_generator(testcases, random_num):
-    total_number = gen_total_number(testcases, random_num)
-    for idx in xrange(total_number):
-        yield random.choice(testcases)
+def testcase_key(testcase):
+    """ Hashable key of the sub-test which equals for equal sub-tests. """
+    return (testcase['class'], testcase['name'], repr(testcase['custom_env']), repr(testcase['group']))
 
-def unique_choice_generator(testcases, random_num):
-    # Estimate testcases length.
+def unique_testcases(testcases):
+    unique_keys = set()
     unique_list = []
     for ts in testcases:
-        if ts not in unique_list:
+        key = testcase_key(ts)
+        if key not in unique_keys:
+            unique_keys.add(key)
             unique_list.append(ts)
-    max_num = len(unique_list)
-    # Unique choice.
+    return unique_list
+
+def weighted_choice(testcases, weight=None):
+    """ Return index of a random test case, chosen in proportion to weight(testcase) if weight is supplied. """
+    if not weight:
+        return random.randrange(len(testcases))
+    cumulative = []
+    total = 0
+    for ts in testcases:
+        total += weight(ts)
+        cumulative.append(total)
+    return min(bisect.bisect_right(cumulative, random.random() * total), len(testcases) - 1)
+
+def choice_generator(testcases, random_num, weight=None):
     total_number = gen_total_number(testcases, random_num)
-    if total_number > max_num:
-        total_number = max_num
-    run_tests = []
     for idx in xrange(total_number):
-        testcase = random.choice(testcases)
-        while testcase in run_tests:
-            testcase = random.choice(testcases)
-        run_tests.append(testcase)
-        yield testcase
+        yield testcases[weighted_choice(testcases, weight)]
+
+def unique_choice_generator(testcases, random_num, weight=None):
+    unique_list = unique_testcases(testcases)
+    # Unique choice.
+    total_number = min(gen_total_number(testcases, random_num), len(unique_list))
+    for idx in xrange(total_number):
+        yield unique_list.pop(weighted_choice(unique_list, weight))
+
+def time_budget_generator(testcases, budget_sec, estimate, weight=None, min_estimate=MIN_ESTIMATE_SEC):
+    """ Randomly choose test cases until the total estimated time fills budget_sec.
+
+    :param estimate: Function to return estimated seconds of a test case.
+    :param min_estimate: Estimate less than it (e.g. 0 for a test which failed at once) is raised to it.
+    """
+    candidates = list(testcases)
+    total_sec = 0
+    while candidates:
+        idx = weighted_choice(candidates, weight)
+        duration = max(estimate(candidates[idx]), min_estimate)
+        if total_sec + duration > budget_sec: # Never choose it again since it can't fit in the rest time.
+            candidates.pop(idx)
+            continue
+        total_sec += duration
+        yield candidates[idx]
+
+def longest_first_packing(items, bins, estimate):
+    """ Assign items to bins, the longest one first to the bin with least total time.
+    Return list of item lists, items in each bin are in the longest first order.
+    """
+    packed = [[] for _ in xrange(bins)]
+    loads = [(0, idx) for idx in xrange(bins)]
+    for item in sorted(items, key=estimate, reverse=True):
+        load, idx = heapq.heappop(loads)
+        packed[idx].append(item)
+        heapq.heappush(loads, (load + estimate(item), idx))
+    return packed
 
 def gen_testcases(generator):
     return [ts for ts in generator]
@@ -49,4 +96,4 @@ def group_generator(testcases, original_source_testcases, exec_group):
             print original_source_testcases[idx]
             testcases.insert(index_point, original_source_testcases[idx])
             index_point = random.randint(index_point+1, len(testcases))
-    return testcases
\ No newline at end of file
+    return testcases
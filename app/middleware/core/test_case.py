@@ -105,6 +105,7 @@ class TestCase(TestCaseTemplate):
             raise
         finally: # always do export file and upload result.
             self.data.test_result.summarize(print_out=False)
+            self.data.collect_http_stats()
             if not self.env.disable_save_result: self.data.export_test_result()
             self._upload_test_result()
             if not self.env.disable_popcorn_report:
@@ -156,6 +157,7 @@ class TestCase(TestCaseTemplate):
             raise
         finally:
             self.data.loop_results.summarize(print_out=False)
+            self.data.collect_loop_http_stats()
              # always do export file.
             if not self.env.disable_save_result: self.data.export_loop_results()
             self._upload_loop_result()
@@ -255,6 +257,16 @@ class TestCase(TestCaseTemplate):
         #self.log.print_test_steps()
         if not self.env.disable_print_errors:
             self.log.print_errors()
+        # Save HTTP stats of entire test.
+        if getattr(self, 'data', None) and not self.env.disable_save_result:
+            try:
+                self.data.export_http_stats()
+            except Exception, e:
+                self.env.log.warning('Saving HTTP stats: {}'.format(e), exc_info=True)
+        # Logs lost by logging pipeline.
+        log_stats = common_utils.flush_logs()
+        if log_stats['dropped'] or log_stats['throttled']:
+            self.env.log.warning('Logging: {dropped} records dropped by full queue, {throttled} records throttled'.format(**log_stats))
         # Close all utilities if it needs.
         if not getattr(self, 'utils', None):
             return
@@ -300,6 +312,11 @@ class TestCase(TestCaseTemplate):
 
     def finally_of_exit_test(self):
         # Behavior extendion after test exited.
+        if getattr(self, 'data', None): # Results uploaded in background should be done before exiting.
+            try:
+                self.data.flush_results()
+            except Exception, e:
+                self.env.log.error(e, exc_info=True)
         if self.env.disable_upload_logs:
             return
         try:
@@ -418,6 +435,11 @@ class TestCase(TestCaseTemplate):
             common_utils.STREAM_LOG_LEVEL = kwargs.get('stream_log_level')
             # Update @logger class logs.
             update_stream_handlers()
+            # Move all loggers to background writing.
+            if kwargs.get('log_pipeline'):
+                common_utils.enable_log_pipeline(
+                    max_bytes=kwargs['log_max_mb']*1024*1024 if kwargs.get('log_max_mb') else None,
+                    rate_limit=kwargs.get('log_rate_limit'))
             # Init logging for Environment.
             log_inst = create_logger(log_name='middleware', stream_log_level=common_utils.STREAM_LOG_LEVEL)
             self.log = copy.copy(log_inst) # Copy it for TestStep feature in the same name test.
@@ -504,6 +526,7 @@ class TestCase(TestCaseTemplate):
             target_inst.disable_loop = self.testcase.SETTINGS.get('disable_loop', False) # (NOT IN input args) Control flag to disable loop test.
             target_inst.disable_upload_logs = kwargs.get('disable_upload_logs', False) # Control flag to not upload output folder to server.
             target_inst.disable_save_result = kwargs.get('disable_save_result', False) # Control flag to not save test result to file.
+            target_inst.stream_results = kwargs.get('stream_results', False) # Control flag to save each loop result when it's done.
             target_inst.disable_print_errors = kwargs.get('disable_print_errors', False) # Control flag to not print test errors at end of tests.
             target_inst.debug_middleware = kwargs.get('debug_middleware') # Control flag to print debug message of middleware.
             target_inst.dry_run = kwargs.get('dry_run') # Control flag to upload test result to logstash.
@@ -515,6 +538,9 @@ class TestCase(TestCaseTemplate):
             target_inst = of_inst
             # UUT and Test settings
             target_inst.logstash_server_url = kwargs.get('logstash_server_url') or LOGSTASH_SERVER_TW
+            target_inst.async_result_upload = kwargs.get('async_result_upload', False) # Upload results in background.
+            target_inst.result_spool_path = kwargs.get('result_spool_path') # File to keep results failed to upload.
+            target_inst.result_flush_timeout = kwargs.get('result_flush_timeout') # Seconds to wait for uploading at exit.
             target_inst.loop_times = kwargs.get('loop_times')
             target_inst.loop_times_from = kwargs.get('loop_times_from', 1)
             # Folder Paths
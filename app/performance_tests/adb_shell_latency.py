@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+""" Compare per-call latency of ADB shell command between "adb" subprocess and native ADB client.
+"""
+# std modules
+import sys
+import threading
+import time
+# platform modules
+from middleware.arguments import InputArgumentParser
+from middleware.test_case import TestCase
+from platform_libraries.histogram import LatencyHistogram
+
+
+class ADBShellLatency(TestCase):
+
+    TEST_SUITE = 'ADB_Performance_Tests'
+    TEST_NAME = 'ADB_Shell_Latency'
+
+    def before_test(self):
+        if not self.adb.adb_client:
+            raise self.err.TestSkipped('Native ADB client is not connected')
+
+    def run_calls(self, native, calls):
+        latency = LatencyHistogram()
+        for _ in xrange(calls):
+            start_time = time.time()
+            self.adb.executeShellCommand(self.command, consoleOutput=False, native=native)
+            latency.record(time.time() - start_time)
+        return latency
+
+    def run_concurrent_calls(self, threads, calls):
+        """ Return (latency histogram, calls per second) of native calls from several threads. """
+        latency = LatencyHistogram()
+        lock = threading.Lock()
+        errors = []
+
+        def worker():
+            try:
+                worker_latency = self.run_calls(native=True, calls=calls)
+                with lock:
+                    latency.merge(worker_latency)
+            except:
+                errors.append(sys.exc_info())
+
+        start_time = time.time()
+        workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+        for worker_thread in workers: worker_thread.start()
+        for worker_thread in workers: worker_thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return latency, threads * calls / (time.time() - start_time)
+
+    def record(self, name, latency):
+        summary = latency.summary(percents=(50, 95, 99))
+        for key in ('mean', 'p50', 'p95', 'p99', 'max'):
+            self.data.test_result['{}_{}_ms'.format(name, key)] = round(summary[key] * 1000, 3)
+        self.log.info('{}: {}'.format(name, summary))
+
+    def test(self):
+        self.run_calls(native=True, calls=5) # Warm up.
+        subprocess_latency = self.run_calls(native=False, calls=self.calls)
+        native_latency = self.run_calls(native=True, calls=self.calls)
+        concurrent_latency, calls_per_sec = self.run_concurrent_calls(threads=self.threads, calls=self.calls)
+        self.record('subprocess', subprocess_latency)
+        self.record('native', native_latency)
+        self.record('native_concurrent', concurrent_latency)
+        self.data.test_result['native_concurrent_calls_per_sec'] = round(calls_per_sec, 2)
+        self.data.test_result['speedup_p50'] = round(subprocess_latency.percentile(50) / native_latency.percentile(50), 2)
+
+
+if __name__ == '__main__':
+    parser = InputArgumentParser("""\
+        *** ADB Shell Latency Benchmark on Kamino Android ***
+        Examples: ./run.sh performance_tests/adb_shell_latency.py --uut_ip 192.168.1.45 --calls 200\
+        """)
+    # Test Arguments
+    parser.add_argument('--command', help='Shell command to run', default='true')
+    parser.add_argument('--calls', help='Calls of each path', type=int, default=200)
+    parser.add_argument('--threads', help='Threads of concurrent native calls', type=int, default=8)
+
+    test = ADBShellLatency(parser)
+    resp = test.main()
+    if resp:
+        sys.exit(0)
+    sys.exit(1)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+""" Native client of ADB server protocol.
+
+Commands are sent to the ADB server (the one "adb connect" uses, local or "-H host -P port") through its socket
+protocol instead of forking an "adb" process for each call. The server keeps the connection to the device, each
+call opens one socket to the server, so calls from different threads run concurrently:
+
+    client = AdbClient(serial='192.168.1.10:5555')
+    stdout, stderr, exit_code = client.shell('getprop ro.build.version.release')
+    client.push('local.bin', '/data/local/tmp/remote.bin')
+
+Shell protocol v2 is used if device supports it, which returns stderr and exit code separately.
+Otherwise stdout and stderr are merged and exit code is None.
+"""
+# std modules
+import os
+import socket
+import stat
+import struct
+import time
+
+# platform modules
+import common_utils
+from platform_libraries.histogram import LatencyHistogram
+
+
+#
+# Protocol Constants
+#
+SYNC_DATA_MAX = 64 * 1024
+SHELL_STDIN = 0
+SHELL_STDOUT = 1
+SHELL_STDERR = 2
+SHELL_EXIT = 3
+SHELL_CLOSE_STDIN = 4
+
+
+class AdbProtocolError(Exception):
+    pass
+
+
+class AdbConnection(object):
+    """ One socket to ADB server. """
+
+    def __init__(self, host, port, timeout, deadline=None):
+        """
+        :param deadline: Epoch time to stop reading, socket.timeout is raised after it.
+        """
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.deadline = deadline
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def recv(self, size=SYNC_DATA_MAX):
+        if self.deadline:
+            left = self.deadline - time.time()
+            if left <= 0:
+                raise socket.timeout('timed out')
+            self.sock.settimeout(left)
+        return self.sock.recv(size)
+
+    def read_exactly(self, size):
+        chunks = []
+        while size:
+            data = self.recv(size)
+            if not data:
+                raise AdbProtocolError('Connection is closed by ADB server')
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+
+    def read_until_close(self):
+        chunks = []
+        while True:
+            data = self.recv()
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+
+    def read_hex_string(self):
+        return self.read_exactly(int(self.read_exactly(4), 16))
+
+    def request(self, service):
+        """ Send service request to server and check its status. """
+        self.send('{:04x}{}'.format(len(service), service))
+        status = self.read_exactly(4)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            raise AdbProtocolError('{}: {}'.format(service, self.read_hex_string()))
+        raise AdbProtocolError('{}: unexpected status {}'.format(service, repr(status)))
+
+
+@common_utils.logger()
+class AdbClient(object):
+
+    def __init__(self, serial, server_host='127.0.0.1', server_port=5037, timeout=60):
+        """
+        :param serial: Device serial in ADB server, ex: "192.168.1.10:5555".
+        :param server_host: Host of ADB server.
+        :param server_port: Port of ADB server.
+        :param timeout: Default seconds to wait for data from server.
+        """
+        self.serial = serial
+        self.server_host = server_host
+        self.server_port = int(server_port)
+        self.timeout = timeout
+        self._features = None
+        self.latency = LatencyHistogram() # Latency of shell calls.
+
+    def _connect(self, timeout=None):
+        timeout = timeout or self.timeout
+        return AdbConnection(self.server_host, self.server_port, timeout, deadline=time.time() + timeout)
+
+    def _open_service(self, service, timeout=None):
+        conn = self._connect(timeout)
+        try:
+            conn.request('host:transport:{}'.format(self.serial))
+            conn.request(service)
+        except:
+            conn.close()
+            raise
+        return conn
+
+    def get_features(self):
+        """ Return feature list of device, ex: ['shell_v2', 'cmd', 'stat_v2'] """
+        if self._features is None:
+            with self._connect() as conn:
+                conn.request('host-serial:{}:features'.format(self.serial))
+                self._features = conn.read_hex_string().split(',')
+        return self._features
+
+    def support_shell_v2(self):
+        return 'shell_v2' in self.get_features()
+
+    def get_state(self):
+        """ Return state of device in ADB server, ex: "device" or "offline". """
+        with self._connect() as conn:
+            conn.request('host-serial:{}:get-state'.format(self.serial))
+            return conn.read_hex_string()
+
+    #
+    # Shell
+    #
+    def shell(self, command, timeout=None):
+        """ Run command and return (stdout, stderr, exit_code).
+
+        :param timeout: Seconds to wait for the command, socket.timeout is raised if it's exceeded.
+        """
+        start_time = time.time()
+        if self.support_shell_v2():
+            stdout, stderr, exit_code = [], [], None
+            for stream_id, data in self._iter_shell_v2(command, timeout):
+                if stream_id == SHELL_STDOUT:
+                    stdout.append(data)
+                elif stream_id == SHELL_STDERR:
+                    stderr.append(data)
+                elif stream_id == SHELL_EXIT:
+                    exit_code = ord(data[0])
+            result = ''.join(stdout), ''.join(stderr), exit_code
+        else:
+            with self._open_service('shell:{}'.format(command), timeout) as conn:
+                result = conn.read_until_close(), '', None
+        self.latency.record(time.time() - start_time)
+        return result
+
+    def shell_stream(self, command, timeout=None):
+        """ Run command and yield stdout data as soon as it's received. """
+        if self.support_shell_v2():
+            for stream_id, data in self._iter_shell_v2(command, timeout):
+                if stream_id == SHELL_STDOUT:
+                    yield data
+            return
+        with self._open_service('shell:{}'.format(command), timeout) as conn:
+            while True:
+                data = conn.recv()
+                if not data:
+                    return
+                yield data
+
+    def _iter_shell_v2(self, command, timeout):
+        """ Yield (stream ID, data) of shell protocol v2 packets. """
+        with self._open_service('shell,v2,raw:{}'.format(command), timeout) as conn:
+            conn.send(struct.pack('<BI', SHELL_CLOSE_STDIN, 0)) # No stdin, or commands reading stdin will hang.
+            while True:
+                try:
+                    header = conn.read_exactly(5)
+                except AdbProtocolError: # Closed after exit packet.
+                    return
+                stream_id, length = struct.unpack('<BI', header)
+                yield stream_id, conn.read_exactly(length) if length else ''
+                if stream_id == SHELL_EXIT:
+                    return
+
+    #
+    # Sync Service
+    #
+    def _sync_request(self, conn, command, data=''):
+        conn.send(command + struct.pack('<I', len(data)) + data)
+
+    def _sync_fail(self, conn, path):
+        length = struct.unpack('<I', conn.read_exactly(4))[0]
+        raise AdbProtocolError('{}: {}'.format(path, conn.read_exactly(length)))
+
+    def stat(self, remote):
+        """ Return (mode, size, mtime) of remote path, mode is 0 if it doesn't exist.
+        Symlink is not followed (lstat), see stat_follow().
+        """
+        with self._open_service('sync:') as conn:
+            self._sync_request(conn, 'STAT', remote)
+            response = conn.read_exactly(16)
+            if response[:4] != 'STAT':
+                raise AdbProtocolError('{}: unexpected response {}'.format(remote, repr(response[:4])))
+            return struct.unpack('<III', response[4:])
+
+    def stat_follow(self, remote):
+        """ stat() which follows symlink to folder by stat "path/". Symlink to others is still returned as symlink. """
+        result = self.stat(remote)
+        if stat.S_ISLNK(result[0]):
+            folder_result = self.stat(remote.rstrip('/') + '/')
+            if stat.S_ISDIR(folder_result[0]):
+                return folder_result
+        return result
+
+    def push(self, local, remote, mode=None, timeout=None):
+        """ Copy local file to remote path (file path, not folder), return bytes sent. """
+        if mode is None:
+            mode = stat.S_IMODE(os.stat(local).st_mode)
+        sent = 0
+        with self._open_service('sync:', timeout) as conn:
+            self._sync_request(conn, 'SEND', '{},{}'.format(remote, stat.S_IFREG | mode))
+            with open(local, 'rb') as f:
+                while True:
+                    data = f.read(SYNC_DATA_MAX)
+                    if not data:
+                        break
+                    self._sync_request(conn, 'DATA', data)
+                    sent += len(data)
+            conn.send('DONE' + struct.pack('<I', int(os.path.getmtime(local))))
+            status = conn.read_exactly(4)
+            if status == 'FAIL':
+                self._sync_fail(conn, remote)
+            conn.read_exactly(4)
+            self._sync_request(conn, 'QUIT')
+        return sent
+
+    def pull(self, remote, local, timeout=None):
+        """ Copy remote file to local path (file path, not folder), return bytes received.
+        Data is written to a temporary file which replaces local path after it's done.
+        """
+        tmp_path = '{}.{}.part'.format(local, os.getpid())
+        try:
+            received = self._pull(remote, tmp_path, timeout)
+            os.rename(tmp_path, local)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        return received
+
+    def _pull(self, remote, local, timeout=None):
+        received = 0
+        with self._open_service('sync:', timeout) as conn:
+            self._sync_request(conn, 'RECV', remote)
+            with open(local, 'wb') as f:
+                while True:
+                    command = conn.read_exactly(4)
+                    if command == 'DONE':
+                        conn.read_exactly(4)
+                        break
+                    if command == 'FAIL':
+                        self._sync_fail(conn, remote)
+                    if command != 'DATA':
+                        raise AdbProtocolError('{}: unexpected response {}'.format(remote, repr(command)))
+                    length = struct.unpack('<I', conn.read_exactly(4))[0]
+                    f.write(conn.read_exactly(length))
+                    received += length
+            self._sync_request(conn, 'QUIT')
+        return received
@@ -1,6 +1,7 @@
 __author__ = 'Kurt Jensen <kurt.jensen@wdc.com>'
 
 import shlex # to split shell commands
+import socket
 import subprocess32 as subprocess # subprocess module ported from python 3.2 with support for timeout exceptions
 from subprocess32 import Popen, PIPE
 import os
@@ -10,9 +11,12 @@ import traceback
 import logging
 import common_utils
 import re
+import stat
 import constants
 from shell_cmds import ShellCommands
 from pyutils import NotSet
+from adb_protocol import AdbClient
+from remote_hash import RemoteHasher
 
 
 def count_nested_calls():
@@ -80,7 +84,8 @@ def resend_on_failure(executeCommand):
 # ADB class to connect to device with ADB over TCP and execute commands
 class ADB(ShellCommands):
 
-    def __init__(self, adbServer=None, adbServerPort=None, uut_ip=None, port='5555', log_name=None, stream_log_level=None, retry_with_reboot_device=False):
+    def __init__(self, adbServer=None, adbServerPort=None, uut_ip=None, port='5555', log_name=None, stream_log_level=None, retry_with_reboot_device=False,
+            use_native_client=True):
         if adbServer and adbServerPort:
             self.adbServer = adbServer
             self.adbServerPort = str(adbServerPort)
@@ -93,6 +98,12 @@ class ADB(ShellCommands):
         self.log = common_utils.create_logger(overwrite=False, log_name=log_name, stream_log_level=stream_log_level)
         self.prefix_command = self.gen_prefix_command()
         self.retry_with_reboot_device = retry_with_reboot_device
+        # Talk to ADB server by socket instead of forking "adb" for shell/push/pull after connected.
+        self.use_native_client = use_native_client
+        self.adb_client = None
+        # Batched file hashing with cache of unchanged files.
+        self.hasher = RemoteHasher(
+            run_cmd=lambda cmd, timeout=60*30: self.executeShellCommand(cmd, consoleOutput=False, timeout=timeout)[0])
 
     def set_serial_client(self, serial_client):
         self.log.debug('Set serial_client: {}'.format(serial_client))
@@ -127,6 +138,7 @@ class ADB(ShellCommands):
         # Change IP
         self.uut_ip = ip
         self.prefix_command = self.gen_prefix_command()
+        self.adb_client = None
         # Recovery connection
         if need_to_recovery_connection:
             self.connect()
@@ -191,6 +203,10 @@ class ADB(ShellCommands):
         else:
             self.log.debug(stdout.strip())
             self.connected = True
+            if self.use_native_client:
+                self.adb_client = AdbClient(serial='{}:{}'.format(self.uut_ip, self.port),
+                    server_host=self.adbServer if self.remoteServer else '127.0.0.1',
+                    server_port=self.adbServerPort if self.remoteServer else 5037)
             return stdout, stderr
 
     def disconnect(self, timeout=60):
@@ -202,6 +218,7 @@ class ADB(ShellCommands):
                 cmd = 'adb disconnect ' + self.uut_ip + ':' + self.port
             stdout, stderr = self.executeCommand(cmd=cmd, timeout=timeout)
             self.connected = False
+            self.adb_client = None
             self.log.debug(stdout)
             self.log.info('Device disconnected')
         else:
@@ -210,6 +227,7 @@ class ADB(ShellCommands):
     def disconnect_all(self, timeout=60):
         stdout, stderr = self.executeCommand(cmd='adb disconnect', timeout=timeout)
         self.connected = False
+        self.adb_client = None
         self.log.debug(stdout)
         self.log.info('Device disconnected')
 
@@ -230,6 +248,10 @@ class ADB(ShellCommands):
 
     def push(self, local=None, remote=None, timeout=60):
         """ adb push command to copy file from local host to remote connected device """
+        if self.adb_client and os.path.isfile(local):
+            mode = self.adb_client.stat_follow(remote)[0]
+            if not mode or stat.S_ISDIR(mode) or stat.S_ISREG(mode): # Others (ex: symlink to file) are pushed by adb command.
+                return self.native_push(local=local, remote=remote, timeout=timeout, remote_mode=mode)
         if self.remoteServer:
             cmd = 'adb -H {0} -P {1} -s {2}:{3} push {4} {5}'.format(self.adbServer, self.adbServerPort, self.uut_ip, self.port, local, remote)
         else:
@@ -239,6 +261,9 @@ class ADB(ShellCommands):
 
     def pull(self, remote=None, local=None, timeout=60):
         """ adb pull command to copy file from remote connected device to local machine """
+        # Only regular file is pulled by native client, others (folder, symlink...) are pulled by adb command.
+        if self.adb_client and stat.S_ISREG(self.adb_client.stat(remote)[0]):
+            return self.native_pull(remote=remote, local=local, timeout=timeout)
         if self.remoteServer:
             cmd = 'adb -H {0} -P {1} -s {2}:{3} push {4} {5}'.format(self.adbServer, self.adbServerPort, self.uut_ip, self.port, remote, local)
         else:
@@ -280,8 +305,16 @@ class ADB(ShellCommands):
         cmd = self.prefix_command.format('logcat -c{}'.format(buffer_str))
         self.executeCommand(cmd=cmd, timeout=timeout)
 
-    def executeShellCommand(self, cmd=None, timeout=60, consoleOutput=True, _no_resend=False, _resend_when_timeout=False):
-        """ Execute shell command on adb connected device """
+    def executeShellCommand(self, cmd=None, timeout=60, consoleOutput=True, _no_resend=False, _resend_when_timeout=False,
+            native=True):
+        """ Execute shell command on adb connected device
+
+        :param native: Send command with native ADB client if it's connected, set False to run "adb" command.
+        """
+        if native and self.adb_client:
+            return self.native_execute(cmd=cmd, timeout=timeout, consoleOutput=consoleOutput,
+                _no_resend=_no_resend, _resend_when_timeout=_resend_when_timeout # privare args.
+            )
         if self.remoteServer:
             cmd = 'adb -H {0} -P {1} -s {2}:{3} shell "{4}"'.format(self.adbServer, self.adbServerPort, self.uut_ip, self.port, cmd)
         else:
@@ -295,6 +328,51 @@ class ADB(ShellCommands):
     def retry_execute(self, cmd=None, consoleOutput=True, stdout=PIPE, stderr=PIPE, timeout=60):
         return self.executeCommand(cmd, consoleOutput, stdout, stderr, timeout)
 
+    #
+    # Native ADB Client
+    #
+    @staticmethod
+    def to_shell_command(cmd):
+        """ Return the command device gets from 'adb shell "cmd"', which is split by local shell and joined by adb. """
+        return ' '.join(shlex.split('"{}"'.format(cmd)))
+
+    @resend_on_failure
+    def native_execute(self, cmd=None, consoleOutput=True, timeout=60):
+        if consoleOutput:
+            self.log.info('Executing command: {}'.format(cmd))
+        try:
+            stdout, stderr, exit_code = self.adb_client.shell(self.to_shell_command(cmd), timeout=timeout)
+        except socket.timeout:
+            self.log.info('Timeout Exceeded: %i seconds' %(timeout))
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if consoleOutput:
+            self.log.info('stdout: ' + stdout)
+        if stderr:
+            self.log.info('stderr: ' + stderr)
+        return stdout, stderr
+
+    def native_push(self, local, remote, timeout=60, remote_mode=None):
+        if remote_mode is None:
+            remote_mode = self.adb_client.stat_follow(remote)[0]
+        if stat.S_ISDIR(remote_mode): # Push into folder.
+            remote = '{}/{}'.format(remote.rstrip('/'), os.path.basename(local))
+        start_time = time.time()
+        sent = self.adb_client.push(local, remote, timeout=timeout)
+        stdout = '{}: 1 file pushed. {} bytes in {:.3f}s'.format(local, sent, time.time() - start_time)
+        self.log.info(stdout)
+        return stdout, ''
+
+    def native_pull(self, remote, local, timeout=60):
+        if not local:
+            local = '.'
+        if os.path.isdir(local):
+            local = os.path.join(local, remote.split('/')[-1])
+        start_time = time.time()
+        received = self.adb_client.pull(remote, local, timeout=timeout)
+        stdout = '{}: 1 file pulled. {} bytes in {:.3f}s'.format(remote, received, time.time() - start_time)
+        self.log.info(stdout)
+        return stdout, ''
+
     def load_factory_env(self):
         """ Load factory env.txt before use fw_printenv command. """
         stdout, stderr = self.executeShellCommand(cmd='fw_printenv > /dev/null 2>&1; echo $?', consoleOutput=False)
@@ -470,13 +548,16 @@ class ADB(ShellCommands):
 
 
     def MD5_checksum(self, user_id, folder_path, consoleOutput=True, timeout=120):
-        user_id = user_id.replace('auth0|', 'auth0\|')
-        command = "busybox md5sum /data/wd/diskVolume0/restsdk/userRoots/{0}/{1}/*".format(user_id, folder_path)
-        result = self.executeShellCommand(command, timeout=timeout, consoleOutput=consoleOutput)[0]
+        """ Return {file name: md5} of files in the folder. Files not changed since last call are not hashed again. """
+        path = "/data/wd/diskVolume0/restsdk/userRoots/{0}/{1}".format(user_id, folder_path)
+        records = self.hasher.hash_files([path], algorithm='md5', max_depth=1, timeout=timeout)
         MD5_nas_dict = {}
-        for element in result.split('\r\n'):
-            if element:
-                MD5_nas_dict.update({element.split('/')[-1]:element.split(' ')[0]})
+        for file_path, record in records.iteritems():
+            file_name = file_path.split('/')[-1]
+            if not file_name.startswith('.'): # Same as "*".
+                MD5_nas_dict[file_name] = record.digest
+        if consoleOutput:
+            self.log.info('MD5 checksum of {}: {}'.format(path, MD5_nas_dict))
         return MD5_nas_dict
 
     def download_file_from_server(self, file_server_ip, file_path, user_id, download_folder):
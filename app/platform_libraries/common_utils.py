@@ -10,11 +10,14 @@ import logstash
 import os
 import requests
 import subprocess
-from inspect import stack
+import sys
+import threading
+from contextlib import contextmanager
 from uuid import uuid4
 # core modules
 import middleware.step_logging as sl # init custom logging
 from pyutils import NotSet
+from log_pipeline import BACKUP_COUNT, CompressedRotatingFileHandler, QueueHandler, get_log_pipeline
 # platform modules
 from jenkins_scripts.upload_ftp import FTP_connect, FTP_upload
 import shlex # to split shell commands
@@ -71,6 +74,12 @@ LOG_NAME_LENGTH = 30
 STREAM_LOG_LEVEL = None
 # Keep handlers (gen from @logger class) to update at once.
 STREAM_HANDLERS = []
+# Loggers created by create_logger(), keyed by full log name.
+LOGGERS = {}
+# File handler of each root log.
+FILE_HANDLERS = {}
+# Use LogPipeline for all loggers, it's enabled by enable_log_pipeline() or environment variable KAT_LOG_PIPELINE.
+LOG_PIPELINE = False
 
 
 def logger(root_log=ROOT_LOG, log_name=None, output_dir=OUTPUT_DIR, overwrite=OVERWRITE, log_name_length=LOG_NAME_LENGTH,
@@ -113,14 +122,16 @@ def create_logger(root_log=ROOT_LOG, log_name=None, output_dir=OUTPUT_DIR, overw
     if stream_log_level is NotSet:
         stream_log_level = STREAM_LOG_LEVEL
     if not log_name:
-        caller_frame = stack()[1]
-        calling_script = caller_frame[0].f_globals.get('__file__', None)
+        calling_script = sys._getframe(1).f_globals.get('__file__', None)
         calling_script = os.path.basename(calling_script)
         if '.' in calling_script:
             calling_script = calling_script.split('.')[0]
         log_name = '{0}.{1}'.format(root_log, calling_script)
     elif not log_name.startswith('{}.'.format(root_log)):
         log_name = '{0}.{1}'.format(root_log, log_name)
+    logger = LOGGERS.get(log_name.ljust(log_name_length))
+    if logger:
+        return logger
 
     # Create output folder if it's not exist
     if not output_dir:
@@ -136,22 +147,31 @@ def create_logger(root_log=ROOT_LOG, log_name=None, output_dir=OUTPUT_DIR, overw
         log_name = '{}.{}'.format(root_log, log_name)
 
     log_name = log_name.ljust(log_name_length)
-    root_logger = _create_root_logger(root_log, output_dir, overwrite)
+    _create_root_logger(root_log, output_dir, overwrite)
     logger = logging.getLogger(log_name)
+    LOGGERS[log_name] = logger
     if logger.handlers:
         return logger
     # Set for child logging.
     logger.propagate = False # Not pass record to root.
-    logger.addHandler(root_logger.handlers[0]) # Share root's file handler.
     if not isinstance(stream_log_level, int):
         stream_log_level = logging.INFO
     stream_handler = gen_stream_handler(level=stream_log_level) # Generate own stream handler.
-    logger.addHandler(stream_handler)
     if level_sync: # Record for @logger case
         STREAM_HANDLERS.append(stream_handler)
+    # Share root's file handler.
+    _add_handlers(logger, [FILE_HANDLERS[root_log.split('.')[0]], stream_handler])
     return logger
 
 
+def _add_handlers(logger, handlers):
+    if LOG_PIPELINE:
+        logger.addHandler(QueueHandler(handlers))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+
 def _create_root_logger(root_log=ROOT_LOG, output_dir=OUTPUT_DIR, overwrite=OVERWRITE):
     """
         Configure the root logging format.
@@ -168,6 +188,9 @@ def _create_root_logger(root_log=ROOT_LOG, output_dir=OUTPUT_DIR, overwrite=OVER
     root_logger = logging.getLogger(root_log)
     if root_logger.handlers:
         # Already created, so return
+        if root_log not in FILE_HANDLERS: # Created by others.
+            handler = root_logger.handlers[0]
+            FILE_HANDLERS[root_log] = handler.handlers[0] if isinstance(handler, QueueHandler) else handler
         return root_logger
 
     root_logger.setLevel(logging.DEBUG)
@@ -190,8 +213,8 @@ def _create_root_logger(root_log=ROOT_LOG, output_dir=OUTPUT_DIR, overwrite=OVER
     stream_handler = gen_stream_handler(level=logging.DEBUG)
 
     # Add handlers to root logger
-    root_logger.addHandler(file_handler) # Always put it at first one.
-    root_logger.addHandler(stream_handler)
+    FILE_HANDLERS[root_log] = file_handler
+    _add_handlers(root_logger, [file_handler, stream_handler]) # File handler is always the first one.
     return root_logger
 
 
@@ -212,6 +235,83 @@ def update_stream_handlers(level=None):
         stream_handler.setLevel(level)
 
 
+def enable_log_pipeline(max_bytes=None, backup_count=BACKUP_COUNT, rate_limit=None):
+    """
+        Move the existing and following loggers created by create_logger() to LogPipeline, so logging calls return
+        without waiting for file and screen output.
+
+        :param max_bytes: Rotate log file when it reaches this size, and compress the rotated ones.
+        :param backup_count: Number of rotated log files to keep.
+        :param rate_limit: Max records per second of each logger, the lower than WARNING ones over it are throttled.
+    """
+    global LOG_PIPELINE
+    get_log_pipeline().configure(rate_limit=rate_limit)
+    get_log_pipeline().flush() # Replace handlers after the queued records are written.
+    replaced = {} # Old handler: new handler
+    if max_bytes:
+        for root_log, file_handler in FILE_HANDLERS.items():
+            if not isinstance(file_handler, logging.FileHandler):
+                continue
+            if isinstance(file_handler, CompressedRotatingFileHandler):
+                file_handler.maxBytes = max_bytes
+                file_handler.backupCount = backup_count
+                continue
+            rotating_handler = CompressedRotatingFileHandler(
+                filename=file_handler.baseFilename, mode='a', maxBytes=max_bytes, backupCount=backup_count)
+            rotating_handler.setLevel(file_handler.level)
+            rotating_handler.setFormatter(file_handler.formatter)
+            replaced[file_handler] = FILE_HANDLERS[root_log] = rotating_handler
+    LOG_PIPELINE = True
+    file_handlers = set(replaced) | set(FILE_HANDLERS.values())
+    for logger in logging.Logger.manager.loggerDict.values():
+        if not isinstance(logger, logging.Logger):
+            continue
+        handlers = []
+        for handler in logger.handlers:
+            handlers.extend(handler.handlers if isinstance(handler, QueueHandler) else [handler])
+        if not file_handlers.intersection(handlers): # Not created by create_logger().
+            continue
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        _add_handlers(logger, [replaced.get(handler, handler) for handler in handlers])
+    for file_handler in replaced:
+        file_handler.close()
+
+
+def flush_logs(timeout=None):
+    """ Wait for the records in LogPipeline to be written, return logging stats of the pipeline. """
+    if LOG_PIPELINE:
+        get_log_pipeline().flush(*([timeout] if timeout else []))
+    return get_log_pipeline().get_stats()
+
+
+if os.environ.get('KAT_LOG_PIPELINE'):
+    enable_log_pipeline(max_bytes=int(os.environ.get('KAT_LOG_MAX_BYTES') or 0),
+        rate_limit=int(os.environ.get('KAT_LOG_RATE_LIMIT') or 0))
+
+
+@contextmanager
+def logging_fork_guard():
+    """ Hold the module lock of logging while forking a process, as logging does by os.register_at_fork() in
+    python 3. Call reinit_logging_locks() in the child process.
+    """
+    logging._acquireLock()
+    try:
+        yield
+    finally:
+        logging._releaseLock()
+
+
+def reinit_logging_locks():
+    """ Recreate the locks of logging module and all handlers in a forked child process. They may be held by
+    other threads of parent at forking, and python 2 doesn't reinitiate them, so the first logging call deadlocks.
+    """
+    logging._lock = threading.RLock()
+    for handler_ref in logging._handlerList:
+        handler = handler_ref()
+        if handler: handler.createLock()
+
+
 def upload_kdp_fw_to_server(model=None, fw=None, env=None, ver=None, data_type='os',ftp_username='ftp', ftp_password='ftppw', ftp_file_path='fileserver.hgst.com/firmware', retry=3):
 
     if not ftp_file_path.endswith('/'):
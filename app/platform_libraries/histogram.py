@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+""" Log-linear (HDR style) histograms for latency and size statistics.
+
+Values are stored as integers in buckets of which width grows with the value, each power of 2 is split
+into 2^sub_bucket_bits sub-buckets, so every recorded value keeps about 2 significant digits (< 1% error
+with the default 7 bits) with a small and fixed memory cost. Buckets are kept in a dict, so histograms are
+cheap to serialize by to_dict() and can be merged across iterations and processes.
+"""
+# std modules
+import math
+import threading
+
+
+class Histogram(object):
+
+    def __init__(self, unit_scale=1, sub_bucket_bits=7):
+        """
+        :param unit_scale: Multiplier to convert recorded value to integer, ex: 1000000 to record seconds in microseconds.
+        :param sub_bucket_bits: Precision bits of each power of 2.
+        """
+        self.unit_scale = unit_scale
+        self.sub_bucket_bits = sub_bucket_bits
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {} # bucket index: count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (shift << self.sub_bucket_bits) | (value >> shift)
+
+    def _bucket_upper(self, index):
+        """ Return the max integer value of the bucket. """
+        shift = index >> self.sub_bucket_bits
+        sub_bucket = index & ((1 << self.sub_bucket_bits) - 1)
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value * self.unit_scale))
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.count += count
+            self.total += value * count
+            if self.min is None or value < self.min: self.min = value
+            if self.max is None or value > self.max: self.max = value
+
+    def merge(self, other):
+        """ Add counts of other Histogram (or its to_dict() data) into this one. """
+        if isinstance(other, dict):
+            other = self.from_dict(other)
+        if other.sub_bucket_bits != self.sub_bucket_bits or other.unit_scale != self.unit_scale:
+            raise ValueError('Cannot merge histograms with different settings')
+        with self._lock:
+            for index, count in other.counts.iteritems():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.count += other.count
+            self.total += other.total
+            if other.min is not None and (self.min is None or other.min < self.min): self.min = other.min
+            if other.max is not None and (self.max is None or other.max > self.max): self.max = other.max
+        return self
+
+    def _scale(self, value):
+        if value is None:
+            return None
+        return float(value) / self.unit_scale
+
+    def get_min(self):
+        return self._scale(self.min)
+
+    def get_max(self):
+        return self._scale(self.max)
+
+    def get_mean(self):
+        if not self.count:
+            return None
+        return float(self.total) / self.count / self.unit_scale
+
+    def percentile(self, percent):
+        """ Return the value at percent (0-100), which is the upper bound of the bucket it falls in. """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(self.count * percent / 100.0)))
+        with self._lock:
+            indexes = sorted(self.counts)
+            counts = self.counts
+            seen = 0
+            for index in indexes:
+                seen += counts[index]
+                if seen >= target:
+                    return self._scale(min(self._bucket_upper(index), self.max))
+        return self.get_max()
+
+    def summary(self, percents=(50, 90, 95, 99, 99.9), digits=6):
+        """ Return {'count': 10, 'min': 0.1, 'mean': 0.2, 'p50': 0.2, ..., 'max': 0.5} """
+        def round_value(value):
+            return round(value, digits) if value is not None else None
+
+        summary = {'count': self.count, 'min': round_value(self.get_min()), 'mean': round_value(self.get_mean()),
+            'max': round_value(self.get_max())}
+        for percent in percents:
+            summary['p{}'.format(str(percent).replace('.', '_'))] = round_value(self.percentile(percent))
+        return summary
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'unit_scale': self.unit_scale,
+                'sub_bucket_bits': self.sub_bucket_bits,
+                'counts': {str(index): count for index, count in self.counts.iteritems()},
+                'count': self.count,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls.__new__(cls)
+        Histogram.__init__(histogram, unit_scale=data['unit_scale'], sub_bucket_bits=data['sub_bucket_bits'])
+        histogram.counts = {int(index): count for index, count in data['counts'].iteritems()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
+
+
+class LatencyHistogram(Histogram):
+    """ Histogram to record seconds in microseconds. """
+
+    def __init__(self, sub_bucket_bits=7):
+        super(LatencyHistogram, self).__init__(unit_scale=1000000, sub_bucket_bits=sub_bucket_bits)
@@ -3,13 +3,17 @@
 """
 # std modules
 import socket
+import threading
+from itertools import count
 
 # 3rd party modules
 import requests
 
 # platform modules
 import common_utils
-from platform_libraries.pyutils import log_request, log_response, retry
+from platform_libraries.http_pool import get_pool_registry, new_pooled_session
+from platform_libraries.http_stats import get_http_stats_recorder
+from platform_libraries.pyutils import log_request, log_response, request_log_stats, retry
 
 
 @common_utils.logger()
@@ -21,6 +25,10 @@ class HTTPRequester(object):
         
         self.session = requests.Session()
         self._persistent_connection = False
+        # Keep-alive pools shared by all requesters in this process, set False to use original requests.request.
+        self.pooled_session = new_pooled_session()
+        self._pooled_connection = True
+        self.http_stats = get_http_stats_recorder() # Per endpoint latency/bytes/status stats of this process.
 
         self._default_global_timeout = default_timeout # For request hangs issue.
         self._global_timeout = self._default_global_timeout
@@ -29,7 +37,10 @@ class HTTPRequester(object):
         self.set_global_timeout(default_timeout)
         self.debug_request = debug_request
         self.debug_response = debug_response
+        self.log_sample_rate = 1 # Log 1 in N successful calls (failed calls are always logged).
+        self._log_counter = count()
         self.fixed_corid = fixed_corid
+        self._corid_lock = threading.Lock() # For sending requests by multiple threads.
         self.previous_response = None
         if buildin_debug:
             from httplib import HTTPConnection
@@ -53,19 +64,43 @@ class HTTPRequester(object):
         socket.setdefaulttimeout(self._default_global_timeout)
         self._global_timeout = self._default_global_timeout
 
+    def get_pool_stats(self):
+        """ Return stats of the shared connection pools, ex: {'http://192.168.1.2:80': {'hits': 9, ...}} """
+        return get_pool_registry().get_pool_stats()
+
     def render_correlation_id(self):
         self.fixed_corid = common_utils.gen_correlation_id()
         self.log.debug('Render a new correlation id: {}'.format(self.fixed_corid))
 
     def increase_correlation_id(self):
+        with self._corid_lock:
+            self._increase_correlation_id()
+            return dict(self.fixed_corid)
+
+    def _increase_correlation_id(self):
         if '#' not in self.fixed_corid['x-correlation-id']: # Set default index.
             self.fixed_corid['x-correlation-id'] = self.fixed_corid['x-correlation-id'] + '#1'
         else: # Inrease requests index.
             cor_id, requests_idx = self.fixed_corid['x-correlation-id'].split('#')
             self.fixed_corid['x-correlation-id'] = cor_id + '#' + str(int(requests_idx)+1)
 
-    def log_request(self, response, logger, debug_logger=None):
-        log_request(response.request, logger, debug_logger, reduce_token=self.reduce_log)
+    def get_log_stats(self):
+        """ Return cost of request/response logging in this process, ex: {'logged': 10, 'sampled_out': 90, 'seconds': 0.01} """
+        return request_log_stats.to_dict()
+
+    def _should_log(self, response):
+        if self.log_sample_rate <= 1:
+            return True
+        if getattr(response, 'status_code', 500) >= 400:
+            return True
+        if next(self._log_counter) % self.log_sample_rate == 0:
+            return True
+        request_log_stats.add_sampled_out()
+        return False
+
+    def log_request(self, response, logger, debug_logger=None, reduce_token=None):
+        if reduce_token is None: reduce_token = self.reduce_log
+        log_request(response.request, logger, debug_logger, reduce_token=reduce_token)
 
     def log_response(self, response, logger, debug_logger=None, show_content=True):
         log_response(response, logger, debug_logger, show_content)
@@ -85,15 +120,24 @@ class HTTPRequester(object):
             response.raise_for_status()
         raise RuntimeError(message)
 
-    def send_request(self, method, url, set_corid=True, retry_times=None, **kwargs):
+    def send_request(self, method, url, set_corid=True, retry_times=None, reduce_log=None, **kwargs):
+        """
+        :param reduce_log: Reduce logs of this call, use self.reduce_log if it is None.
+                           Set it per call instead of changing self.reduce_log when sending requests by multiple threads.
+        """
+        if reduce_log is None: reduce_log = self.reduce_log
 
         #  hook point before sending a request
         if self.before_send_request: self.before_send_request()
 
         def retry_check(response):
+            if hasattr(response, 'status_code'): self.http_stats.record_response(method, url, response, stream=kwargs.get('stream'))
             # logging
-            if self.debug_request: self.log_request(response, logger=self.log.debug, debug_logger=self.log.debug)
-            if self.debug_response: self.log_response(response, logger=self.log.debug, debug_logger=self.log.debug)
+            log_call = (self.debug_request or self.debug_response) and self._should_log(response)
+            if log_call and self.debug_request:
+                self.log_request(response, logger=self.log.debug, debug_logger=self.log.debug, reduce_token=reduce_log)
+            if log_call and self.debug_response: # Not to read content of streaming response.
+                self.log_response(response, logger=self.log.debug, debug_logger=self.log.debug, show_content=not kwargs.get('stream'))
             # Response checks
             if hasattr(response, 'status_code') and response.status_code < 500:
                 # Additional checks for 401 issue on Kamino device.
@@ -105,12 +149,12 @@ class HTTPRequester(object):
         self.previous_response = None
         if set_corid:
             #cid_dict = common_utils.gen_correlation_id()
-            self.increase_correlation_id()
-            if not self.reduce_log: self.log.debug('Set x-correlation-id: {}'.format(self.fixed_corid['x-correlation-id']))
+            corid = self.increase_correlation_id()
+            if not reduce_log: self.log.debug('Set x-correlation-id: {}'.format(corid['x-correlation-id']))
             if 'headers' in kwargs:
-                kwargs['headers'].update(self.fixed_corid)
+                kwargs['headers'].update(corid)
             else:
-                kwargs['headers'] = self.fixed_corid
+                kwargs['headers'] = corid
         if 'timeout' not in kwargs: # For request hangs issue.
             kwargs['timeout'] = self._global_timeout
         try:
@@ -123,6 +167,14 @@ class HTTPRequester(object):
                     log=self.log.info, retry_lambda=retry_check, not_raise_error=True, **kwargs
                 )
                 
+            elif self._pooled_connection:
+                response = retry( # Retry for it broken (status code >= 500 or no status code) by somehow
+                                  # to decrease the issues devolers won't handle.
+                    func=self.pooled_session.request, method=method, url=url,
+                    excepts=(Exception), delay=self._retry_delay, max_retry=retry_times if isinstance(retry_times, int) else self._retry_times,
+                    log=self.log.info, retry_lambda=retry_check, not_raise_error=True, **kwargs
+                )
+
             else:  # Original requests.request
                 response = retry( # Retry for it broken (status code >= 500 or no status code) by somehow
                                   # to decrease the issues devolers won't handle.
@@ -132,6 +184,7 @@ class HTTPRequester(object):
                 )
 
         except Exception, e:
+            self.http_stats.record_error(method, url)
             self.log.debug('[Request Failure] {}'.format(e), exc_info=True)
             raise
         self.previous_response = response
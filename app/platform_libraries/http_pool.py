@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+""" Shared keep-alive connection pools for HTTPRequester.
+
+All HTTPRequester instances (RestAPI, NasAdminClient, CloudAPI...) in one process mount the same
+PooledHTTPAdapter, so requests to the same host reuse TCP/TLS connections instead of doing a new
+handshake for every call. Each host gets its own sized pool; connections are dropped when they
+have been idle too long or are older than the max age.
+"""
+# std modules
+import cookielib
+import threading
+import time
+
+# 3rd party modules
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, VerifiedHTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# platform modules
+from platform_libraries.pyutils import Singleton
+
+
+#
+# Pool Settings
+#
+POOL_CONNECTIONS = 20 # Number of host pools to cache.
+POOL_MAXSIZE = 20 # Max connections to keep in each host pool.
+IDLE_TIMEOUT = 60 # Seconds. Drop a connection if it is not used for this long.
+MAX_AGE = 60*10 # Seconds. Drop a connection if it is older than this.
+
+
+class _NoCookiePolicy(cookielib.DefaultCookiePolicy):
+    """ Pooled sessions are shared by users, don't keep any cookie like requests.request() does. """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class PoolStats(object):
+    """ Counters of one host pool. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0 # Requests sent on a connection which was already open.
+        self.new_connections = 0
+        self.idle_evictions = 0
+        self.age_evictions = 0
+
+    def incr(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def reuse_ratio(self):
+        if not self.requests:
+            return 0.0
+        return float(self.hits) / self.requests
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'new_connections': self.new_connections,
+            'idle_evictions': self.idle_evictions,
+            'age_evictions': self.age_evictions,
+            'reuse_ratio': round(self.reuse_ratio(), 4)
+        }
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.hits = self.new_connections = self.idle_evictions = self.age_evictions = 0
+
+
+class _StatsConnectionMixin(object):
+    """ Stamp the socket open time and count new connections. """
+    _kat_stats = None
+    _kat_connected_at = None
+    _kat_last_used = None
+
+    def connect(self):
+        super(_StatsConnectionMixin, self).connect()
+        self._kat_connected_at = self._kat_last_used = time.time()
+        if self._kat_stats: self._kat_stats.incr('new_connections')
+
+
+class StatsHTTPConnection(_StatsConnectionMixin, HTTPConnection):
+    pass
+
+
+class StatsHTTPSConnection(_StatsConnectionMixin, VerifiedHTTPSConnection):
+    pass
+
+
+class _EvictionPoolMixin(object):
+    """ Evict idle/aged connections on checkout and record pool stats. """
+    idle_timeout = IDLE_TIMEOUT
+    max_age = MAX_AGE
+
+    def __init__(self, *args, **kwargs):
+        super(_EvictionPoolMixin, self).__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _new_conn(self):
+        conn = super(_EvictionPoolMixin, self)._new_conn()
+        conn._kat_stats = self.stats
+        return conn
+
+    def _get_conn(self, timeout=None):
+        conn = super(_EvictionPoolMixin, self)._get_conn(timeout)
+        if conn and getattr(conn, 'sock', None) and conn._kat_connected_at:
+            now = time.time()
+            if self.max_age and now - conn._kat_connected_at > self.max_age:
+                self.stats.incr('age_evictions')
+                conn.close() # Reconnect on next request.
+            elif self.idle_timeout and now - conn._kat_last_used > self.idle_timeout:
+                self.stats.incr('idle_evictions')
+                conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn: conn._kat_last_used = time.time()
+        super(_EvictionPoolMixin, self)._put_conn(conn)
+
+    def _make_request(self, conn, *args, **kwargs):
+        self.stats.incr('requests')
+        if getattr(conn, 'sock', None): self.stats.incr('hits')
+        return super(_EvictionPoolMixin, self)._make_request(conn, *args, **kwargs)
+
+
+class EvictionHTTPConnectionPool(_EvictionPoolMixin, HTTPConnectionPool):
+    ConnectionCls = StatsHTTPConnection
+
+
+class EvictionHTTPSConnectionPool(_EvictionPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = StatsHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter with per host pools which support idle eviction, max age and stats. """
+    __attrs__ = HTTPAdapter.__attrs__ + ['idle_timeout', 'max_age']
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, idle_timeout=IDLE_TIMEOUT,
+            max_age=MAX_AGE, **kwargs):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        super(PooledHTTPAdapter, self).__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super(PooledHTTPAdapter, self).init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        # Pool classes carry the eviction settings of this adapter.
+        settings = {'idle_timeout': self.idle_timeout, 'max_age': self.max_age}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('EvictionHTTPConnectionPool', (EvictionHTTPConnectionPool,), settings),
+            'https': type('EvictionHTTPSConnectionPool', (EvictionHTTPSConnectionPool,), settings)
+        }
+
+    def get_pool_stats(self):
+        """ Return stats of each host pool, ex: {'http://192.168.1.2:80': {'requests': 10, 'hits': 9, ...}} """
+        stats = {}
+        pools = self.poolmanager.pools
+        with pools.lock:
+            pool_list = list(pools._container.values())
+        for pool in pool_list:
+            if not hasattr(pool, 'stats'):
+                continue
+            stats['{}://{}:{}'.format(pool.scheme, pool.host, pool.port)] = pool.stats.to_dict()
+        return stats
+
+    def reset_pool_stats(self):
+        pools = self.poolmanager.pools
+        with pools.lock:
+            pool_list = list(pools._container.values())
+        for pool in pool_list:
+            if hasattr(pool, 'stats'): pool.stats.reset()
+
+
+class ConnectionPoolRegistry(object):
+    """ Process wide holder of the shared PooledHTTPAdapter. """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._adapter = None
+        self.settings = {
+            'pool_connections': POOL_CONNECTIONS,
+            'pool_maxsize': POOL_MAXSIZE,
+            'idle_timeout': IDLE_TIMEOUT,
+            'max_age': MAX_AGE
+        }
+
+    @property
+    def adapter(self):
+        with self._lock:
+            if not self._adapter:
+                self._adapter = PooledHTTPAdapter(**self.settings)
+            return self._adapter
+
+    def configure(self, **settings):
+        """ Update pool settings. Existing connections are closed and the pools are re-created with new settings,
+        sessions which already mounted the shared adapter get the new settings as well.
+        """
+        with self._lock:
+            self.settings.update(settings)
+            if not self._adapter:
+                return
+            self._adapter.close()
+            self._adapter.idle_timeout = self.settings['idle_timeout']
+            self._adapter.max_age = self.settings['max_age']
+            self._adapter._pool_connections = self.settings['pool_connections']
+            self._adapter._pool_maxsize = self.settings['pool_maxsize']
+            self._adapter.init_poolmanager(self.settings['pool_connections'], self.settings['pool_maxsize'],
+                block=self._adapter._pool_block)
+
+    def mount(self, session):
+        """ Mount the shared adapter to the given requests.Session. """
+        adapter = self.adapter
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_pool_stats(self):
+        with self._lock:
+            if not self._adapter:
+                return {}
+            return self._adapter.get_pool_stats()
+
+    def reset_pool_stats(self):
+        with self._lock:
+            if self._adapter: self._adapter.reset_pool_stats()
+
+    def close(self):
+        """ Close all pooled connections. """
+        with self._lock:
+            if self._adapter: self._adapter.close()
+
+
+def get_pool_registry():
+    return ConnectionPoolRegistry()
+
+
+def new_pooled_session():
+    """ Create a requests.Session which sends requests through the shared pools and keeps no cookies. """
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookiePolicy())
+    return get_pool_registry().mount(session)
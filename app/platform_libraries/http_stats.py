@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+""" Per endpoint statistics of HTTP calls sent by HTTPRequester.
+
+Each call is recorded under its URL template, which is "METHOD /path" with IDs in path replaced by {id},
+ex: "GET /sdk/v2/files/{id}/content". Every template keeps a latency histogram, a response size histogram
+and counters of status class. HTTPStats can be saved to JSON file and merged with stats of other iterations
+or processes.
+"""
+# std modules
+import json
+import re
+import threading
+import urllib
+import urlparse
+
+# platform modules
+from platform_libraries.histogram import Histogram, LatencyHistogram
+from platform_libraries.pyutils import Singleton
+
+
+# Path segment which looks like an ID: numbers, UUID/hex, RestSDK ID (long token with digits), auth0 user ID or email.
+_ID_SEGMENT = re.compile(r'^(?:\d+|[0-9a-fA-F-]{16,}|(?=.*\d)[A-Za-z0-9_.-]{16,}|auth0\|.+|[^@/]+@[^@/]+)$')
+_MAX_CACHED_TEMPLATES = 10000
+_template_cache = {}
+
+
+def normalize_url(method, url):
+    """ Return URL template of the call, ex: ('GET', 'http://ip/sdk/v2/files/abc123...?fields=id')
+    => 'GET /sdk/v2/files/{id}'
+    """
+    path = urlparse.urlsplit(url).path
+    key = (method, path)
+    template = _template_cache.get(key)
+    if template:
+        return template
+    segments = ['{id}' if segment and _ID_SEGMENT.match(urllib.unquote(segment)) else segment
+        for segment in path.split('/')]
+    template = '{} {}'.format(method.upper(), '/'.join(segments) or '/')
+    if len(_template_cache) >= _MAX_CACHED_TEMPLATES:
+        _template_cache.clear()
+    _template_cache[key] = template
+    return template
+
+
+class EndpointStats(object):
+    """ Statistics of one URL template. """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        self.latency = LatencyHistogram() # Seconds from sending request to response headers parsed.
+        self.response_bytes = Histogram()
+        self.bytes_sent = 0
+        self.status_classes = {} # ex: {'2xx': 10, '4xx': 1, 'error': 1}
+
+    def record(self, elapsed, status_code, response_bytes=None, bytes_sent=0):
+        self.latency.record(elapsed)
+        if response_bytes is not None: self.response_bytes.record(response_bytes)
+        with self._lock:
+            self.bytes_sent += bytes_sent
+            self._incr_status('{}xx'.format(status_code / 100))
+
+    def record_error(self):
+        """ Request failed without response. """
+        with self._lock:
+            self._incr_status('error')
+
+    def _incr_status(self, status_class):
+        self.status_classes[status_class] = self.status_classes.get(status_class, 0) + 1
+
+    def count(self):
+        return sum(self.status_classes.itervalues())
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.response_bytes.merge(other.response_bytes)
+        with self._lock:
+            self.bytes_sent += other.bytes_sent
+            for status_class, count in other.status_classes.iteritems():
+                self.status_classes[status_class] = self.status_classes.get(status_class, 0) + count
+        return self
+
+    def summary(self):
+        """ Flat dict for ELK and Popcorn. """
+        latency = self.latency.summary(percents=(50, 90, 95, 99))
+        summary = {
+            'endpoint': self.endpoint,
+            'count': self.count(),
+            'latency_min': latency['min'],
+            'latency_mean': latency['mean'],
+            'latency_p50': latency['p50'],
+            'latency_p90': latency['p90'],
+            'latency_p95': latency['p95'],
+            'latency_p99': latency['p99'],
+            'latency_max': latency['max'],
+            'bytes_received': self.response_bytes.total,
+            'bytes_received_p99': self.response_bytes.percentile(99),
+            'bytes_sent': self.bytes_sent
+        }
+        for status_class, count in self.status_classes.iteritems():
+            summary['status_{}'.format(status_class)] = count
+        return summary
+
+    def to_dict(self):
+        return {
+            'endpoint': self.endpoint,
+            'latency': self.latency.to_dict(),
+            'response_bytes': self.response_bytes.to_dict(),
+            'bytes_sent': self.bytes_sent,
+            'status_classes': dict(self.status_classes)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data['endpoint'])
+        stats.latency = LatencyHistogram.from_dict(data['latency'])
+        stats.response_bytes = Histogram.from_dict(data['response_bytes'])
+        stats.bytes_sent = data['bytes_sent']
+        stats.status_classes = dict(data['status_classes'])
+        return stats
+
+
+class HTTPStats(object):
+    """ EndpointStats of all URL templates. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {} # URL template: EndpointStats
+
+    def _get(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if not stats:
+            with self._lock:
+                stats = self.endpoints.setdefault(endpoint, EndpointStats(endpoint))
+        return stats
+
+    def record(self, method, url, elapsed, status_code, response_bytes=None, bytes_sent=0):
+        self._get(normalize_url(method, url)).record(elapsed, status_code, response_bytes, bytes_sent)
+
+    def record_error(self, method, url):
+        self._get(normalize_url(method, url)).record_error()
+
+    def merge(self, other):
+        """ Merge HTTPStats object or its to_dict() data. """
+        if isinstance(other, dict):
+            other = self.from_dict(other)
+        for endpoint, stats in other.endpoints.items():
+            self._get(endpoint).merge(stats)
+        return self
+
+    def summary(self):
+        """ Return summary list of endpoints sorted by call count. """
+        return sorted((stats.summary() for stats in self.endpoints.values()), key=lambda s: s['count'], reverse=True)
+
+    def to_dict(self):
+        return {'endpoints': [stats.to_dict() for stats in self.endpoints.values()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        http_stats = cls()
+        for stats_data in data.get('endpoints', []):
+            stats = EndpointStats.from_dict(stats_data)
+            http_stats.endpoints[stats.endpoint] = stats
+        return http_stats
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+class HTTPStatsRecorder(object):
+    """ Process wide recorder used by HTTPRequester. """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.stats = HTTPStats()
+
+    def record_response(self, method, url, response, stream=False):
+        if not self.enabled:
+            return
+        response_bytes = None
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            response_bytes = int(content_length)
+        elif not stream: # Content is already read.
+            response_bytes = len(response.content or '')
+        body = getattr(response.request, 'body', None)
+        bytes_sent = len(body) if isinstance(body, basestring) else 0
+        self.stats.record(method, url, response.elapsed.total_seconds(), response.status_code, response_bytes, bytes_sent)
+
+    def record_error(self, method, url):
+        if not self.enabled:
+            return
+        self.stats.record_error(method, url)
+
+    def pop(self):
+        """ Return HTTPStats recorded so far and start a new one. """
+        with self._lock:
+            stats, self.stats = self.stats, HTTPStats()
+        return stats
+
+
+def get_http_stats_recorder():
+    return HTTPStatsRecorder()
+
+
+def merge_http_stats_files(paths):
+    """ Merge saved HTTPStats files (ex: from different processes) into one HTTPStats. """
+    http_stats = HTTPStats()
+    for path in paths:
+        http_stats.merge(HTTPStats.load(path))
+    return http_stats
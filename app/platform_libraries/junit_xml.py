@@ -139,60 +139,70 @@ class TestSuite(object):
 
         # test cases
         for case in self.test_cases:
-            test_case_attributes = dict()
-            test_case_attributes['name'] = decode(case.name, encoding)
-            if case.elapsed_sec:
-                test_case_attributes['time'] = "%f" % case.elapsed_sec
-            if case.classname:
-                test_case_attributes['classname'] = decode(case.classname, encoding)
-
-            test_case_element = ET.SubElement(
-                xml_element, "testcase", test_case_attributes)
-
-            # failures
-            if case.is_failure():
-                attrs = {'type': 'failure'}
-                if case.failure_message:
-                    attrs['message'] = decode(case.failure_message, encoding)
-                failure_element = ET.Element("failure", attrs)
-                if case.failure_output:
-                    failure_element.text = decode(case.failure_output, encoding)
-                test_case_element.append(failure_element)
-
-            # errors
-            if case.is_error():
-                attrs = {'type': 'error'}
-                if case.error_message:
-                    attrs['message'] = decode(case.error_message, encoding)
-                error_element = ET.Element("error", attrs)
-                if case.error_output:
-                    error_element.text = decode(case.error_output, encoding)
-                test_case_element.append(error_element)
-
-            # skippeds
-            if case.is_skipped():
-                attrs = {'type': 'skipped'}
-                if case.skipped_message:
-                    attrs['message'] = decode(case.skipped_message, encoding)
-                skipped_element = ET.Element("skipped", attrs)
-                if case.skipped_output:
-                    skipped_element.text = decode(case.skipped_output, encoding)
-                test_case_element.append(skipped_element)
-
-            # test stdout
-            if case.stdout:
-                stdout_element = ET.Element("system-out")
-                stdout_element.text = decode(case.stdout, encoding)
-                test_case_element.append(stdout_element)
-
-            # test stderr
-            if case.stderr:
-                stderr_element = ET.Element("system-err")
-                stderr_element.text = decode(case.stderr, encoding)
-                test_case_element.append(stderr_element)
+            xml_element.append(TestSuite.build_test_case_element(case, encoding=encoding))
 
         return xml_element
 
+    @staticmethod
+    def build_test_case_element(case, encoding=None):
+        '''
+        Builds the XML element of a test case.
+        @param encoding: Used to decode encoded strings.
+        @return: XML element with unicode string elements
+        '''
+        test_case_attributes = dict()
+        test_case_attributes['name'] = decode(case.name, encoding)
+        if case.elapsed_sec:
+            test_case_attributes['time'] = "%f" % case.elapsed_sec
+        if case.classname:
+            test_case_attributes['classname'] = decode(case.classname, encoding)
+
+        test_case_element = ET.Element("testcase", test_case_attributes)
+
+        # failures
+        if case.is_failure():
+            attrs = {'type': 'failure'}
+            if case.failure_message:
+                attrs['message'] = decode(case.failure_message, encoding)
+            failure_element = ET.Element("failure", attrs)
+            if case.failure_output:
+                failure_element.text = decode(case.failure_output, encoding)
+            test_case_element.append(failure_element)
+
+        # errors
+        if case.is_error():
+            attrs = {'type': 'error'}
+            if case.error_message:
+                attrs['message'] = decode(case.error_message, encoding)
+            error_element = ET.Element("error", attrs)
+            if case.error_output:
+                error_element.text = decode(case.error_output, encoding)
+            test_case_element.append(error_element)
+
+        # skippeds
+        if case.is_skipped():
+            attrs = {'type': 'skipped'}
+            if case.skipped_message:
+                attrs['message'] = decode(case.skipped_message, encoding)
+            skipped_element = ET.Element("skipped", attrs)
+            if case.skipped_output:
+                skipped_element.text = decode(case.skipped_output, encoding)
+            test_case_element.append(skipped_element)
+
+        # test stdout
+        if case.stdout:
+            stdout_element = ET.Element("system-out")
+            stdout_element.text = decode(case.stdout, encoding)
+            test_case_element.append(stdout_element)
+
+        # test stderr
+        if case.stderr:
+            stderr_element = ET.Element("system-err")
+            stderr_element.text = decode(case.stderr, encoding)
+            test_case_element.append(stderr_element)
+
+        return test_case_element
+
     @staticmethod
     def to_xml_string(test_suites, prettyprint=True, encoding=None):
         '''Returns the string representation of the JUnit XML document.
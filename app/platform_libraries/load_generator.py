@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+""" Open-loop load generator for RestSDK.
+
+Requests are driven by one event loop on a pycurl multi handle instead of one thread per user, so a single
+process can keep thousands of requests in flight. Arrivals follow the scenario rate no matter how fast the
+device responds (open-loop), requests which can't start yet wait in a backlog, and their waiting time is
+counted in response time, so a slow device shows up as higher latency instead of lower request rate.
+
+Example:
+    operations = RestSDKOperations(parent_id='root', file_ids={user1.username: ['id1', 'id2']})
+    scenario = LoadScenario(operations.get_operations(), mix={'download': 60, 'search': 25, 'upload': 10, 'share': 5},
+        rate=200, duration=60)
+    report = LoadGenerator(scenario, clients=[user1, user2], max_in_flight=2000).run()
+    print report
+"""
+# std modules
+import json
+import os
+import random
+import time
+from collections import deque
+from uuid import uuid4
+
+# 3rd party modules
+import pycurl
+
+# platform modules
+import common_utils
+from platform_libraries.histogram import LatencyHistogram
+
+
+class RequestSpec(object):
+    """ One HTTP request built by an operation. """
+
+    def __init__(self, method, url, headers=None, body=None, expect_status=(200,), on_complete=None):
+        """
+        :param headers: Headers in dict.
+        :param body: Request body in string.
+        :param on_complete: Function called with (status_code, response_headers) when request succeeded.
+        """
+        self.method = method
+        self.url = url
+        self.headers = headers or {}
+        self.body = body
+        self.expect_status = expect_status
+        self.on_complete = on_complete
+
+
+class LoadScenario(object):
+    """ Declarative mix of operations and arrival rate. """
+
+    def __init__(self, operations, mix, rate, duration, arrival='poisson', max_backlog=None):
+        """
+        :param operations: Dict of operation name: function which takes a client and returns RequestSpec,
+                           or None to skip this arrival (ex: no file to download yet).
+        :param mix: Dict of operation name: weight. ex: {'download': 60, 'search': 25, 'upload': 10, 'share': 5}
+        :param rate: Arrivals per second.
+        :param duration: Seconds to generate arrivals.
+        :param arrival: 'poisson' for random intervals or 'constant' for fixed intervals.
+        :param max_backlog: Max arrivals waiting to start. Arrivals over it are dropped and counted.
+        """
+        for name in mix:
+            if name not in operations:
+                raise ValueError('Operation "{}" in mix is not defined'.format(name))
+        if arrival not in ('poisson', 'constant'):
+            raise ValueError('Unknown arrival: {}'.format(arrival))
+        self.operations = operations
+        self.mix = mix
+        self.rate = float(rate)
+        self.duration = duration
+        self.arrival = arrival
+        self.max_backlog = max_backlog
+        self._names = []
+        self._cumulative_weights = []
+        total = 0
+        for name, weight in sorted(mix.iteritems()):
+            if weight <= 0: continue
+            total += weight
+            self._names.append(name)
+            self._cumulative_weights.append(total)
+        self._total_weight = total
+
+    def pick_operation(self):
+        point = random.uniform(0, self._total_weight)
+        for name, cumulative_weight in zip(self._names, self._cumulative_weights):
+            if point <= cumulative_weight:
+                return name
+        return self._names[-1]
+
+    def next_interval(self):
+        if self.arrival == 'constant':
+            return 1 / self.rate
+        return random.expovariate(self.rate)
+
+
+class OperationStats(object):
+    """ Statistics of one operation. """
+
+    def __init__(self, name):
+        self.name = name
+        self.response_time = LatencyHistogram() # From scheduled arrival to response end, include backlog waiting.
+        self.service_time = LatencyHistogram() # From request sent to response end.
+        self.ttfb = LatencyHistogram()
+        self.status_classes = {} # ex: {'2xx': 10, '5xx': 1}
+        self.errors = 0 # Unexpected status or transport errors.
+        self.skipped = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def merge(self, other):
+        self.response_time.merge(other.response_time)
+        self.service_time.merge(other.service_time)
+        self.ttfb.merge(other.ttfb)
+        for status_class, count in other.status_classes.iteritems():
+            self.status_classes[status_class] = self.status_classes.get(status_class, 0) + count
+        self.errors += other.errors
+        self.skipped += other.skipped
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        return self
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'response_time': self.response_time.summary(),
+            'service_time': self.service_time.summary(),
+            'ttfb': self.ttfb.summary(),
+            'status_classes': dict(self.status_classes),
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received
+        }
+
+
+class LoadReport(object):
+
+    def __init__(self, scenario):
+        self.offered_rate = scenario.rate
+        self.duration = scenario.duration
+        self.operations = {name: OperationStats(name) for name in scenario.operations}
+        self.arrivals = 0
+        self.completed = 0
+        self.dropped = 0
+        self.max_backlog = 0
+        self.max_in_flight = 0
+        self.elapsed = 0
+
+    def achieved_rate(self):
+        if not self.elapsed:
+            return 0.0
+        return self.completed / self.elapsed
+
+    def total_errors(self):
+        return sum(stats.errors for stats in self.operations.itervalues())
+
+    def to_dict(self):
+        return {
+            'offered_rate': self.offered_rate,
+            'achieved_rate': round(self.achieved_rate(), 3),
+            'duration': self.duration,
+            'elapsed': round(self.elapsed, 3),
+            'arrivals': self.arrivals,
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'errors': self.total_errors(),
+            'max_backlog': self.max_backlog,
+            'max_in_flight': self.max_in_flight,
+            'operations': {name: stats.to_dict() for name, stats in self.operations.iteritems()}
+        }
+
+    def __str__(self):
+        lines = ['Offered {:.1f} req/s, achieved {:.1f} req/s in {:.1f} sec: {} arrivals, {} completed, {} dropped, '
+            '{} errors, max backlog: {}, max in flight: {}'.format(self.offered_rate, self.achieved_rate(), self.elapsed,
+            self.arrivals, self.completed, self.dropped, self.total_errors(), self.max_backlog, self.max_in_flight)]
+        lines.append('{:<12}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'operation', 'count', 'errors', 'p50', 'p95', 'p99', 'max', 'MB'))
+        for name, stats in sorted(self.operations.iteritems()):
+            summary = stats.response_time.summary()
+            lines.append('{:<12}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10.2f}'.format(
+                name, summary['count'], stats.errors, summary['p50'], summary['p95'], summary['p99'], summary['max'],
+                (stats.bytes_sent + stats.bytes_received) / 1024.0 / 1024.0))
+        return '\n'.join(lines)
+
+
+class _Transfer(object):
+    """ State of one in-flight request. """
+
+    def __init__(self, name, spec, scheduled_time):
+        self.name = name
+        self.spec = spec
+        self.scheduled_time = scheduled_time
+        self.start_time = time.time()
+        self.bytes_received = 0
+        self.headers = {}
+
+    def write(self, data):
+        self.bytes_received += len(data) # Drop response body.
+
+    def header(self, line):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            self.headers[key.strip().lower()] = value.strip()
+
+
+@common_utils.logger()
+class LoadGenerator(object):
+    """ Run a LoadScenario with a pycurl multi event loop. """
+
+    def __init__(self, scenario, clients, max_in_flight=1000, timeout=60, verify_ssl=False, log=None):
+        """
+        :param clients: List of RestAPI objects. Arrivals are assigned to them in turn.
+        :param max_in_flight: Max concurrent requests (and connections).
+        :param timeout: Seconds for each request.
+        """
+        self.scenario = scenario
+        self.clients = clients
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.verify_ssl = verify_ssl
+        if log: self.log = log
+        self.max_backlog = scenario.max_backlog or max_in_flight * 10
+        self._client_idx = 0
+
+    def _next_client(self):
+        client = self.clients[self._client_idx % len(self.clients)]
+        self._client_idx += 1
+        return client
+
+    def _setup_handle(self, handle, transfer):
+        spec = transfer.spec
+        handle.reset()
+        handle.setopt(pycurl.URL, spec.url)
+        handle.setopt(pycurl.NOSIGNAL, 1)
+        handle.setopt(pycurl.TIMEOUT, self.timeout)
+        if not self.verify_ssl:
+            handle.setopt(pycurl.SSL_VERIFYPEER, 0)
+            handle.setopt(pycurl.SSL_VERIFYHOST, 0)
+        handle.setopt(pycurl.HTTPHEADER, ['{}: {}'.format(key, value) for key, value in spec.headers.iteritems()])
+        if spec.method == 'GET':
+            handle.setopt(pycurl.HTTPGET, 1)
+        else:
+            if spec.body is not None:
+                handle.setopt(pycurl.POSTFIELDS, spec.body)
+            handle.setopt(pycurl.CUSTOMREQUEST, spec.method)
+        handle.setopt(pycurl.WRITEFUNCTION, transfer.write)
+        handle.setopt(pycurl.HEADERFUNCTION, transfer.header)
+        handle.transfer = transfer
+
+    def _finish(self, handle, report, error=None):
+        transfer = handle.transfer
+        handle.transfer = None
+        stats = report.operations[transfer.name]
+        end_time = time.time()
+        stats.response_time.record(end_time - transfer.scheduled_time)
+        stats.service_time.record(end_time - transfer.start_time)
+        stats.bytes_received += transfer.bytes_received
+        stats.bytes_sent += len(transfer.spec.body) if transfer.spec.body else 0
+        report.completed += 1
+        if error:
+            stats.errors += 1
+            stats.status_classes['error'] = stats.status_classes.get('error', 0) + 1
+            self.log.debug('{} {} failed: {}'.format(transfer.spec.method, transfer.spec.url, error))
+            return
+        status_code = handle.getinfo(pycurl.RESPONSE_CODE)
+        stats.ttfb.record(handle.getinfo(pycurl.STARTTRANSFER_TIME))
+        status_class = '{}xx'.format(status_code / 100)
+        stats.status_classes[status_class] = stats.status_classes.get(status_class, 0) + 1
+        if status_code not in transfer.spec.expect_status:
+            stats.errors += 1
+            self.log.debug('{} {} returns unexpected status: {}'.format(transfer.spec.method, transfer.spec.url, status_code))
+            return
+        if transfer.spec.on_complete:
+            try:
+                transfer.spec.on_complete(status_code, transfer.headers)
+            except Exception as e:
+                self.log.warning('on_complete of {} failed: {}'.format(transfer.name, repr(e)))
+
+    def run(self):
+        """ Generate load until scenario duration is reached and all requests are done.
+
+        :return: LoadReport object.
+        """
+        scenario = self.scenario
+        report = LoadReport(scenario)
+        multi = pycurl.CurlMulti()
+        free_handles = []
+        in_flight = set()
+        backlog = deque() # (scheduled_time, operation name)
+        self.log.info('Start load: {} req/s for {} sec, mix: {}, max in flight: {}'.format(
+            scenario.rate, scenario.duration, scenario.mix, self.max_in_flight))
+        start_time = time.time()
+        end_time = start_time + scenario.duration
+        next_arrival = start_time
+        try:
+            while True:
+                now = time.time()
+                # Arrivals.
+                while next_arrival <= now and next_arrival < end_time:
+                    report.arrivals += 1
+                    if len(backlog) >= self.max_backlog:
+                        report.dropped += 1
+                    else:
+                        backlog.append((next_arrival, scenario.pick_operation()))
+                    next_arrival += scenario.next_interval()
+                report.max_backlog = max(report.max_backlog, len(backlog))
+                # Start requests.
+                while backlog and len(in_flight) < self.max_in_flight:
+                    scheduled_time, name = backlog.popleft()
+                    try:
+                        spec = scenario.operations[name](self._next_client())
+                    except Exception as e:
+                        report.operations[name].errors += 1
+                        self.log.warning('Failed to build request of {}: {}'.format(name, repr(e)))
+                        continue
+                    if not spec:
+                        report.operations[name].skipped += 1
+                        continue
+                    handle = free_handles.pop() if free_handles else pycurl.Curl()
+                    self._setup_handle(handle, _Transfer(name, spec, scheduled_time))
+                    multi.add_handle(handle)
+                    in_flight.add(handle)
+                report.max_in_flight = max(report.max_in_flight, len(in_flight))
+                # Drive transfers.
+                while True:
+                    ret, _ = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    queued, ok_list, error_list = multi.info_read()
+                    for handle in ok_list:
+                        multi.remove_handle(handle)
+                        in_flight.discard(handle)
+                        self._finish(handle, report)
+                        free_handles.append(handle)
+                    for handle, _, error_message in error_list:
+                        multi.remove_handle(handle)
+                        in_flight.discard(handle)
+                        self._finish(handle, report, error=error_message)
+                        free_handles.append(handle)
+                    if not queued:
+                        break
+                if now >= end_time and not backlog and not in_flight:
+                    break
+                # Wait for socket activity or next arrival.
+                wait_time = 0.05
+                if next_arrival < end_time:
+                    wait_time = max(0, min(wait_time, next_arrival - time.time()))
+                if in_flight:
+                    multi.select(wait_time)
+                elif wait_time:
+                    time.sleep(wait_time)
+        finally:
+            for handle in in_flight:
+                multi.remove_handle(handle)
+            for handle in list(in_flight) + free_handles:
+                handle.close()
+            multi.close()
+            report.elapsed = time.time() - start_time
+        self.log.info('Load report:\n{}'.format(report))
+        return report
+
+
+class RestSDKOperations(object):
+    """ Request builders of common RestSDK operations: search, download, upload and share. """
+
+    def __init__(self, parent_id='root', file_ids=None, upload_size=1024*64, search_limit=100, max_file_ids=10000):
+        """
+        :param parent_id: Folder to search and upload.
+        :param file_ids: Dict of username: list of file IDs for download and share. Uploaded files are added as well.
+        :param upload_size: Bytes of each uploaded file.
+        """
+        self.parent_id = parent_id
+        self.file_ids = {username: list(ids) for username, ids in (file_ids or {}).iteritems()}
+        self.search_limit = search_limit
+        self.max_file_ids = max_file_ids
+        self.payload = os.urandom(upload_size)
+        self.uploaded_ids = {} # username: uploaded file IDs, for cleanup.
+
+    def get_operations(self):
+        return {'search': self.search, 'download': self.download, 'upload': self.upload, 'share': self.share}
+
+    def _headers(self, client, content_type=None):
+        headers = {'Authorization': 'Bearer {}'.format(client.get_id_token())}
+        if content_type: headers['Content-Type'] = content_type
+        return headers
+
+    def _pick_file(self, client):
+        ids = self.file_ids.get(client.username)
+        if not ids:
+            return None
+        return random.choice(ids)
+
+    def search(self, client):
+        return RequestSpec('GET', '{}/sdk/v2/filesSearch/parents?ids={}&limit={}'.format(
+            client.url_prefix, self.parent_id, self.search_limit), headers=self._headers(client))
+
+    def download(self, client):
+        file_id = self._pick_file(client)
+        if not file_id:
+            return None
+        return RequestSpec('GET', '{}/sdk/v2/files/{}/content'.format(client.url_prefix, file_id),
+            headers=self._headers(client))
+
+    def upload(self, client):
+        def on_complete(status_code, headers):
+            # Location: '/sdk/v2/files/6cJ1JmK3ObY_N3EQlVGH-ASYmPVtOPmo46i5JqGj'
+            file_id = headers['location'].rsplit('/').pop()
+            self.uploaded_ids.setdefault(client.username, []).append(file_id)
+            ids = self.file_ids.setdefault(client.username, [])
+            if len(ids) < self.max_file_ids: ids.append(file_id)
+
+        body = client.gen_creation_body(file_content=self.payload, name='load_{}'.format(uuid4().hex),
+            parent_id=self.parent_id)
+        return RequestSpec('POST', '{}/sdk/v2/files?resolveNameConflict=1'.format(client.url_prefix),
+            headers=self._headers(client, content_type='multipart/related;boundary=foo'), body=body,
+            expect_status=(201,), on_complete=on_complete)
+
+    def share(self, client):
+        file_id = self._pick_file(client)
+        if not file_id:
+            return None
+        body = json.dumps({'fileID': file_id, 'entity': {'id': 'anybody', 'type': 'user'}, 'value': 'ReadFile'})
+        return RequestSpec('POST', '{}/sdk/v1/filePerms'.format(client.url_prefix),
+            headers=self._headers(client, content_type='application/json'), body=body, expect_status=(201, 409))
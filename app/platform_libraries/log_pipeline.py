@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+""" Non-blocking logging backend for the loggers created by common_utils.create_logger().
+
+A logger in pipeline has only one QueueHandler, which renders the message of record and appends it with the real
+handlers (file and stream handlers) to a deque. A single writer thread pops records and passes them to the real
+handlers, so the logging thread never waits for disk or terminal:
+
+    common_utils.enable_log_pipeline(max_bytes=50*1024*1024, rate_limit=200)
+    log.info('...') # Returns right after the record is queued.
+    get_log_pipeline().get_stats() # {'queued': ..., 'written': ..., 'dropped': ..., 'throttled': ...}
+
+Records lower than WARNING are throttled by the rate limit of each logger, and dropped if the queue is full.
+WARNING and above records are always queued.
+"""
+# std modules
+import atexit
+import gzip
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+
+#
+# Pipeline Settings
+#
+MAX_QUEUE = 100000 # Max records waiting in queue.
+IDLE_SLEEP = 0.05 # Seconds. How long the writer sleeps when queue is empty.
+FLUSH_TIMEOUT = 10 # Seconds.
+BACKUP_COUNT = 5 # Compressed log files to keep.
+THROTTLE_NOTE_INTERVAL = 10 # Seconds. Min interval of the notes of throttled records of a logger.
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """ RotatingFileHandler which compresses rotated files to FILE.1.gz, FILE.2.gz...
+
+    Only the process which created the handler rotates the file. Forked processes (e.g. device pool workers)
+    write to the same file and reopen it after it's rotated by the parent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        logging.handlers.RotatingFileHandler.__init__(self, *args, **kwargs)
+        self._owner_pid = os.getpid()
+
+    def shouldRollover(self, record):
+        if self._owner_pid == os.getpid():
+            return logging.handlers.RotatingFileHandler.shouldRollover(self, record)
+        self._reopen_if_rotated()
+        return 0
+
+    def _reopen_if_rotated(self):
+        """ Reopen the file if it's removed or replaced, like WatchedFileHandler. """
+        try:
+            file_stat = os.stat(self.baseFilename)
+        except OSError:
+            file_stat = None
+        if self.stream and file_stat and os.fstat(self.stream.fileno()).st_ino == file_stat.st_ino:
+            return
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if self.backupCount > 0:
+            for idx in xrange(self.backupCount - 1, 0, -1):
+                src_path = '{}.{}.gz'.format(self.baseFilename, idx)
+                dst_path = '{}.{}.gz'.format(self.baseFilename, idx + 1)
+                if os.path.exists(src_path):
+                    if os.path.exists(dst_path): os.remove(dst_path)
+                    os.rename(src_path, dst_path)
+            with open(self.baseFilename, 'rb') as src, gzip.open('{}.1.gz'.format(self.baseFilename), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.remove(self.baseFilename)
+        self.stream = self._open()
+
+
+class QueueHandler(logging.Handler):
+    """ Handler which queues records for the given handlers to the pipeline. """
+
+    def __init__(self, handlers, pipeline=None):
+        logging.Handler.__init__(self, level=min(handler.level for handler in handlers))
+        self.handlers = handlers
+        self.pipeline = pipeline or get_log_pipeline()
+        self.pipeline.add_handlers(handlers)
+
+    def handle(self, record):
+        # Not to take the handler lock.
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        self.pipeline.put(self.handlers, record)
+
+
+class _RateLimiter(object):
+    """ Token bucket of each logger name. """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Records per second.
+        :param burst: Max records at once, default is records of one second.
+        """
+        self.rate = float(rate)
+        self.burst = burst or max(rate, 1)
+        self._buckets = {} # name: (tokens, update time)
+        self._lock = threading.Lock() # Loggers are used by multiple threads.
+
+    def allow(self, name):
+        with self._lock:
+            now = time.time()
+            tokens, last = self._buckets.get(name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[name] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+
+class LogPipeline(object):
+
+    def __init__(self, max_queue=MAX_QUEUE):
+        self.max_queue = max_queue
+        self.rate_limiter = None
+        self._handlers = set() # Handlers used by writer.
+        self._pid = None
+        self._reset()
+        atexit.register(self._flush_at_exit)
+
+    def _reset(self):
+        """ Initiate runtime states, it's also for the child process forked from a process which used the pipeline. """
+        self._pid = os.getpid()
+        self._queue = deque()
+        self._throttled_by = {} # name: number of throttled records since the last note.
+        self._throttle_notes = {} # name: time of the last note.
+        self._writer = None
+        self._busy = False # Writer is handling a record.
+        self._stopped = False
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock() # For stats and throttle states, which are updated by multiple threads.
+        self.reset_stats()
+
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        self._reset()
+        # Writer thread of parent may be using handlers at forking.
+        if self.rate_limiter: self.rate_limiter._lock = threading.Lock()
+        for handler in self._handlers:
+            handler.createLock()
+            if isinstance(handler, logging.FileHandler) and handler.stream:
+                handler.stream = handler._open()
+        # multiprocessing child exits by os._exit() without atexit.
+        multiprocessing.util.Finalize(None, self.flush, exitpriority=0)
+
+    def configure(self, rate_limit=None, max_queue=None):
+        """ Update settings and return pipeline itself.
+
+        :param rate_limit: Records per second of each logger, 0 means no limit.
+        """
+        if rate_limit is not None: self.rate_limiter = _RateLimiter(rate_limit) if rate_limit else None
+        if max_queue is not None: self.max_queue = max_queue
+        return self
+
+    def add_handlers(self, handlers):
+        self._handlers.update(handlers)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.queued = 0
+            self.written = 0
+            self.dropped = 0 # Queue is full.
+            self.throttled = 0 # Over rate limit.
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                'queued': self.queued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'throttled': self.throttled,
+                'pending': len(self._queue)
+            }
+
+    #
+    # Producer
+    #
+    def put(self, handlers, record):
+        self._check_fork()
+        if record.levelno < logging.WARNING:
+            if self.rate_limiter and not self.rate_limiter.allow(record.name):
+                with self._stats_lock:
+                    self.throttled += 1
+                    self._throttled_by[record.name] = self._throttled_by.get(record.name, 0) + 1
+                return
+            if len(self._queue) >= self.max_queue:
+                with self._stats_lock: self.dropped += 1
+                return
+        throttled = None
+        if record.name in self._throttled_by:
+            with self._stats_lock:
+                if record.name in self._throttled_by and \
+                        record.created - self._throttle_notes.get(record.name, 0) >= THROTTLE_NOTE_INTERVAL:
+                    self._throttle_notes[record.name] = record.created
+                    throttled = self._throttled_by.pop(record.name)
+        if throttled:
+            self._append(handlers, logging.LogRecord(record.name, logging.WARNING, record.pathname, record.lineno,
+                '{} messages are throttled'.format(throttled), None, None))
+        self._append(handlers, record)
+
+    def _append(self, handlers, record):
+        self._prepare(record)
+        self._queue.append((handlers, record))
+        with self._stats_lock: self.queued += 1
+        if not self._writer:
+            self._start_writer()
+
+    def _prepare(self, record):
+        """ Render message and traceback in caller thread, since arguments and frames may be changed later. """
+        try:
+            record.msg = record.getMessage()
+        except Exception:
+            record.msg = '{!r} % {!r}'.format(record.msg, record.args)
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None
+
+    #
+    # Writer
+    #
+    def _start_writer(self):
+        with self._start_lock:
+            if self._writer:
+                return
+            self._stopped = False
+            self._writer = threading.Thread(target=self._write_loop, name='LogPipeline')
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._busy = True # Before popping, so flush() never sees an empty queue with a record on the way.
+            try:
+                handlers, record = self._queue.popleft()
+            except IndexError:
+                self._busy = False
+                if self._stopped:
+                    break
+                time.sleep(IDLE_SLEEP)
+                continue
+            try:
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            finally:
+                self._busy = False
+            with self._stats_lock: self.written += 1
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """ Wait for queued records to be written, return number of records still in queue. """
+        self._check_fork()
+        deadline = time.time() + timeout
+        while (self._queue or self._busy) and self._writer and self._writer.is_alive() and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self._queue)
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid():
+            return
+        self.flush()
+        self._stopped = True # Not to let daemon thread run at interpreter shutdown.
+        if self._writer: self._writer.join(IDLE_SLEEP * 2)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_log_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = LogPipeline()
+    return _pipeline
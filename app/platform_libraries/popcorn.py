@@ -244,15 +244,17 @@ def gen_popcorn_report(testcase, test_results, skip_error=False):
 
     return pr
 
-def upload_popcorn_report_to_server(data, popcorn_address='popcorn.wdc.com', source='PLATFORM'):
+def upload_popcorn_report_to_server(data, popcorn_address='popcorn.wdc.com', source='PLATFORM', session=None, timeout=None):
+    """ Upload report and return the response. Send request by session if it's given. """
     url = 'https://{0}/api/reports/automation?source={1}'.format(popcorn_address, source)
     headers = {'Content-Type': 'application/json',
                 'X-POPCORN-KEY': randomString(),
                 'X-POPCORN-BUILD-URL': data['executionSummary']['buildUrl']}
 
-    response = requests.post(url=url, data=json.dumps(data), headers=headers)
+    response = (session or requests).post(url=url, data=json.dumps(data), headers=headers, timeout=timeout)
     if not response.status_code == 200:
         print 'Upload popcorn json report to popcorn server failed !!!, response code:{0}, error log:{1}'.format(response.status_code, response.content)
+    return response
 
 def randomString(stringLength=10):
     """Generate a random string of fixed length """
@@ -5,8 +5,9 @@ __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 
 import logging
 import os
-import json
 import string
+import sys
+import threading
 import time
 import traceback
 import types
@@ -110,6 +111,57 @@ def partial_read_in_chunks(file_object, start_position, end_position, chunk_size
             read_offset = 0
         yield file_object.read(read_chunk)
 
+class _PageFetcher(threading.Thread):
+    """ Fetch one page in background. """
+
+    def __init__(self, fetch_page, page_token):
+        super(_PageFetcher, self).__init__(name='PageFetcher')
+        self.daemon = True
+        self.fetch_page = fetch_page
+        self.page_token = page_token
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.fetch_page(self.page_token)
+        except:
+            self.exc_info = sys.exc_info()
+
+    def get(self):
+        self.join()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+def iter_pages(fetch_page, page_token=None, prefetch=True):
+    """ Lazy function (generator) to read pages one by one until no next page.
+
+    [Arguments]
+        fetch_page: Function
+            Called with page token, it returns (data list of the page, next page token).
+        page_token: Any
+            Page token of the first page.
+        prefetch: Boolean
+            Fetch next page in background while caller is handling current page.
+    """
+    fetcher = None
+    while True:
+        if fetcher:
+            data_list, next_page_token = fetcher.get()
+        else:
+            data_list, next_page_token = fetch_page(page_token)
+        if not data_list: # no data return
+            return
+        fetcher = None
+        if next_page_token and prefetch:
+            fetcher = _PageFetcher(fetch_page, next_page_token)
+            fetcher.start()
+        yield data_list
+        if not next_page_token: # no next page
+            return
+        page_token = next_page_token
+
 def ignore_unknown_codec(string):
     """ Convert the given string to base string, and replace the unknown codec char by "_". """
     convert_string = []
@@ -169,49 +221,121 @@ def retry(func, excepts=None, retry_lambda=NotSet, delay=30, max_retry=20, log=N
 #
 # Request Tool Area
 #
+MAX_LOG_BODY_SIZE = 4096 # Bytes. Longer JSON body is truncated in log.
+_LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'warn': logging.WARNING,
+    'error': logging.ERROR, 'exception': logging.ERROR, 'critical': logging.CRITICAL}
+
+
+class RequestLogStats(object):
+    """ Cost of request/response logging. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.logged = 0
+        self.sampled_out = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        with self._lock:
+            self.logged += 1
+            self.seconds += seconds
+
+    def add_sampled_out(self):
+        with self._lock:
+            self.sampled_out += 1
+
+    def to_dict(self):
+        return {'logged': self.logged, 'sampled_out': self.sampled_out, 'seconds': round(self.seconds, 6)}
+
+request_log_stats = RequestLogStats()
+
+
+def is_log_enabled(log_func):
+    """ Return False if log_func is a method of logging.Logger and the message won't be output by any handler. """
+    logger = getattr(log_func, '__self__', None)
+    if not isinstance(logger, logging.Logger):
+        return True
+    level = _LOG_LEVELS.get(getattr(log_func, '__name__', None))
+    if level is None:
+        return True
+    if not logger.isEnabledFor(level):
+        return False
+    # Walk through handlers as Logger.callHandlers() does.
+    found = False
+    while logger:
+        for handler in logger.handlers:
+            found = True
+            if level >= handler.level:
+                return True
+        if not logger.propagate:
+            break
+        logger = logger.parent
+    # logging outputs the message by lastResort handler (py3) or warns once (py2) if no handler found.
+    return not found
+
+
+def _format_body(body):
+    """ Return body text to log: JSON body (up to MAX_LOG_BODY_SIZE) or short body, otherwise None. """
+    if not isinstance(body, basestring) or not body:
+        return None
+    if isinstance(body, unicode): # Not to raise UnicodeEncodeError by formatting it into str.
+        body = body.encode('utf-8')
+    if body.lstrip()[:1] in ('{', '['): # Looks like JSON, not to parse it.
+        if len(body) > MAX_LOG_BODY_SIZE:
+            return '{}...({} bytes)'.format(body[:MAX_LOG_BODY_SIZE], len(body))
+        return body
+    if 512 > len(body):
+        return body
+    return None
+
+
 def log_request(request, logger, debug_logger=None, reduce_token=False):
     if not debug_logger: debug_logger=logger
+    log_debug = is_log_enabled(debug_logger)
+    if not is_log_enabled(logger) and not log_debug:
+        return
+    start_time = time.time()
     logger('HTTP Request:')
     logger('* Method : {}'.format(request.method))
     logger('* URL    : {}'.format(request.url))
-    try:
-        if hasattr(request, 'body') and request.body:
-            try: # Print whole string if it is JSON string.
-                json.loads(request.body)
-                debug_logger('* Body   : {}'.format(request.body))
-            except ValueError:
-                if 512 > len(request.body):
-                    debug_logger('* Body   : {}'.format(request.body))
-    except:
-        pass
-    if reduce_token:
-        log_header = dict(request.headers)
-        if 'Authorization' in log_header:
-            log_header['Authorization'] = "*" + log_header['Authorization'][7:12] + "*" + log_header['Authorization'][-5:]
-        debug_logger('* Headers: \n{}'.format(pformat(log_header)))
-    else:
-        debug_logger('* Headers: \n{}'.format(pformat(request.headers)))
+    if log_debug: # Format body and headers only if they will be printed.
+        try:
+            body = _format_body(getattr(request, 'body', None))
+            if body: debug_logger('* Body   : {}'.format(body))
+        except:
+            pass
+        if reduce_token:
+            log_header = dict(request.headers)
+            if 'Authorization' in log_header:
+                log_header['Authorization'] = "*" + log_header['Authorization'][7:12] + "*" + log_header['Authorization'][-5:]
+            debug_logger('* Headers: \n{}'.format(pformat(log_header)))
+        else:
+            debug_logger('* Headers: \n{}'.format(pformat(request.headers)))
+    request_log_stats.add(time.time() - start_time)
 
 def log_response(response, logger, debug_logger=None, show_content=True):
     if not debug_logger: debug_logger=logger
+    log_debug = is_log_enabled(debug_logger)
+    if not is_log_enabled(logger) and not log_debug:
+        return
+    start_time = time.time()
     logger('HTTP Response:')
     logger('* Status Code : {}'.format(getattr(response, 'status_code', '')))
-    if show_content:
-        try:
-            if hasattr(response, 'content') and response.content:
-                try: # Print whole string if it is JSON string.
-                    json.loads(response.content)
-                    debug_logger('* Content: {}'.format(response.content))
-                except ValueError:
-                    if 512 > len(response.content):
-                        debug_logger('* Content: {}'.format(response.content))
-        except:
-            pass
-    
-    debug_logger('* Reason : {}'.format(getattr(response, 'reason', '')))
-    debug_logger('* Headers: \n{}'.format(pformat(getattr(response, 'headers', ''))))
+    if log_debug: # Format content and headers only if they will be printed.
+        if show_content:
+            try:
+                content = _format_body(getattr(response, 'content', None))
+                if content: debug_logger('* Content: {}'.format(content))
+            except:
+                pass
+        debug_logger('* Reason : {}'.format(getattr(response, 'reason', '')))
+        debug_logger('* Headers: \n{}'.format(pformat(getattr(response, 'headers', ''))))
     if hasattr(response, 'elapsed'):
         logger('* Seconds: {}'.format(response.elapsed.total_seconds()))
+    request_log_stats.add(time.time() - start_time)
 
 
 #
@@ -256,19 +380,19 @@ def hex_escape(s):
 def escape(s):
     return ''.join(c if c in printable else '' for c in s)
 
+# Terminal control sequences, ex: "\x1b[1;32m", "\x1b[K", "\x1b(B".
+ANSI_SEQUENCE = re.compile(r'\x1b\[[0-9;?]*[@-~]|\x1b[()][0-9A-Za-z]|\x1b[=>78]')
+# Terminal control sequences and the other non-printable characters (including "\r").
+ESCAPE_SEQUENCE = re.compile(ANSI_SEQUENCE.pattern + r'|[^\x20-\x7e\t\n\x0b\x0c]')
+
 @decode_unicode_args
 def replace_escape_sequence(string, show_hex=False):
     """Delete Linux control codes from serial output."""
     # replace unicode escape, followed by formatting (used by Linux
     # to format console output)
     if show_hex:
-        string = hex_escape(string)
-    else:
-        string = escape(string)
-    re1 = re.compile('(.)(\\[)(\\?)?(\\d+)([a-z])', re.IGNORECASE | re.DOTALL)
-    re2 = re.compile('(.)(\\[)(\\d+)(;)(\\d+)([a-z])', re.IGNORECASE | re.DOTALL)
-    string = re1.sub('', string)
-    return re2.sub('', string).strip().replace('\r', '')
+        return hex_escape(ANSI_SEQUENCE.sub('', string)).strip().replace('\r', '')
+    return ESCAPE_SEQUENCE.sub('', string).strip()
 
 
 # Sample logging tool.
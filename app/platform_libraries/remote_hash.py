@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+""" Batched file hashing on the device with a local cache.
+
+A manifest of paths is sent as quoted arguments of one command (split into several commands only if it is
+too long for the device), the device lists (size, inode, mtime) of the files in one pass, and only the files
+which are not in the local cache with the same (path, size, inode, mtime) are hashed, in several parallel jobs
+on the device. So hashing the same folders again in the next iteration costs only one round trip to list them.
+
+Commands are run by a function, so it works with SSH and ADB shell:
+
+    hasher = RemoteHasher(run_cmd=lambda cmd: ssh.execute_cmd(cmd, quiet=True)[0])
+    records = hasher.hash_files(['/data/wd/diskVolume0/dataset'])
+    print records['/data/wd/diskVolume0/dataset/a.jpg'].digest
+
+Paths with newlines are not supported, and paths with double quotes are not supported by ADB shell.
+"""
+# std modules
+import hashlib
+import json
+import os
+import pipes
+import threading
+from collections import namedtuple, OrderedDict
+
+# platform modules
+import common_utils
+
+
+#
+# Hasher Settings
+#
+MAX_COMMAND_LENGTH = 65536 # Bytes of one remote command, the limit of device is usually 128KB or more.
+JOBS = 4 # Parallel hash processes on device.
+# Seconds. Files modified more recently are not cached, since mtime of some file systems (ex: FAT) is not precise.
+MIN_CACHE_AGE = 2
+# Algorithm name: tool names on the device. "crc" is POSIX cksum, which is not the same as zlib.crc32.
+HASH_TOOLS = OrderedDict([
+    ('xxh64', ['xxh64sum', 'xxhsum']),
+    ('crc', ['cksum']),
+    ('md5', ['md5sum']),
+    ('sha1', ['sha1sum']),
+    ('sha256', ['sha256sum'])
+])
+
+
+# version is "inode mtime" with nanoseconds, cacheable is False if file is just modified.
+FileStat = namedtuple('FileStat', ['size', 'mtime', 'version', 'cacheable'])
+
+
+class HashRecord(object):
+
+    def __init__(self, path, size, mtime, algorithm, digest, version=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.algorithm = algorithm
+        self.digest = digest
+        self.version = version
+
+    def to_dict(self):
+        return {'path': self.path, 'size': self.size, 'mtime': self.mtime, 'algorithm': self.algorithm,
+            'digest': self.digest, 'version': self.version}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def __repr__(self):
+        return 'HashRecord({}, size={}, mtime={}, {}={})'.format(self.path, self.size, self.mtime, self.algorithm,
+            self.digest)
+
+
+@common_utils.logger()
+class RemoteHasher(object):
+
+    def __init__(self, run_cmd, algorithm='md5', jobs=JOBS, cache_path=None, max_command_length=MAX_COMMAND_LENGTH):
+        """
+        :param run_cmd: Function to execute a shell command on the device and return stdout. It's called with
+                        keyword argument "timeout" (seconds of each command) if caller of hash methods gives one.
+        :param algorithm: Default algorithm: md5, sha1, sha256, crc, xxh64 or "auto" for the cheapest one on device.
+        :param jobs: Number of hash processes run in parallel on device.
+        :param cache_path: JSON file to keep the cache across test processes.
+        """
+        self.run_cmd = run_cmd
+        self.algorithm = algorithm
+        self.jobs = jobs
+        self.cache_path = cache_path
+        self.max_command_length = max_command_length
+        self._lock = threading.Lock()
+        self._tools = None # algorithm: command prefix, detected at the first call.
+        self._stat_supported = False
+        self._cache = {} # (path, algorithm): HashRecord
+        self.reset_stats()
+        if cache_path and os.path.exists(cache_path):
+            self.load_cache()
+
+    def reset_stats(self):
+        self.round_trips = 0
+        self.cache_hits = 0
+        self.hashed_files = 0
+        self.hashed_bytes = 0
+
+    def get_stats(self):
+        return {
+            'round_trips': self.round_trips,
+            'cache_hits': self.cache_hits,
+            'hashed_files': self.hashed_files,
+            'hashed_bytes': self.hashed_bytes,
+            'cached_files': len(self._cache)
+        }
+
+    #
+    # Cache
+    #
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                records = [HashRecord.from_dict(data) for data in json.load(f)]
+        except (IOError, ValueError, TypeError) as e:
+            self.log.warning('Ignore hash cache {}: {}'.format(self.cache_path, repr(e)))
+            return
+        with self._lock:
+            for record in records:
+                self._cache[(record.path, record.algorithm)] = record
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        with self._lock:
+            records = [record.to_dict() for record in self._cache.itervalues()]
+        with open(self.cache_path, 'w') as f:
+            json.dump(records, f)
+
+    #
+    # Remote Commands
+    #
+    def _run(self, command, timeout=None):
+        self.round_trips += 1
+        if timeout:
+            return self.run_cmd(command, timeout=timeout) or ''
+        return self.run_cmd(command) or ''
+
+    def _iter_commands(self, prefix, args, suffix=''):
+        """ Yield commands of "prefix args suffix" with quoted args, split them if the command is too long. """
+        batch = []
+        length = len(prefix) + len(suffix)
+        for arg in args:
+            quoted = pipes.quote(arg)
+            if batch and length + len(quoted) + 1 > self.max_command_length:
+                yield batch
+                batch = []
+                length = len(prefix) + len(suffix)
+            batch.append(quoted)
+            length += len(quoted) + 1
+        if batch:
+            yield batch
+
+    def detect_tools(self):
+        """ Find hash tools on device. """
+        names = [name for tools in HASH_TOOLS.itervalues() for name in tools]
+        output = self._run(
+            'for t in {}; do command -v $t >/dev/null 2>&1 && echo $t; done; '
+            'command -v busybox >/dev/null 2>&1 && echo busybox; '
+            'stat -c %s / >/dev/null 2>&1 && echo stat; true'.format(' '.join(names)))
+        found = set(line.strip() for line in output.splitlines())
+        tools = OrderedDict()
+        for algorithm, names in HASH_TOOLS.iteritems():
+            for name in names:
+                if name in found:
+                    tools[algorithm] = name
+                    break
+            else:
+                if 'busybox' in found and algorithm in ('md5', 'sha1', 'sha256', 'crc'):
+                    tools[algorithm] = 'busybox {}'.format(HASH_TOOLS[algorithm][0])
+        self._tools = tools
+        self._stat_supported = 'stat' in found
+        self.log.debug('Hash tools on device: {}'.format(tools))
+        return tools
+
+    def get_algorithms(self):
+        if self._tools is None: self.detect_tools()
+        return self._tools.keys()
+
+    def _resolve_algorithm(self, algorithm):
+        if self._tools is None: self.detect_tools()
+        algorithm = algorithm or self.algorithm
+        if algorithm == 'auto':
+            if not self._tools:
+                raise RuntimeError('No hash tool found on device')
+            return self._tools.keys()[0] # The cheapest one.
+        if algorithm not in self._tools:
+            raise RuntimeError('Hash tool of {} is not found on device, available: {}'.format(algorithm, self._tools.keys()))
+        return algorithm
+
+    #
+    # Public Methods
+    #
+    def list_files(self, paths, max_depth=None, timeout=None):
+        """ Return OrderedDict of {file path: FileStat} of files and files under folders in paths.
+        Values of FileStat are None if "stat" is not supported on device.
+
+        :param max_depth: Max depth of folders to list, ex: 1 for files directly in the folder.
+        :param timeout: Seconds of each command on device, use the default of run_cmd if it's None.
+        """
+        if self._tools is None: self.detect_tools()
+        options = '-maxdepth {} '.format(max_depth) if max_depth else ''
+        if self._stat_supported:
+            # %y is mtime with nanoseconds (if file system supports it), "|" separates it from path.
+            prefix = 'date +%s; find'
+            suffix = " {}-type f -exec stat -c '%s %Y %i %y|%n' {{}} + 2>/dev/null".format(options)
+        else:
+            prefix = 'find'
+            suffix = ' {}-type f 2>/dev/null'.format(options)
+        files = OrderedDict()
+        for batch in self._iter_commands(prefix, paths, suffix):
+            lines = self._run('{} {}{}'.format(prefix, ' '.join(batch), suffix), timeout).splitlines()
+            now = None # Time of device.
+            if self._stat_supported and lines:
+                try:
+                    now = int(lines.pop(0))
+                except ValueError:
+                    pass
+            for line in lines:
+                line = line.rstrip('\r')
+                if not line:
+                    continue
+                if self._stat_supported:
+                    info, path = line.split('|', 1)
+                    size, mtime, version = info.split(' ', 2)
+                    mtime = int(mtime)
+                    files[path] = FileStat(int(size), mtime, version, now is None or now - mtime >= MIN_CACHE_AGE)
+                else:
+                    files[line] = FileStat(None, None, None, False)
+        return files
+
+    def hash_files(self, paths, algorithm=None, max_depth=None, timeout=None):
+        """ Return OrderedDict of {file path: HashRecord} of files and files under folders in paths.
+        Files not found are not in the result.
+
+        :param timeout: Seconds of each command on device, use the default of run_cmd if it's None.
+        """
+        algorithm = self._resolve_algorithm(algorithm)
+        files = self.list_files(paths, max_depth=max_depth, timeout=timeout)
+        records = OrderedDict()
+        to_hash = []
+        for path, file_stat in files.iteritems():
+            record = self._cache.get((path, algorithm))
+            if record and file_stat.size is not None and record.size == file_stat.size and \
+                    record.version == file_stat.version:
+                records[path] = record
+                self.cache_hits += 1
+            else:
+                records[path] = None
+                to_hash.append(path)
+        if to_hash:
+            digests = self._hash(to_hash, algorithm, timeout)
+            with self._lock:
+                for path in to_hash:
+                    if path not in digests: # Removed after listed.
+                        del records[path]
+                        continue
+                    file_stat = files[path]
+                    records[path] = HashRecord(path, file_stat.size, file_stat.mtime, algorithm, digests[path],
+                        version=file_stat.version)
+                    if file_stat.cacheable:
+                        self._cache[(path, algorithm)] = records[path]
+                    if file_stat.size is not None:
+                        self.hashed_bytes += file_stat.size
+                    self.hashed_files += 1
+            self.save_cache()
+        return records
+
+    def hash_folder(self, path, algorithm=None, timeout=None):
+        """ Return one digest of all files under path, which is the same as
+        "find path -type f -exec md5sum {} + | awk '{print $1}' | sort | md5sum" with md5.
+        """
+        digests = sorted(record.digest + '\n' for record in self.hash_files([path], algorithm=algorithm, timeout=timeout).itervalues())
+        return hashlib.md5(''.join(digests)).hexdigest()
+
+    def _hash(self, paths, algorithm, timeout=None):
+        """ Hash files on device, return {path: digest}. """
+        tool = self._tools[algorithm]
+        digests = {}
+        jobs = max(1, min(self.jobs, len(paths)))
+        for batch in self._iter_commands(tool, paths, ' ' * 30 * jobs):
+            # Split the batch into jobs running in background.
+            groups = [batch[idx::jobs] for idx in xrange(jobs) if batch[idx::jobs]]
+            command = ' '.join('({} {} 2>/dev/null) &'.format(tool, ' '.join(group)) for group in groups) + ' wait'
+            for line in self._run(command, timeout).splitlines():
+                line = line.rstrip('\r')
+                if not line:
+                    continue
+                if algorithm == 'crc': # "crc size path"
+                    digest, _, path = line.split(' ', 2)
+                else: # "digest  path" or "digest *path"
+                    digest, path = line.split(None, 1)
+                    if path.startswith('*'): path = path[1:]
+                digests[path] = digest
+        return digests
@@ -3,10 +3,11 @@
 # std modules
 import json
 import os
+import stat
 import sys
 import time
 import urllib
-from datetime import datetime
+from datetime import datetime, timedelta
 from itertools import count
 from uuid import uuid4
 
@@ -21,7 +22,11 @@ from platform_libraries.cloud_api import CloudAPI
 from platform_libraries.cloud_environment import RestEnvironment
 from platform_libraries.http_client import HTTPRequester
 from platform_libraries.constants import Kamino 
-from platform_libraries.pyutils import partial_read_in_chunks, read_in_chunks, retry
+from platform_libraries.pyutils import iter_pages, partial_read_in_chunks, read_in_chunks, retry
+from platform_libraries.restsdk_download import StreamingDownloader
+from platform_libraries.restsdk_upload import DirectoryUploader, ResumableUploader
+from platform_libraries.restsdk_walker import BulkDeleter, ConcurrentTreeWalker
+from platform_libraries.token_cache import get_token_cache
 
 
 class ItemParser(object):
@@ -52,30 +57,14 @@ class RestAPI(HTTPRequester):
 
     @property
     def owner_access_token(self):
-        def do_refresh_owner_token():
-            response = self._do_refresh_token(RestAPI.owner_refresh_token)
-            self.log.debug('Refresh Owner ID token complete')
-            RestAPI._owner_id_token = response['id_token']
-            RestAPI.owner_token_time = datetime.now()
-            self.log.debug('Refreshed Owner ID token: {}'.format(RestAPI._owner_id_token))
-            return RestAPI._owner_id_token
-
         self.log.debug('Getting ID token of owner: {}'.format(RestAPI.owner_username))
-        if RestAPI.owner_token_time:
-            return self.get_existing_id_token(
-                RestAPI.owner_token_time, RestAPI._owner_id_token, refresh_token_func=do_refresh_owner_token)
-
-        # Get a new token.
-        response = self._get_id_token(RestAPI.owner_username, RestAPI.owner_password)
-        self.log.info('Get new Owner ID token complete')
-        RestAPI._owner_id_token = response['id_token']
-        #RestAPI.owner_access_token = response['access_token']
-        RestAPI.owner_refresh_token = response['refresh_token']
-        self.log.debug('Owner ID token: {}'.format(RestAPI._owner_id_token))
-        #self.log.debug('Owner Access token: {}'.format(RestAPI.owner_access_token))
-        self.log.debug('Owner Refresh token: {}'.format(RestAPI.owner_refresh_token))
-        # If first user attached to device set owner access token
-        RestAPI.owner_token_time = datetime.now()
+        entry = self.token_cache.get_token(
+            key=self.get_token_key(RestAPI.owner_username),
+            login_func=lambda: self._get_id_token(RestAPI.owner_username, RestAPI.owner_password),
+            refresh_func=self._do_refresh_token)
+        RestAPI._owner_id_token = entry.id_token
+        RestAPI.owner_refresh_token = entry.refresh_token
+        RestAPI.owner_token_time = datetime.fromtimestamp(entry.token_time)
         return RestAPI._owner_id_token
 
     @owner_access_token.setter
@@ -101,6 +90,8 @@ class RestAPI(HTTPRequester):
         self.access_token = None
         self.refresh_token = None
         self.id_token_time = None
+        self.token_cache = get_token_cache() # Tokens shared by all RestAPI objects of the same user.
+        self.token_entry = None # TokenEntry which id_token is from.
         # Auth0 token expired time is 86400 secs (24 hours)
         # set the expired time to 23 hours and try to refresh token before it's expired
         self.id_token_expired_time = 23 * 60 * 60
@@ -170,6 +161,7 @@ class RestAPI(HTTPRequester):
         self.access_token = access_token
         self.refresh_token = refresh_token
         self.id_token_time = id_token_time
+        self.token_entry = None
         self.device_id = device_id
 
     def update_url_prefix(self, url_prefix=None):
@@ -311,13 +303,14 @@ class RestAPI(HTTPRequester):
             self.error('Failed to get ID token.', response)
         return response.json()
 
-    def get_existing_id_token(self, id_token_time, existing_id_token, refresh_token_func=None):
-        if not self.reduce_log: self.log.debug('ID token already exist, checking the expire time')
+    def get_existing_id_token(self, id_token_time, existing_id_token, refresh_token_func=None, reduce_log=None):
+        if reduce_log is None: reduce_log = self.reduce_log
+        if not reduce_log: self.log.debug('ID token already exist, checking the expire time')
         current_time = datetime.now()
         time_passed = (current_time - id_token_time).seconds
         # Token isn't timeout.
         if time_passed < self.id_token_expired_time:
-            if not self.reduce_log: 
+            if not reduce_log:
                 self.log.debug('Use existed ID token, it will be expired in {} seconds'.
                     format(self.id_token_expired_time - time_passed))
                 self.log.debug('ID token: {}'.format(existing_id_token))
@@ -326,18 +319,35 @@ class RestAPI(HTTPRequester):
         self.log.info('ID token expired, refresh the ID token')
         return refresh_token_func() if refresh_token_func else self.do_refresh_token()
 
-    def get_id_token(self):
-        if not self.reduce_log: self.log.debug('Getting ID token of user: {}'.format(self.username))
-        if self.id_token_time:
-            return self.get_existing_id_token(self.id_token_time, self.id_token)
+    def get_token_key(self, username=None):
+        return (self.env, username or self.username)
+
+    def _apply_token_entry(self, entry):
+        self.token_entry = entry
+        self.id_token = entry.id_token
+        self.access_token = entry.access_token
+        self.refresh_token = entry.refresh_token
+        self.id_token_expired_time = entry.expired_time
+        self.id_token_time = datetime.fromtimestamp(entry.token_time)
+        return self.id_token
 
-        # Get a new token.
-        response = self._get_id_token(self.username, self.password)
+    def get_id_token(self, reduce_log=None):
+        if reduce_log is None: reduce_log = self.reduce_log
+        if not reduce_log: self.log.debug('Getting ID token of user: {}'.format(self.username))
+        if self.id_token_time and (not self.token_entry or self.token_entry.id_token != self.id_token):
+            # Token is not from token cache (ex: given by test), keep using it until it expired.
+            return self.get_existing_id_token(self.id_token_time, self.id_token, reduce_log=reduce_log)
+
+        # Get token from token cache, which logs in or refreshes token only if it is needed.
+        entry = self.token_cache.get_token(
+            key=self.get_token_key(),
+            login_func=lambda: self._get_id_token(self.username, self.password),
+            refresh_func=self._do_refresh_token)
+        if entry is self.token_entry:
+            return self.id_token
+        # New login, or replaced by other instance or background refresher.
+        self._apply_token_entry(entry)
         self.log.info('Get new ID token complete')
-        self.id_token = response['id_token']
-        self.access_token = response['access_token']
-        self.refresh_token = response['refresh_token']
-        self.id_token_expired_time = int(response['expires_in']) - 600  # The unit is second. Minus 600 seconds is for buffer.
         self.log.debug('ID token: {}'.format(self.id_token))
         self.log.debug('Access token: {}'.format(self.access_token))
         self.log.debug('Refresh token: {}'.format(self.refresh_token))
@@ -345,10 +355,10 @@ class RestAPI(HTTPRequester):
         # If first user attached to device set owner access token
         if self.id == 0:
             self.owner_access_token = self.id_token
-        self.id_token_time = datetime.now()
         return self.id_token
 
     def get_fresh_id_token(self):
+        self.token_cache.invalidate(self.get_token_key(), self.id_token)
         self.id_token_time = None
         return self.get_id_token()
 
@@ -391,6 +401,12 @@ class RestAPI(HTTPRequester):
 
             :return: Access token in String format. ex. '3931eb3d-7ee2-4257-988f-3aeb7f6d520d'
         """
+        entry = self.token_cache.get_entry(self.get_token_key())
+        if entry and entry.refresh_token == self.refresh_token: # Shared token, refresh it only once.
+            self._apply_token_entry(self.token_cache.refresh(
+                key=self.get_token_key(), refresh_func=self._do_refresh_token, stale_id_token=self.id_token))
+            self.log.debug('Refreshed ID token: {}'.format(self.id_token))
+            return self.id_token
         response = self._do_refresh_token(self.refresh_token)
         self.log.debug('Refresh ID token complete')
         self.id_token = response['id_token']
@@ -1090,6 +1106,20 @@ class RestAPI(HTTPRequester):
             self.error('Failed to execute get file content.', response)
         return response
 
+    def download_file(self, file_id, sink=None, hash_algorithm='md5', parallel=1, range_size=1024*1024*8,
+            chunk_size=1024*1024, use_mmap=False, size=None, timeout=120, api_version='v3'):
+        """ Download file content and calculate its digest in one pass (see StreamingDownloader).
+
+        :param sink: None or os.devnull to drop data, a file path, or a file object.
+        :param parallel: Number of ranged GET requests at the same time for file larger than range_size.
+        :param api_version: Version of file content API, 'v3' (get_file_content_v3) or 'v2'.
+        :return: DownloadReport object, which has size, digest, ttfb and throughput.
+        """
+        self.log.debug('Download file content with ID: {}'.format(file_id))
+        downloader = StreamingDownloader(self, chunk_size=chunk_size, parallel=parallel, range_size=range_size,
+            hash_algorithm=hash_algorithm, timeout=timeout, log=self.log, api_version=api_version)
+        return downloader.download(file_id, sink=sink, use_mmap=use_mmap, size=size)
+
     def get_permission(self, file_id, user_id=None, entity_id=None, entity_type='user'):
         """
             Get the local folder/file permission of a user
@@ -1618,32 +1648,102 @@ class RestAPI(HTTPRequester):
     def _search_data_until_limit(self, search_method, search_kargs={}, field_keep_keys=None,
             limit=None, data_key='files'):
         """ Get "limit" number of data with search method. Get all if limit is not specified. """
-        query_args = search_kargs.copy()
-        return_list = []
+        return list(self._iter_search_data(search_method, search_kargs, field_keep_keys, limit, prefetch=False))
+
+    def _iter_search_data(self, search_method, search_kargs=None, field_keep_keys=None, limit=None, prefetch=True,
+            item_getter=None):
+        """ Lazy version of _search_data_until_limit(), yield data one by one with search method.
+
+        :param search_method: Method which accept "page_token" and return (data list, next page token).
+        :param field_keep_keys: Only keep these keys in each data to lighten data size.
+        :param limit: Stop after yielding "limit" number of data. Yield all if limit is not specified.
+        :param prefetch: Search next page in background while caller is handling current page.
+        :param item_getter: Function to take the data out of each item before keeping keys.
+        """
+        query_args = dict(search_kargs or {})
+        first_page_token = query_args.pop('page_token', None)
         residual_num = limit or -1
-        while residual_num:
-            data_list, next_page_token = search_method(**query_args)
-            query_args['page_token'] = next_page_token
-            if field_keep_keys: # Lighten data size.
-                data_list = [{key: data[key] for key in field_keep_keys} for data in data_list]
-
-            num_of_data = len(data_list)
-            if not num_of_data: # no data return
-                break
-            # Unlimit case always append data.
-            if residual_num == -1:
-                return_list.extend(data_list)
-            # Or append sufficient data to achieve limit number. 
-            else:
-                if num_of_data > residual_num:
-                    decrease_num = residual_num
-                else:
-                    decrease_num = num_of_data
-                residual_num-=decrease_num
-                return_list.extend(data_list[:decrease_num])
-            if not next_page_token: # no next page
+
+        def fetch_page(page_token):
+            return search_method(page_token=page_token, **query_args)
+
+        for data_list in iter_pages(fetch_page, first_page_token, prefetch):
+            for data in data_list:
+                if item_getter: data = item_getter(data)
+                if field_keep_keys: # Lighten data size.
+                    data = {key: data[key] for key in field_keep_keys if key in data}
+                yield data
+                residual_num -= 1
+                if not residual_num:
+                    return
+
+    def iter_files_by_parent(self, parent_id='root', fields=None, limit=None, page_size=1000, prefetch=True, timeout=120):
+        """ Lazily yield files/folders under parent_id page by page (see search_file_by_parent()).
+
+        :param fields: List of keys to keep in each item, also requested as "fields" of API.
+        :param limit: Maximum number of items to yield. Yield all if it is not specified.
+        :param page_size: Number of items per request.
+        :param prefetch: Search next page in background while caller is handling current page.
+        """
+        search_kargs = {'parent_id': parent_id, 'limit': page_size, 'timeout': timeout}
+        if fields: search_kargs['fields'] = ','.join(fields)
+        return self._iter_search_data(self.search_file_by_parent, search_kargs, field_keep_keys=fields,
+            limit=limit, prefetch=prefetch)
+
+    def iter_search_text(self, keyword, fields=None, limit=None, page_size=1000, prefetch=True):
+        """ Lazily yield matched files of search_file_by_text() page by page.
+
+        :return: Generator of the "file" object of each match.
+        Other parameters refer to iter_files_by_parent().
+        """
+        search_kargs = {'keyword': keyword, 'limit': page_size}
+        if fields: search_kargs['fields'] = ','.join(fields)
+        return self._iter_search_data(self.search_file_by_text, search_kargs, field_keep_keys=fields,
+            limit=limit, prefetch=prefetch, item_getter=lambda match: match.get('file', match))
+
+    def iter_time_groups(self, end_time, unit, mime_groups, fields=None, limit=None, page_size=1000, prefetch=True):
+        """ Lazily yield media time groups from end_time to the oldest one (see get_media_time_groups()).
+
+        mediaTimeGroups API has no page token, so the next page is searched by moving end_time to
+        just before the oldest "minTime" of current page. minTime and maxTime are always requested, and
+        removed from items if they are not in fields.
+        Other parameters refer to iter_files_by_parent().
+        """
+        seen_groups = set()
+        # Paging and dedup need minTime and maxTime, items are reduced to the caller's fields later.
+        search_fields = fields + [key for key in ('minTime', 'maxTime') if key not in fields] if fields else None
+
+        def search_time_groups(page_token):
+            groups = self.get_media_time_groups(end_time=page_token, unit=unit, mime_groups=mime_groups,
+                fields=','.join(search_fields) if search_fields else None, limit=page_size)
+            # Drop groups returned by previous page.
+            new_groups = []
+            for group in groups:
+                group_key = (group.get('minTime'), group.get('maxTime'))
+                if group_key in seen_groups:
+                    continue
+                seen_groups.add(group_key)
+                new_groups.append(group)
+            min_times = [group['minTime'] for group in groups if group.get('minTime')]
+            if len(groups) < page_size or not new_groups or not min_times:
+                return new_groups, None
+            return new_groups, self._time_before(min(min_times))
+
+        return self._iter_search_data(search_time_groups, {'page_token': end_time}, field_keep_keys=fields,
+            limit=limit, prefetch=prefetch)
+
+    @staticmethod
+    def _time_before(time_string):
+        """ Return the API time string 1 millisecond before the given one, ex: 2000-05-09T07:00:45.175Z """
+        for time_format in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+            try:
+                dt = datetime.strptime(time_string, time_format)
                 break
-        return return_list
+            except ValueError:
+                continue
+        else:
+            raise ValueError('Unknown time format: {}'.format(time_string))
+        return (dt - timedelta(milliseconds=1)).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
 
     def clean_user_root_by_rm(self, adb_inst, timeout=60*60*12, name_list=None):
         """ Delete data in owner's home directory with specified name list or all. (Use "adb shell rm -rf") 
@@ -1658,35 +1758,33 @@ class RestAPI(HTTPRequester):
             rm_path = '{0}{1}/{2}'.format(Kamino.USER_ROOT_PATH, self.get_user_id(escape=True), name)
             adb_inst.executeShellCommand(cmd='rm -rf {}'.format(rm_path), timeout=timeout)
 
-    def clean_user_root_by_delete_each(self):
+    def clean_user_root_by_delete_each(self, max_workers=8):
         """ Delete data in owner's home directory by delete each files and each folders. 
+        Files are deleted while walking folders (each folder is deleted after it is fully listed),
+        then folders are deleted from bottom to top level.
         Note: Not check with "Family" folder can not removed issue.
+
+        :param max_workers: Number of threads to walk folders and number of threads to delete data.
         """
         self.log.info("Delete data in owner's home directory.")
-        all_folder_ids = []
-        # Handle root parent.
-        file_id_list, sub_folder_ids = self.walk_folder(search_parent_id='root')
-        self.log.info("Delete files...")
-        for file_id in file_id_list:
-            self.delete_file(data_id=file_id)
-        all_folder_ids.extend(sub_folder_ids)
-
-        # Search sub-folders from top to bottom.
-        while sub_folder_ids:
-            next_round_ids = []
-            for folder_id in sub_folder_ids:
-                file_id_list, folder_id_list = self.walk_folder(search_parent_id=folder_id)
+        folder_ids_by_depth = {}
+        walker = ConcurrentTreeWalker(self, max_workers=max_workers, item_parser=ItemParser.only_id, log=self.log)
+        deleter = BulkDeleter(self, max_workers=max_workers, log=self.log)
+
+        def walk_file_ids(): # Stream file IDs to deleter and collect folder IDs by level.
+            for folder_id, depth, file_id_list, sub_folder_ids in walker.walk(parent_id='root', whole_folder=True):
+                folder_ids_by_depth.setdefault(depth+1, []).extend(sub_folder_ids)
                 for file_id in file_id_list:
-                    self.delete_file(data_id=file_id)
-                next_round_ids+=folder_id_list # Collect deeper level sub-folder IDs.
-            sub_folder_ids = next_round_ids
-            all_folder_ids.extend(sub_folder_ids)
-            
+                    yield file_id
+
+        self.log.info("Delete files...")
+        deleter.delete(walk_file_ids())
         # Delete all folder from bottom to top.
         self.log.info("Delete folders...")
-        all_folder_ids.reverse()
-        for folder_id in all_folder_ids:
-            self.delete_file(data_id=folder_id)
+        for depth in sorted(folder_ids_by_depth, reverse=True):
+            deleter.delete(folder_ids_by_depth[depth])
+        self.log.info('Clean user root: {} data deleted in {:.2f} sec ({:.2f} items/sec)'.format(
+            deleter.deleted, deleter.elapsed, deleter.items_per_sec()))
 
     def walk_folder(self, search_parent_id, scroll_limit=1000, item_parser=ItemParser.only_id):
         """ Just browse all items in specified folder page by page until no next page. """
@@ -1709,6 +1807,15 @@ class RestAPI(HTTPRequester):
             if not next_page_token:
                 return file_list, folder_list
 
+    def walk_tree(self, search_parent_id='root', max_workers=8, scroll_limit=1000, item_parser=ItemParser.only_id):
+        """ Walk all sub-folders of search_parent_id concurrently (BFS).
+
+        :return: Generator of (folder_id, depth, file_list, sub_folder_list) for each page of each folder.
+        """
+        walker = ConcurrentTreeWalker(self, max_workers=max_workers, scroll_limit=scroll_limit, item_parser=item_parser,
+            log=self.log)
+        return walker.walk(parent_id=search_parent_id)
+
     def usb_slurp(self, usb_name=None, folder_name=None, data_id=None, dest_parent_id='', timeout=3600, wait_until_done=True, api_version='v1'):
         """
             Copy entire data of the first found USB to owner's home directory with USB slurp API 
@@ -2278,9 +2385,11 @@ class RestAPI(HTTPRequester):
             self.error('Failed to execute deleting resumable file', response)
         return response
 
-    def upload_resumable_file_content(self, file_id, data=None, offset=None, done=False, truncate=False, timeout=120):
+    def upload_resumable_file_content(self, file_id, data=None, offset=None, done=False, truncate=False, timeout=120,
+            reduce_log=None):
         """ REF: http://build-docs.wdmv.wdc.com/docs/restsdk.html#update-resumable-file-content """
-        if not self.reduce_log: self.log.debug('Uploading resumable file content with ID: {}'.format(file_id))
+        if reduce_log is None: reduce_log = self.reduce_log
+        if not reduce_log: self.log.debug('Uploading resumable file content with ID: {}'.format(file_id))
         params = []
         if offset: params.append('offset={}'.format(offset))
         if done: params.append('done=true')
@@ -2290,7 +2399,7 @@ class RestAPI(HTTPRequester):
         response = self.bearer_request(
             method='PUT',
             url='{0}/sdk/v2/files/{1}/resumable/content{2}'.format(self.url_prefix, file_id, params_str),
-            data=data, timeout=timeout
+            data=data, timeout=timeout, reduce_log=reduce_log
         )
         if response.status_code != 204:
             self.error('Failed to execute uploading resumable file content', response)
@@ -2355,7 +2464,7 @@ class RestAPI(HTTPRequester):
 
     def chuck_upload_file(self, file_object, file_name=None, file_id=None, start_offset=0, raise_error=True,
             resolve_name_conflict=False, upload_chunk_size=1024*1024*2, read_chunk_size=1024*2, timeout=120,
-            set_global_timeout=True, parent_folder=None, **kwargs):
+            set_global_timeout=True, parent_folder=None, max_in_flight=1, chunk_retry=0, **kwargs):
         """ Upload a file with generator chuck by chuck. This way is the same as Android APP (chuck size: 2MB).
 
         :param file_object: A file object or readable object.
@@ -2365,11 +2474,30 @@ class RestAPI(HTTPRequester):
         :param raise_error: Raise ChuckUploadFailed exception when it is True.
         :param upload_chunk_size: Chunk size for uploading. Android APP is 2 MB.
         :param read_chunk_size: Chunk size for read from file to reduce memory loading.
+                                Not used for local file, which is memory-mapped (see ResumableUploader).
+        :param max_in_flight: Number of chunk requests sent at the same time (local file only).
+        :param chunk_retry: Retry times of each chunk request (local file only).
         """
         self.log.debug('Chuck upload file: {} ...'.format(file_name if file_name else file_id))
         # Hot fix for timeout not work for uploading.
         if set_global_timeout:
             self.set_global_timeout(timeout)
+        if self._is_local_file(file_object):
+            try:
+                uploader = ResumableUploader(self, chunk_size=upload_chunk_size, max_in_flight=max_in_flight,
+                    chunk_retry=chunk_retry, timeout=timeout, log=self.log)
+                report = uploader.upload(file_object=file_object, file_name=file_name, file_id=file_id,
+                    start_offset=start_offset, resolve_name_conflict=resolve_name_conflict, parent_folder=parent_folder, **kwargs)
+                if not report.file_id:
+                    return None, None
+                return report.file_id, None
+            except RestAPI.ChuckUploadFailed as e:
+                if raise_error:
+                    raise
+                return (e.file_id, e.start_offset) if e.file_id else (file_name, None)
+            finally:
+                if set_global_timeout:
+                    self.reset_global_timeout()
         # Estimate file offset.
         file_object.seek(0, 2) # Seek to end of file.
         end_position = file_object.tell()
@@ -2427,6 +2555,29 @@ class RestAPI(HTTPRequester):
             if set_global_timeout:
                 self.reset_global_timeout()
 
+    @staticmethod
+    def _is_local_file(file_object):
+        """ Return True if file_object is a regular file on local disk, which can be memory-mapped. """
+        try:
+            return stat.S_ISREG(os.fstat(file_object.fileno()).st_mode)
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+
+    def upload_local_file(self, file_path, file_name=None, file_id=None, start_offset=None, upload_chunk_size=1024*1024*2,
+            max_in_flight=1, chunk_retry=3, timeout=120, **kwargs):
+        """ Upload a local file with memory-mapped chunks and return the throughput report.
+
+        :param file_id: File ID of the existing resumable file to resume, committed offset is asked from device
+                        if start_offset is not specified.
+        :return: UploadReport object.
+        Other parameters refer to ResumableUploader.
+        """
+        uploader = ResumableUploader(self, chunk_size=upload_chunk_size, max_in_flight=max_in_flight,
+            chunk_retry=chunk_retry, timeout=timeout, log=self.log)
+        if not file_name and not file_id:
+            file_name = os.path.basename(file_path)
+        return uploader.upload(file_path=file_path, file_name=file_name, file_id=file_id, start_offset=start_offset, **kwargs)
+
     def recursive_upload(self, path, parent_id='root', chunk_size=1024*2, **kwargs):
         """ Upload entire specified folder or upload specified file.
         """
@@ -2440,17 +2591,30 @@ class RestAPI(HTTPRequester):
                 for file_name in files:
                     file_path = '{}/{}'.format(path, file_name)
                     #self.upload_file(file_name=file_name, file_object=open(file_path), chunk_size=chunk_size, parent_id=folder_id, **kwargs)
-                    self.chuck_upload_file(file_object=open(file_path), file_name=file_name,  parent_id=folder_id,
-                        read_chunk_size=chunk_size, set_global_timeout=False, **kwargs)
+                    with open(file_path, 'rb') as f:
+                        self.chuck_upload_file(file_object=f, file_name=file_name,  parent_id=folder_id,
+                            read_chunk_size=chunk_size, set_global_timeout=False, **kwargs)
                 # Upload all folders.
                 for dir_name in dirs:
                     dir_path = '{}/{}'.format(path, dir_name)
                     self.recursive_upload(path=dir_path, parent_id=folder_id, chunk_size=chunk_size, **kwargs)
                 break # one level
         elif os.path.isfile(path):
-            self.chuck_upload_file(file_object=open(path), file_name=name, read_chunk_size=chunk_size, set_global_timeout=False, **kwargs)
+            with open(path, 'rb') as f:
+                self.chuck_upload_file(file_object=f, file_name=name, read_chunk_size=chunk_size, set_global_timeout=False, **kwargs)
             #self.upload_file(file_name=name, file_object=open(path), chunk_size=chunk_size, parent_id=parent_id, **kwargs)
 
+    def sync_upload(self, path, parent_id='root', max_workers=8, max_open_files=None, skip_existing=True,
+            manifest_path=None, **kwargs):
+        """ Upload entire specified folder with a pool of upload workers (see DirectoryUploader).
+
+        Unlike recursive_upload(), existing remote folders are reused and files with the same name and size
+        are skipped, and progress is saved to manifest_path to resume a crashed run.
+        :return: DirectoryUploadReport object.
+        """
+        uploader = DirectoryUploader(self, max_workers=max_workers, max_open_files=max_open_files,
+            skip_existing=skip_existing, manifest_path=manifest_path, log=self.log, **kwargs)
+        return uploader.upload(path, parent_id=parent_id)
 
     def share_file(self, file_id, owner_id=None, user_id_to_share='anybody', permission='ReadFile', prefix_type='proxy'):
         """ Share one file and return its cache URL and access token. 
@@ -2708,7 +2872,7 @@ class RestAPI(HTTPRequester):
 
     def bearer_request(self, method, url, set_corid=True, **kwargs):
         """ Send request with bearer headers. """
-        access_token = self.get_id_token()
+        access_token = self.get_id_token(reduce_log=kwargs.get('reduce_log'))
         headers = {
             'Authorization': 'Bearer {0}'.format(access_token)
         }
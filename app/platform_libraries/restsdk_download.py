@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+""" Streaming download engine for RestAPI.
+
+Response chunks are hashed and written to the sink in one pass, so a downloaded file doesn't need to be
+read again for checksum. Large file can be downloaded by several ranged GET requests at the same time,
+ranges are still hashed and written in order.
+"""
+# std modules
+import hashlib
+import mmap
+import os
+import sys
+import threading
+import time
+
+
+class DownloadReport(object):
+    """ Result of one downloaded file. """
+
+    def __init__(self, file_id, hash_algorithm='md5'):
+        self.file_id = file_id
+        self.hash_algorithm = hash_algorithm
+        self.size = 0
+        self.expected_size = None # File size reported by device, if it was queried.
+        self.digest = None
+        self.ttfb = None # Seconds from sending request to the first body chunk.
+        self.elapsed = 0
+        self.ranges = 1
+
+    def is_complete(self):
+        """ Return False if the received size differs from the expected size. """
+        return self.expected_size is None or self.size == self.expected_size
+
+    def mb_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.size / 1024.0 / 1024.0 / self.elapsed
+
+    def to_dict(self):
+        return {
+            'file_id': self.file_id,
+            'size': self.size,
+            'expected_size': self.expected_size,
+            'hash_algorithm': self.hash_algorithm,
+            'digest': self.digest,
+            'ttfb_sec': round(self.ttfb, 4) if self.ttfb is not None else None,
+            'elapsed_sec': round(self.elapsed, 3),
+            'mb_per_sec': round(self.mb_per_sec(), 3),
+            'ranges': self.ranges
+        }
+
+    def __str__(self):
+        return '{}: {} bytes in {:.2f} sec ({:.2f} MB/s, TTFB: {} sec, {} ranges), {}: {}'.format(
+            self.file_id, self.size, self.elapsed, self.mb_per_sec(),
+            '{:.4f}'.format(self.ttfb) if self.ttfb is not None else None, self.ranges, self.hash_algorithm, self.digest)
+
+
+class _Sink(object):
+    """ Write downloaded data in order to nowhere, a file path, a file object or a memory-mapped file. """
+
+    def __init__(self, sink=None, size=None, use_mmap=False):
+        self.file_object = None
+        self.file_map = None
+        self.own_file = False
+        self.size = size
+        self.offset = 0 # Received bytes.
+        if sink is None or sink == os.devnull:
+            return
+        if not isinstance(sink, basestring): # File object.
+            self.file_object = sink
+            return
+        self.own_file = True
+        if use_mmap and size:
+            self.file_object = open(sink, 'w+b')
+            self.file_object.truncate(size)
+            self.file_map = mmap.mmap(self.file_object.fileno(), size, access=mmap.ACCESS_WRITE)
+        else:
+            self.file_object = open(sink, 'wb')
+
+    def write(self, data):
+        if self.file_map:
+            # Bytes over the mapped size are dropped, the caller checks the received size.
+            end = min(self.offset+len(data), self.size)
+            if end > self.offset:
+                self.file_map[self.offset:end] = data[:end-self.offset]
+        elif self.file_object:
+            self.file_object.write(data)
+        self.offset += len(data)
+
+    def close(self):
+        if self.file_map:
+            self.file_map.flush()
+            self.file_map.close()
+            if self.offset < self.size: # Not to leave zero bytes at the end.
+                self.file_object.truncate(self.offset)
+        if self.file_object and self.own_file:
+            self.file_object.close()
+
+
+class StreamingDownloader(object):
+    """ Download file content with RestSDK API and calculate its digest on the fly. """
+
+    def __init__(self, rest_client, chunk_size=1024*1024, parallel=1, range_size=1024*1024*8, hash_algorithm='md5',
+            timeout=120, log=None, api_version='v3'):
+        """
+        :param rest_client: RestAPI object.
+        :param chunk_size: Bytes to read from response each time.
+        :param parallel: Number of ranged GET requests at the same time. 1 means download by one request.
+        :param range_size: Bytes of each ranged GET request.
+        :param hash_algorithm: Any algorithm name of hashlib, or None to skip hashing.
+        :param api_version: Version of RestSDK file content API, 'v3' or 'v2'.
+        """
+        self.rest_client = rest_client
+        self.chunk_size = chunk_size
+        self.parallel = max(1, parallel)
+        self.range_size = range_size
+        self.hash_algorithm = hash_algorithm
+        self.timeout = timeout
+        self.log = log or rest_client.log
+        self.api_version = api_version
+
+    def get_content_url(self, file_id):
+        return '{0}/sdk/{1}/files/{2}/content'.format(self.rest_client.url_prefix, self.api_version, file_id)
+
+    def _request(self, url, headers=None, expect_status=(200,)):
+        # Reduce logs per call, rest_client may be shared by other threads.
+        response = self.rest_client.bearer_request(method='GET', url=url, headers=headers or {}, stream=True,
+            timeout=self.timeout, reduce_log=True)
+        if response.status_code not in expect_status:
+            self.rest_client.error('Failed to download file content, status code: {}'.format(response.status_code), response)
+        return response
+
+    def download(self, file_id, sink=None, use_mmap=False, size=None):
+        """ Download file content of file_id.
+
+        :param sink: Where to write data: None or os.devnull to drop it, a file path, or a file object.
+        :param use_mmap: Write data into a memory-mapped file when sink is a file path and size is known.
+        :param size: File size. Query from device if it is needed by ranged GET or mmap.
+        :return: DownloadReport object.
+        """
+        report = DownloadReport(file_id, self.hash_algorithm)
+        hasher = hashlib.new(self.hash_algorithm) if self.hash_algorithm else None
+        url = self.get_content_url(file_id)
+        if size is None and (self.parallel > 1 or use_mmap):
+            size = int(self.rest_client.get_data_by_id(file_id).get('size', 0))
+        report.expected_size = size
+        output = _Sink(sink, size, use_mmap)
+        start_time = time.time()
+        try:
+            if self.parallel > 1 and size > self.range_size:
+                self._download_ranges(url, size, hasher, output, report, start_time)
+            else:
+                response = self._request(url)
+                try:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if not chunk:
+                            continue
+                        if report.ttfb is None: report.ttfb = time.time() - start_time
+                        if hasher: hasher.update(chunk)
+                        output.write(chunk)
+                        report.size += len(chunk)
+                finally:
+                    response.close()
+        finally:
+            output.close()
+            report.elapsed = time.time() - start_time
+        if hasher: report.digest = hasher.hexdigest()
+        self.log.info('Downloaded {}'.format(report))
+        if not report.is_complete():
+            self.log.warning('Received {} bytes but file size is {} bytes'.format(report.size, report.expected_size))
+        return report
+
+    def _download_ranges(self, url, size, hasher, output, report, start_time):
+        """ Download ranges by worker threads and consume them in order at caller thread.
+        At most 2 ranges per worker are kept in memory.
+        """
+        ranges = [(offset, min(offset+self.range_size, size)) for offset in xrange(0, size, self.range_size)]
+        report.ranges = len(ranges)
+        next_range = [0] # Index of next range to download.
+        results = {} # Index: data
+        errors = []
+        cond = threading.Condition()
+        slots = threading.Semaphore(self.parallel * 2)
+
+        def worker():
+            while True:
+                slots.acquire()
+                with cond:
+                    if errors or next_range[0] >= len(ranges):
+                        slots.release()
+                        return
+                    idx = next_range[0]
+                    next_range[0] += 1
+                start, end = ranges[idx]
+                try:
+                    response = self._request(url, headers={'Range': 'bytes={}-{}'.format(start, end-1)}, expect_status=(206,))
+                    try:
+                        data = []
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if chunk:
+                                if report.ttfb is None: report.ttfb = time.time() - start_time
+                                data.append(chunk)
+                    finally:
+                        response.close()
+                    data = ''.join(data)
+                    if len(data) != end - start:
+                        raise RuntimeError('Range {}-{} returns {} bytes'.format(start, end-1, len(data)))
+                except:
+                    with cond:
+                        errors.append(sys.exc_info())
+                        cond.notify_all()
+                    return
+                with cond:
+                    results[idx] = data
+                    cond.notify_all()
+
+        threads = []
+        for idx in xrange(min(self.parallel, len(ranges))):
+            thread = threading.Thread(target=worker, name='RangeDownloader-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for idx in xrange(len(ranges)):
+                with cond:
+                    while idx not in results and not errors:
+                        cond.wait(1)
+                    if errors:
+                        break
+                    data = results.pop(idx)
+                if hasher: hasher.update(data)
+                output.write(data)
+                report.size += len(data)
+                slots.release()
+        finally:
+            with cond:
+                if not errors and report.size != size:
+                    errors.append((RuntimeError, RuntimeError('Download stopped at {} of {} bytes'.format(report.size, size)), None))
+                next_range[0] = len(ranges) # Stop workers.
+            for thread in threads:
+                slots.release() # Wake up workers waiting for slot.
+        if errors:
+            self.log.error('Catch an exception from range downloader, and re-raise this exception')
+            raise errors[0][0], errors[0][1], errors[0][2]
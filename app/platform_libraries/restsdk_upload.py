@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+""" Resumable upload engine and directory upload pipeline for RestAPI.
+
+The source file is memory-mapped and every chunk is sent as a zero-copy buffer slice of the map
+(one request body per chunk instead of a generator of small reads), several chunks can be kept in
+flight, each chunk is retried on failure and an interrupted upload can be resumed from the last
+committed offset.
+"""
+# std modules
+import Queue
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+
+# 3rd party modules
+import requests
+
+# platform modules
+from platform_libraries.constants import Kamino
+
+
+class UploadReport(object):
+    """ Throughput report of one uploaded file. """
+
+    def __init__(self, file_name=None, file_id=None, size=0, start_offset=0):
+        self.file_name = file_name
+        self.file_id = file_id
+        self.size = size
+        self.start_offset = start_offset
+        self.uploaded_bytes = 0
+        self.chunks = 0
+        self.retries = 0
+        self.elapsed = 0
+
+    def mb_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.uploaded_bytes / 1024.0 / 1024.0 / self.elapsed
+
+    def to_dict(self):
+        return {
+            'file_name': self.file_name,
+            'file_id': self.file_id,
+            'size': self.size,
+            'start_offset': self.start_offset,
+            'uploaded_bytes': self.uploaded_bytes,
+            'chunks': self.chunks,
+            'retries': self.retries,
+            'elapsed_sec': round(self.elapsed, 3),
+            'mb_per_sec': round(self.mb_per_sec(), 3)
+        }
+
+    def __str__(self):
+        return '{}: {} bytes in {:.2f} sec ({:.2f} MB/s, {} chunks, {} retries)'.format(
+            self.file_name or self.file_id, self.uploaded_bytes, self.elapsed, self.mb_per_sec(), self.chunks, self.retries)
+
+
+class ResumableUploader(object):
+    """ Upload a local file with RestSDK resumable file API chunk by chunk. """
+
+    def __init__(self, rest_client, chunk_size=1024*1024*2, max_in_flight=1, chunk_retry=3, retry_delay=5, timeout=120,
+            log=None):
+        """
+        :param rest_client: RestAPI object.
+        :param chunk_size: Bytes of each chunk request. Android APP is 2 MB.
+        :param max_in_flight: Number of chunk requests sent at the same time. Only set it more than 1 if
+                              the device accepts resumable content out of order, the commit chunk (done=true)
+                              is always sent after all other chunks are uploaded.
+        :param chunk_retry: Retry times of each chunk request, only connection errors and 5xx responses are retried.
+        :param retry_delay: Seconds to wait before retrying a chunk request.
+        """
+        self.rest_client = rest_client
+        self.chunk_size = chunk_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.chunk_retry = chunk_retry
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.log = log or rest_client.log
+
+    def get_committed_offset(self, file_id):
+        """ Get uploaded size of the resumable file from device. """
+        return int(self.rest_client.get_resumable_file(file_id).get('size', 0))
+
+    def upload(self, file_path=None, file_object=None, file_name=None, file_id=None, start_offset=None,
+            resolve_name_conflict=False, parent_folder=None, **kwargs):
+        """ Upload file_path (or a real file object) to a new resumable file named file_name, or continue
+        uploading to the existing resumable file_id.
+
+        :param start_offset: Offset to start uploading. Ask device for the committed offset if it is None and
+                             file_id is given, or 0 for new file.
+        :return: UploadReport object, its file_id is None if file is already exists in the NAS.
+        :raise: RestAPI.ChuckUploadFailed with the committed offset to resume.
+        """
+        if file_object is None:
+            with open(file_path, 'rb') as f:
+                return self.upload(file_object=f, file_name=file_name, file_id=file_id, start_offset=start_offset,
+                    resolve_name_conflict=resolve_name_conflict, parent_folder=parent_folder, **kwargs)
+
+        ChuckUploadFailed = self.rest_client.ChuckUploadFailed
+        size = os.fstat(file_object.fileno()).st_size
+        report = UploadReport(file_name=file_name, file_id=file_id, size=size)
+        start_time = time.time()
+        if file_name and not file_id: # Create file record if gieven file name.
+            try:
+                file_id = self.rest_client.create_resumable_file(file_name, resolve_name_conflict=resolve_name_conflict,
+                    parent_folder=parent_folder, timeout=self.timeout, **kwargs)
+            except Exception as e:
+                self.log.exception(e)
+                raise ChuckUploadFailed('Create file failed', file_name=file_name, parent_id=kwargs.get('parent_id'), exception=e)
+            if not file_id:
+                return report
+            report.file_id = file_id
+            start_offset = start_offset or 0
+        elif start_offset is None:
+            start_offset = self.get_committed_offset(file_id)
+            self.log.info('Resume file: {} from offset: {}'.format(file_id, start_offset))
+        report.start_offset = start_offset
+
+        file_map = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        try:
+            self._upload_chunks(file_map, file_id, start_offset, size, report, kwargs.get('parent_id'))
+        finally:
+            if file_map: file_map.close()
+            report.elapsed = time.time() - start_time
+        self.log.info('Uploaded {}'.format(report))
+        return report
+
+    def _gen_chunks(self, start_offset, size):
+        """ Return [(start, end), ...] of chunks to upload, the last one is the commit chunk. """
+        chunks = []
+        offset = start_offset
+        while offset + self.chunk_size < size:
+            chunks.append((offset, offset+self.chunk_size))
+            offset += self.chunk_size
+        chunks.append((offset, size))
+        return chunks
+
+    def _is_retryable(self, error):
+        """ Only connection errors and 5xx responses are worth retrying, other errors (ex: 4xx) are raised at once. """
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code >= 500
+
+    def _send_chunk(self, file_map, file_id, start, end, done, report, lock):
+        retry_times = 0
+        while True:
+            data = buffer(file_map, start, end-start) if file_map and end > start else ''
+            try: # Reduce logs per call, rest_client is shared by other upload threads.
+                self.rest_client.upload_resumable_file_content(file_id=file_id, offset=start, done=done, data=data,
+                    timeout=self.timeout, reduce_log=True)
+                break
+            except Exception as e:
+                if retry_times >= self.chunk_retry or not self._is_retryable(e):
+                    raise
+                retry_times += 1
+                with lock: report.retries += 1
+                self.log.warning('Upload chunk {}-{} of file: {} failed: {}, retry #{} after {} sec.'.format(
+                    start, end, file_id, e, retry_times, self.retry_delay))
+                time.sleep(self.retry_delay)
+        with lock:
+            report.uploaded_bytes += end - start
+            report.chunks += 1
+
+    def _upload_chunks(self, file_map, file_id, start_offset, size, report, parent_id=None):
+        chunks = self._gen_chunks(start_offset, size)
+        commit_chunk = chunks.pop()
+        lock = threading.Lock()
+        finished = set() # Start offset of uploaded chunks.
+        errors = []
+
+        def committed_offset():
+            # Device has all data before the first chunk which is not uploaded.
+            for start, end in chunks:
+                if start not in finished:
+                    return start
+            return commit_chunk[0]
+
+        def raise_failed(exc_info):
+            self.log.error('Chuck upload failed', exc_info=exc_info)
+            raise self.rest_client.ChuckUploadFailed('Chuck upload failed', file_id, committed_offset(),
+                parent_id=parent_id, exception=exc_info[1])
+
+        if self.max_in_flight == 1 or len(chunks) < 2:
+            for start, end in chunks:
+                try:
+                    self._send_chunk(file_map, file_id, start, end, False, report, lock)
+                except:
+                    raise_failed(sys.exc_info())
+                finished.add(start)
+        else:
+            chunk_queue = Queue.Queue()
+            for chunk in chunks:
+                chunk_queue.put(chunk)
+
+            def worker():
+                while not errors:
+                    try:
+                        start, end = chunk_queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        self._send_chunk(file_map, file_id, start, end, False, report, lock)
+                    except:
+                        errors.append(sys.exc_info())
+                        return
+                    with lock: finished.add(start)
+
+            threads = []
+            for idx in xrange(min(self.max_in_flight, len(chunks))):
+                thread = threading.Thread(target=worker, name='ChunkUploader-{}'.format(idx))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise_failed(errors[0])
+        # Commit file with the last chunk.
+        try:
+            self._send_chunk(file_map, file_id, commit_chunk[0], commit_chunk[1], True, report, lock)
+        except:
+            raise_failed(sys.exc_info())
+
+
+class DirectoryUploadReport(object):
+    """ Aggregate throughput report of one directory upload. """
+
+    def __init__(self, path):
+        self.path = path
+        self.folders = 0
+        self.files = 0
+        self.skipped_files = 0
+        self.uploaded_bytes = 0
+        self.elapsed = 0
+
+    def mb_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.uploaded_bytes / 1024.0 / 1024.0 / self.elapsed
+
+    def files_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.files / self.elapsed
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'folders': self.folders,
+            'files': self.files,
+            'skipped_files': self.skipped_files,
+            'uploaded_bytes': self.uploaded_bytes,
+            'elapsed_sec': round(self.elapsed, 3),
+            'mb_per_sec': round(self.mb_per_sec(), 3),
+            'files_per_sec': round(self.files_per_sec(), 3)
+        }
+
+    def __str__(self):
+        return '{}: {} files ({} skipped), {} folders, {} bytes in {:.2f} sec ({:.2f} MB/s, {:.2f} files/s)'.format(
+            self.path, self.files, self.skipped_files, self.folders, self.uploaded_bytes, self.elapsed,
+            self.mb_per_sec(), self.files_per_sec())
+
+
+class UploadManifest(object):
+    """ Progress of a directory upload saved in JSON file, for resuming a crashed run.
+
+    Format: {"path": local root, "parent_id": remote parent ID, "folders": {relative path: folder ID},
+             "files": {relative path: file ID}}
+    """
+
+    def __init__(self, manifest_path, path, parent_id, save_interval=5):
+        self.manifest_path = manifest_path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.last_save_time = 0
+        self.data = {'path': path, 'parent_id': parent_id, 'folders': {}, 'files': {}}
+        if manifest_path and os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                data = json.load(f)
+            # Only resume the same upload.
+            if data.get('path') == path and data.get('parent_id') == parent_id:
+                self.data = data
+
+    def get_folder(self, rel_path):
+        return self.data['folders'].get(rel_path)
+
+    def has_file(self, rel_path):
+        return rel_path in self.data['files']
+
+    def add_folder(self, rel_path, folder_id):
+        with self.lock:
+            self.data['folders'][rel_path] = folder_id
+        self.save(force=True) # Folder ID is required to resume files in it.
+
+    def add_file(self, rel_path, file_id):
+        with self.lock:
+            self.data['files'][rel_path] = file_id
+        self.save()
+
+    def save(self, force=False):
+        if not self.manifest_path:
+            return
+        with self.lock:
+            if not force and time.time() - self.last_save_time < self.save_interval:
+                return
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f)
+            os.rename(tmp_path, self.manifest_path) # Atomic replace.
+            self.last_save_time = time.time()
+
+
+class DirectoryUploader(object):
+    """ Upload a local directory tree with a pool of upload workers.
+
+    The producer (caller thread) walks the local tree from top to bottom, resolves the remote folder of each
+    local folder (reuse the existing one or create it), then queues the files of this folder for upload workers.
+    """
+
+    def __init__(self, rest_client, max_workers=8, max_open_files=None, skip_existing=True, manifest_path=None,
+            chunk_size=1024*1024*2, chunk_retry=3, timeout=120, log=None):
+        """
+        :param max_workers: Number of upload threads.
+        :param max_open_files: Max local files opened at the same time. Default is max_workers.
+        :param skip_existing: Skip the file if remote folder has a file with the same name and size.
+        :param manifest_path: JSON file to save progress, upload is resumed if it exists.
+        Other parameters refer to ResumableUploader.
+        """
+        self.rest_client = rest_client
+        self.max_workers = max_workers
+        self.open_files = threading.BoundedSemaphore(max_open_files or max_workers)
+        self.skip_existing = skip_existing
+        self.manifest_path = manifest_path
+        self.log = log or rest_client.log
+        self.uploader = ResumableUploader(rest_client, chunk_size=chunk_size, chunk_retry=chunk_retry, timeout=timeout,
+            log=self.log)
+
+    def _list_remote_folder(self, folder_id):
+        """ Return {name: item} of the remote folder. """
+        return {item['name']: item for item in self.rest_client.iter_files_by_parent(
+            parent_id=folder_id, fields=['id', 'name', 'mimeType', 'size'])}
+
+    def _resolve_folder(self, name, parent_id, remote_items):
+        item = remote_items.get(name)
+        if item and item.get('mimeType') == Kamino.MimeType.FOLDER:
+            return item['id'], False
+        folder_id = self.rest_client.commit_folder(name, parent_id=parent_id)
+        if not folder_id: # Conflict with existing file.
+            raise RuntimeError('Cannot create folder: {} in {}'.format(name, parent_id))
+        return folder_id, True
+
+    def _upload_file(self, task, report, manifest, lock):
+        rel_path, file_path, parent_id = task
+        with self.open_files:
+            with open(file_path, 'rb') as f:
+                file_report = self.uploader.upload(file_object=f, file_name=os.path.basename(file_path), parent_id=parent_id)
+        if not file_report.file_id: # Created by other client.
+            self.log.warning('File: {} is already exists in the NAS, skip it'.format(rel_path))
+            with lock: report.skipped_files += 1
+            return
+        manifest.add_file(rel_path, file_report.file_id)
+        with lock:
+            report.files += 1
+            report.uploaded_bytes += file_report.uploaded_bytes
+
+    def upload(self, path, parent_id='root'):
+        """ Upload the local folder "path" into remote folder parent_id.
+
+        :return: DirectoryUploadReport object.
+        """
+        path = os.path.abspath(path)
+        report = DirectoryUploadReport(path)
+        manifest = UploadManifest(self.manifest_path, path, parent_id)
+        file_queue = Queue.Queue(maxsize=self.max_workers * 4)
+        lock = threading.Lock()
+        errors = []
+
+        def worker():
+            while True:
+                task = file_queue.get()
+                if task is None:
+                    return
+                if errors: # Skip the rest of files.
+                    continue
+                try:
+                    self._upload_file(task, report, manifest, lock)
+                except:
+                    errors.append(sys.exc_info())
+
+        start_time = time.time()
+        threads = []
+        for idx in xrange(self.max_workers):
+            thread = threading.Thread(target=worker, name='DirectoryUploader-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            folder_ids = {}
+            remote_folders = {} # Relative path: {name: item} of sub-folders in remote folder.
+            base_path = os.path.dirname(path)
+            for root, dirs, files in os.walk(path): # Parent folder is always walked before its sub-folders.
+                if errors:
+                    break
+                rel_root = os.path.relpath(root, base_path)
+                folder_id = manifest.get_folder(rel_root)
+                created = False
+                if not folder_id:
+                    rel_parent = os.path.dirname(rel_root)
+                    remote_parent_id = folder_ids.get(rel_parent, parent_id)
+                    if rel_parent not in remote_folders: # Top folder.
+                        remote_folders[rel_parent] = self._list_remote_folder(remote_parent_id)
+                    # Existing folder is always reused, skip_existing is only for files.
+                    folder_id, created = self._resolve_folder(os.path.basename(root), remote_parent_id, remote_folders[rel_parent])
+                    if created: report.folders += 1
+                    manifest.add_folder(rel_root, folder_id)
+                folder_ids[rel_root] = folder_id
+                # New folder is empty.
+                remote_items = {} if created else self._list_remote_folder(folder_id)
+                remote_folders[rel_root] = {name: item for name, item in remote_items.iteritems()
+                    if item.get('mimeType') == Kamino.MimeType.FOLDER}
+                for file_name in sorted(files):
+                    rel_path = os.path.join(rel_root, file_name)
+                    file_path = os.path.join(root, file_name)
+                    if manifest.has_file(rel_path):
+                        with lock: report.skipped_files += 1
+                        continue
+                    item = remote_items.get(file_name) if self.skip_existing else None
+                    if item and item.get('size') == os.path.getsize(file_path):
+                        with lock: report.skipped_files += 1
+                        continue
+                    file_queue.put((rel_path, file_path, folder_id))
+        finally:
+            for thread in threads:
+                file_queue.put(None)
+            for thread in threads:
+                thread.join()
+            manifest.save(force=True)
+            report.elapsed = time.time() - start_time
+            self.log.info('Uploaded directory {}'.format(report))
+        if errors:
+            self.log.error('Catch an exception from upload worker, and re-raise this exception')
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return report
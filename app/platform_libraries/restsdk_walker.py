@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+""" Concurrent folder tree walker and bulk delete pipeline for RestAPI.
+"""
+# std modules
+import Queue
+import sys
+import threading
+import time
+
+# platform modules
+from platform_libraries.constants import Kamino
+from platform_libraries.pyutils import retry
+
+
+_DONE = object() # End of results.
+
+
+def _put_until_stop(queue, item, stop_event, timeout=1):
+    """ Put item into bounded queue, give up if stop_event is set. """
+    while not stop_event.is_set():
+        try:
+            queue.put(item, timeout=timeout)
+            return True
+        except Queue.Full:
+            continue
+    return False
+
+
+class ConcurrentTreeWalker(object):
+    """ Walk a folder tree on RestSDK by BFS with a pool of worker threads.
+
+    Each worker takes one folder from the work queue, browses it page by page with search_file_by_parent()
+    and pushes sub-folders back to the work queue, so folders of the same level are browsed concurrently.
+    """
+
+    def __init__(self, rest_client, max_workers=8, scroll_limit=1000, item_parser=None, max_pending_pages=None,
+            log=None):
+        """
+        :param rest_client: RestAPI object.
+        :param max_workers: Number of threads to browse folders.
+        :param scroll_limit: Page size of search_file_by_parent().
+        :param item_parser: Function to convert each item, return whole item if it is None.
+        :param max_pending_pages: Max pages waiting for caller to consume. Default is 4 pages per worker.
+        """
+        self.rest_client = rest_client
+        self.max_workers = max_workers
+        self.scroll_limit = scroll_limit
+        self.item_parser = item_parser
+        self.max_pending_pages = max_pending_pages or max_workers * 4
+        self.log = log or rest_client.log
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.folders = 0
+        self.files = 0
+        self.pages = 0
+        self.elapsed = 0
+
+    def items_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return (self.folders + self.files) / self.elapsed
+
+    def walk(self, parent_id='root', whole_folder=False):
+        """ Generator to walk all sub-folders of parent_id.
+
+        :param whole_folder: Yield a folder only after all its pages are browsed, so caller can modify
+                             the folder (e.g. delete its items) without breaking the page token of the folder.
+        :return: Yield (folder_id, depth, file_list, sub_folder_list) for each page of each folder.
+                 Folder which has more than one page is yielded more than once unless whole_folder is True.
+                 depth of parent_id is 0.
+        """
+        self.reset_stats()
+        work_queue = Queue.Queue()
+        result_queue = Queue.Queue(maxsize=self.max_pending_pages)
+        stop_event = threading.Event()
+        lock = threading.Lock()
+        pending = [1] # Folders not yet finished browsing.
+        errors = []
+
+        def browse_folder(folder_id, depth):
+            page_token = None
+            file_list = []
+            folder_list = []
+            while not stop_event.is_set():
+                item_list, page_token = retry(
+                    func=self.rest_client.search_file_by_parent, log=self.log.warning,
+                    **{'parent_id': folder_id, 'page_token': page_token, 'limit': self.scroll_limit}
+                )
+                if not whole_folder:
+                    file_list = []
+                    folder_list = []
+                page_files = len(file_list)
+                page_folders = len(folder_list)
+                for item in item_list:
+                    parsed_item = self.item_parser(item) if self.item_parser else item
+                    if item['mimeType'] == Kamino.MimeType.FOLDER:
+                        with lock: pending[0] += 1
+                        work_queue.put((item['id'], depth+1))
+                        folder_list.append(parsed_item)
+                    else:
+                        file_list.append(parsed_item)
+                with lock:
+                    self.pages += 1
+                    self.files += len(file_list) - page_files
+                    self.folders += len(folder_list) - page_folders
+                if not whole_folder or not page_token:
+                    _put_until_stop(result_queue, (folder_id, depth, file_list, folder_list), stop_event)
+                if not page_token:
+                    return
+
+        def worker():
+            while not stop_event.is_set():
+                task = work_queue.get()
+                if task is None:
+                    return
+                try:
+                    browse_folder(*task)
+                except:
+                    errors.append(sys.exc_info())
+                    stop_event.set()
+                    return
+                with lock:
+                    pending[0] -= 1
+                    walk_done = not pending[0]
+                if walk_done:
+                    _put_until_stop(result_queue, _DONE, stop_event)
+
+        start_time = time.time()
+        work_queue.put((parent_id, 0))
+        threads = []
+        for idx in xrange(self.max_workers):
+            thread = threading.Thread(target=worker, name='TreeWalker-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            while True:
+                if errors:
+                    break
+                try:
+                    entry = result_queue.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                if entry is _DONE:
+                    break
+                yield entry
+        finally:
+            stop_event.set()
+            for thread in threads:
+                work_queue.put(None)
+            self.elapsed = time.time() - start_time
+            self.log.info('Walked {} folders and {} files in {:.2f} sec ({:.2f} items/sec)'.format(
+                self.folders, self.files, self.elapsed, self.items_per_sec()))
+        if errors:
+            self.log.error('Catch an exception from tree walker, and re-raise this exception')
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+
+class BulkDeleter(object):
+    """ Delete data IDs from an iterable with a pool of delete_file() worker threads. """
+
+    def __init__(self, rest_client, max_workers=8, ignore_not_found=True, log=None):
+        """
+        :param rest_client: RestAPI object.
+        :param max_workers: Number of threads to call delete_file().
+        :param ignore_not_found: Not raise error if data is already deleted (404).
+        """
+        self.rest_client = rest_client
+        self.max_workers = max_workers
+        self.ignore_not_found = ignore_not_found
+        self.log = log or rest_client.log
+        self.deleted = 0
+        self.elapsed = 0
+
+    def items_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.deleted / self.elapsed
+
+    def _delete(self, data_id):
+        try:
+            self.rest_client.delete_file(data_id=data_id)
+        except Exception as e:
+            if not self.ignore_not_found:
+                raise
+            if getattr(e, 'response', None) is not None and e.response.status_code == 404:
+                return False
+            if isinstance(e, RuntimeError) and '404' in str(e):
+                return False
+            raise
+        return True
+
+    def delete(self, id_iter):
+        """ Delete all IDs from id_iter (list or generator), IDs are consumed while deleting.
+
+        :return: Number of deleted data.
+        """
+        id_queue = Queue.Queue(maxsize=self.max_workers * 4)
+        stop_event = threading.Event()
+        lock = threading.Lock()
+        errors = []
+        counter = [0]
+
+        def worker():
+            while True:
+                data_id = id_queue.get()
+                if data_id is None:
+                    return
+                if stop_event.is_set(): # Skip the rest of IDs.
+                    continue
+                try:
+                    deleted = self._delete(data_id)
+                except:
+                    errors.append(sys.exc_info())
+                    stop_event.set()
+                    continue
+                if deleted:
+                    with lock: counter[0] += 1
+
+        start_time = time.time()
+        threads = []
+        for idx in xrange(self.max_workers):
+            thread = threading.Thread(target=worker, name='BulkDeleter-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for data_id in id_iter:
+                if not _put_until_stop(id_queue, data_id, stop_event):
+                    break
+        finally:
+            for thread in threads:
+                id_queue.put(None)
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start_time
+            self.deleted += counter[0]
+            self.elapsed += elapsed
+            self.log.info('Deleted {} data in {:.2f} sec ({:.2f} items/sec)'.format(
+                counter[0], elapsed, counter[0] / elapsed if elapsed else 0.0))
+        if errors:
+            self.log.error('Catch an exception from bulk deleter, and re-raise this exception')
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return counter[0]
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+""" Process wide sink to ship test results to logstash and Popcorn in background.
+
+Results are serialized when they are put, so the caller can keep changing its result objects. A daemon thread
+takes them from a bounded queue, uploads logstash records in batches (one JSON array per POST, which logstash
+splits into events) and Popcorn reports one by one, all through a pooled session. Results which can't be uploaded
+for a server error or an unreachable server are appended to a JSONL spool file and retried later, also by the
+next test process which uses the same spool file:
+
+    sink = get_result_sink().configure(spool_path='output/results/result_spool.jsonl')
+    sink.put_logstash(test_result.logstash_records(), server_url=LOGSTASH_SERVER_TW)
+    sink.put_popcorn(popcorn_report, source='PLATFORM')
+    sink.flush(timeout=60) # Before exiting test.
+"""
+# std modules
+import atexit
+import json
+import os
+import Queue
+import threading
+import time
+
+# 3rd party modules
+import requests
+
+# platform modules
+import common_utils
+from constants import LOGSTASH_SERVER_TW
+from platform_libraries.http_pool import new_pooled_session
+from platform_libraries.popcorn import upload_popcorn_report_to_server
+from platform_libraries.pyutils import Singleton
+
+
+#
+# Sink Settings
+#
+MAX_QUEUE = 1000 # Max results waiting in queue, put() blocks when queue is full.
+PUT_TIMEOUT = 10 # Seconds. Spool the result directly if queue is still full after this time.
+BATCH_SIZE = 50 # Max logstash records in one POST.
+BATCH_INTERVAL = 2 # Seconds. How long to wait for more results to fill a batch.
+RETRY_INTERVAL = 60 # Seconds. How often to retry the spooled results.
+REQUEST_TIMEOUT = 30 # Seconds.
+FLUSH_TIMEOUT = 60 # Seconds.
+
+LOGSTASH = 'logstash'
+POPCORN = 'popcorn'
+
+
+class _SinkItem(object):
+
+    def __init__(self, kind, target, data):
+        """
+        :param kind: LOGSTASH or POPCORN.
+        :param target: Server URL for logstash, {'popcorn_address': ..., 'source': ...} for Popcorn.
+        :param data: Serialized JSON string.
+        """
+        self.kind = kind
+        self.target = target
+        self.data = data
+
+    def to_line(self):
+        return json.dumps({'kind': self.kind, 'target': self.target, 'data': self.data})
+
+    @classmethod
+    def from_line(cls, line):
+        item = json.loads(line)
+        return cls(kind=item['kind'], target=item['target'], data=item['data'])
+
+
+class _RetryableError(Exception):
+    """ Upload failed but it may succeed later. """
+    pass
+
+
+@common_utils.logger()
+class ResultSink(object):
+    """ Background uploader with bounded queue, batching and disk spool. """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self.spool_path = None
+        self.bulk_logstash = True
+        self.batch_size = BATCH_SIZE
+        self.batch_interval = BATCH_INTERVAL
+        self.retry_interval = RETRY_INTERVAL
+        self.request_timeout = REQUEST_TIMEOUT
+        self.put_timeout = PUT_TIMEOUT
+        self._pid = None
+        self._reset()
+        atexit.register(self._flush_at_exit)
+
+    def _reset(self):
+        """ Initiate runtime states, it's also for the child process forked from a process which used the sink. """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = Queue.Queue(maxsize=MAX_QUEUE)
+        self._pending = 0 # Items in queue or being uploaded.
+        self._flushing = threading.Event()
+        self._stop_event = threading.Event()
+        self._worker = None
+        self._session = None
+        self._last_retry = 0
+        self.reset_stats()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def configure(self, spool_path=None, bulk_logstash=None, batch_size=None, batch_interval=None,
+            retry_interval=None, request_timeout=None):
+        """ Update sink settings and return sink itself.
+
+        :param spool_path: JSONL file to keep the results failed to upload.
+        :param bulk_logstash: Upload multiple logstash records in one POST or not.
+        """
+        self._check_fork()
+        if spool_path: self.spool_path = spool_path
+        if bulk_logstash is not None: self.bulk_logstash = bulk_logstash
+        if batch_size is not None: self.batch_size = batch_size
+        if batch_interval is not None: self.batch_interval = batch_interval
+        if retry_interval is not None: self.retry_interval = retry_interval
+        if request_timeout is not None: self.request_timeout = request_timeout
+        return self
+
+    def reset_stats(self):
+        self.queued = 0
+        self.uploaded = 0
+        self.posts = 0
+        self.spooled = 0
+        self.retried = 0 # Spooled items uploaded at retry.
+        self.dropped = 0 # Items rejected by server.
+
+    def get_stats(self):
+        return {
+            'queued': self.queued,
+            'uploaded': self.uploaded,
+            'posts': self.posts,
+            'spooled': self.spooled,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'pending': self._pending
+        }
+
+    def _incr(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    #
+    # Producer Methods
+    #
+    def put_logstash(self, records, server_url=None):
+        """ Queue logstash records.
+
+        :param records: List of dicts, e.g. the one returned by logstash_records() of test result.
+        """
+        for record in records:
+            self._put(_SinkItem(LOGSTASH, server_url or LOGSTASH_SERVER_TW, json.dumps(record, ensure_ascii=False)))
+
+    def put_popcorn(self, report, popcorn_address='popcorn.wdc.com', source='PLATFORM'):
+        self._put(_SinkItem(POPCORN, {'popcorn_address': popcorn_address, 'source': source}, json.dumps(report)))
+
+    def _put(self, item):
+        self._check_fork()
+        self._start_worker()
+        with self._lock:
+            self._pending += 1
+            self.queued += 1
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except Queue.Full: # Uploading is too slow, don't block test any longer.
+            self.log.warning('Result queue is full, spool the result')
+            self._spool([item])
+            self._done(1)
+
+    def _done(self, count):
+        with self._idle:
+            self._pending -= count
+            if not self._pending:
+                self._idle.notify_all()
+
+    #
+    # Worker
+    #
+    def _start_worker(self):
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stop_event.clear()
+            self._worker = threading.Thread(target=self._work_loop, name='ResultSink')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _get_session(self):
+        if not self._session:
+            self._session = new_pooled_session()
+        return self._session
+
+    def _get_batch(self):
+        """ Return items which are got within batch interval, or empty list if there is no item. """
+        try:
+            items = [self._queue.get(timeout=min(self.batch_interval, self.retry_interval))]
+        except Queue.Empty:
+            return []
+        deadline = time.time() + self.batch_interval
+        while len(items) < self.batch_size and items[-1] is not None:
+            left = 0 if self._flushing.is_set() else deadline - time.time()
+            try:
+                items.append(self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        if items[-1] is None: # Stop signal.
+            items.pop()
+        return items
+
+    def _work_loop(self):
+        while not self._stop_event.is_set():
+            items = self._get_batch()
+            if items:
+                try:
+                    failed_items = self._upload(items)
+                    if failed_items: self._spool(failed_items)
+                except Exception as e: # Keep worker alive.
+                    self.log.warning('Uploading results failed: {}'.format(repr(e)), exc_info=True)
+                    self._spool(items)
+                finally:
+                    self._done(len(items))
+            if self.spool_path and time.time() - self._last_retry > self.retry_interval:
+                self.retry_spool()
+
+    #
+    # Uploading
+    #
+    def _upload(self, items):
+        """ Upload items and return the ones should be retried later. A server is not tried again in the same call
+        after its first failure, so a dead server costs one timeout only.
+        """
+        failed_items = []
+        down_servers = set()
+        def try_upload(server, upload_func, *args):
+            if server in down_servers:
+                return False
+            try:
+                upload_func(*args)
+            except _RetryableError as e:
+                self.log.warning(e)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.log.warning('Result server {} is unreachable: {}'.format(server, repr(e)))
+            else:
+                return True
+            down_servers.add(server)
+            return False
+
+        logstash_items = {} # server_url: items
+        for item in items:
+            if item.kind == LOGSTASH:
+                logstash_items.setdefault(item.target, []).append(item)
+            elif not try_upload(item.target['popcorn_address'], self._upload_popcorn, item):
+                failed_items.append(item)
+        for server_url, server_items in logstash_items.iteritems():
+            if not self.bulk_logstash:
+                failed_items.extend(item for item in server_items
+                    if not try_upload(server_url, self._upload_logstash, item))
+                continue
+            for idx in xrange(0, len(server_items), self.batch_size):
+                batch = server_items[idx:idx+self.batch_size]
+                if not try_upload(server_url, self._upload_logstash_bulk, server_url, batch):
+                    failed_items.extend(batch)
+        return failed_items
+
+    def _check_response(self, response, count, server):
+        self._incr('posts')
+        if response.status_code == 200:
+            self._incr('uploaded', count)
+            return
+        message = 'Upload {} results to {} failed. Status Code: {}, Content: {}'.format(
+            count, server, response.status_code, response.content[:200])
+        if response.status_code >= 500 or response.status_code == 429:
+            raise _RetryableError(message)
+        # Server never accepts it.
+        self._incr('dropped', count)
+        self.log.error(message)
+
+    def _upload_logstash(self, item):
+        response = self._get_session().post(url=item.target, data=item.data,
+            headers={'Content-Type': 'application/json'}, timeout=self.request_timeout)
+        self._check_response(response, 1, item.target)
+
+    def _upload_logstash_bulk(self, server_url, items):
+        data = '[{}]'.format(','.join(item.data for item in items))
+        response = self._get_session().post(url=server_url, data=data,
+            headers={'Content-Type': 'application/json'}, timeout=self.request_timeout)
+        self._check_response(response, len(items), server_url)
+
+    def _upload_popcorn(self, item):
+        response = upload_popcorn_report_to_server(data=json.loads(item.data), session=self._get_session(),
+            timeout=self.request_timeout, **item.target)
+        self._check_response(response, 1, item.target['popcorn_address'])
+
+    #
+    # Spool
+    #
+    def _spool(self, items):
+        if not self.spool_path:
+            self.log.error('No spool file, {} results are lost'.format(len(items)))
+            self._incr('dropped', len(items))
+            return
+        with self._spool_lock:
+            with open(self.spool_path, 'a') as f:
+                for item in items:
+                    f.write(item.to_line() + '\n')
+        self._incr('spooled', len(items))
+        self.log.info('Spooled {} results to {}'.format(len(items), self.spool_path))
+
+    def retry_spool(self):
+        """ Upload spooled results, keep the failed ones in spool file. Return number of results left. """
+        self._last_retry = time.time()
+        if not self.spool_path:
+            return 0
+        # Take the spooled results out of file, so new results can be spooled during upload.
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path):
+                return 0
+            with open(self.spool_path, 'r') as f:
+                items = [_SinkItem.from_line(line) for line in f if line.strip()]
+            os.remove(self.spool_path)
+        if not items:
+            return 0
+        self.log.info('Retry {} spooled results'.format(len(items)))
+        failed_items = items # Put all of them back if uploading raises.
+        try:
+            failed_items = self._upload(items)
+            self._incr('retried', len(items) - len(failed_items))
+        finally:
+            if failed_items:
+                with self._spool_lock:
+                    with open(self.spool_path, 'a') as f:
+                        for item in failed_items:
+                            f.write(item.to_line() + '\n')
+        return len(failed_items)
+
+    #
+    # Exiting
+    #
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """ Wait for queued results to be uploaded or spooled, then retry the spooled results once.
+        Return number of results which are not uploaded yet.
+        """
+        self._check_fork()
+        deadline = time.time() + timeout
+        self._flushing.set()
+        try:
+            with self._idle:
+                while self._pending:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        break
+                    self._idle.wait(left)
+            left_items = []
+            while True: # Worker is too slow, take the rest in queue.
+                try:
+                    item = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is not None: left_items.append(item)
+            if left_items:
+                self.log.warning('Uploading is not done in {} sec, spool {} results'.format(timeout, len(left_items)))
+                self._spool(left_items)
+                self._done(len(left_items))
+            return self.retry_spool() + self._pending
+        finally:
+            self._flushing.clear()
+
+    def _stop_worker(self):
+        self._stop_event.set()
+        if not self._worker or not self._worker.is_alive():
+            return
+        try:
+            self._queue.put_nowait(None) # Wake worker up.
+        except Queue.Full:
+            pass
+        self._worker.join(self.request_timeout)
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid():
+            return
+        if self._pending:
+            self.flush()
+        self._stop_worker() # Not to let daemon thread run at interpreter shutdown.
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        left = self.flush(timeout)
+        self._stop_worker()
+        if self._session: self._session.close()
+        self._session = None
+        return left
+
+
+def get_result_sink():
+    return ResultSink()
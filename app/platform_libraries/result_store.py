@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+""" Streaming store of loop test results.
+
+Each result is written once when it's appended, so the cost of saving results doesn't grow with iterations:
+    - Journal: Append-only JSON lines, one test result per line.
+    - JUnit XML: Test cases are appended at the byte offset of the closing tags, and the header with counts is
+                 rewritten in its fixed size space. The file is a complete report after each append.
+    - Summary index: Counts and elapsed time statistics, which ResultList.summarize() can use instead of going
+                     through all results. It's saved to a small JSON file every few seconds and at closing.
+
+    store = LoopResultStore(journal_path='output/results/Test.jsonl', junit_path='output/results/test_report.xml',
+        summary_path='output/results/Test.summary.json', suite_name='Test')
+    store.append(test_result)
+    store.close()
+"""
+# std modules
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+# platform modules
+from junit_xml import TestSuite, decode
+
+
+HEADER_RESERVE = 160 # Bytes reserved in JUnit header for counts to grow.
+SUMMARY_SAVE_INTERVAL = 10 # Seconds.
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+XML_TAIL = '\t</testsuite>\n</testsuites>\n'
+
+
+class ResultSummary(object):
+    """ Counts and elapsed time statistics of test results, updated by each result. """
+
+    def __init__(self):
+        self.tests = 0
+        self.passed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.passed_timed = 0 # Passed tests with elapsed time.
+        self.passed_time = 0.0
+        self.max_passed_time = None
+        self.min_passed_time = None
+        self.last_err_time = None
+        self.failed_tests = [] # Names of failed tests.
+        self.skipped_tests = [] # Names of skipped tests.
+
+    def add(self, test_result):
+        """ Count a summarized TestResult. """
+        self.tests += 1
+        elapsed_sec = test_result.TEST_ELAPSED_SEC
+        if test_result.TEST_PASS is None:
+            self.skipped += 1
+            self.skipped_tests.append(getattr(test_result, 'TEST_NAME', 'Unknown'))
+        elif test_result.TEST_PASS:
+            self.passed += 1
+            if elapsed_sec:
+                self.passed_timed += 1
+                self.passed_time += elapsed_sec
+                self.max_passed_time = max(self.max_passed_time, elapsed_sec)
+                self.min_passed_time = elapsed_sec if self.min_passed_time is None else min(self.min_passed_time, elapsed_sec)
+        else:
+            self.failed += 1
+            self.failed_tests.append(getattr(test_result, 'TEST_NAME', 'Unknown'))
+            if elapsed_sec: self.last_err_time = elapsed_sec
+
+    def avg_passed_time(self):
+        return self.passed_time / self.passed_timed if self.passed_timed else None
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data['avg_passed_time'] = self.avg_passed_time()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        for k, v in data.iteritems():
+            if hasattr(summary, k): setattr(summary, k, v)
+        return summary
+
+
+class JUnitStreamWriter(object):
+    """ JUnit XML file of one test suite, which test cases are appended to. """
+
+    def __init__(self, path, suite_name, encoding=None):
+        self.path = path
+        self.suite_name = suite_name
+        self.encoding = encoding
+        self.tests = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.time = 0.0
+        self.header_size = None
+        self.offset = None # Byte offset of XML_TAIL.
+        name = ET.tostring(ET.Element('testsuite', {'name': decode(suite_name, encoding)}), encoding='utf-8')
+        self.name_attr = name[len('<testsuite '):-len(' />')] # name="..." with escaping.
+        self.file = open(path, 'w+b')
+        header = self._gen_header()
+        self.header_size = len(header) + HEADER_RESERVE
+        self.file.write(self._pad_header(header))
+        self.offset = self.file.tell()
+        self.file.write(XML_TAIL)
+        self.file.flush()
+
+    def _gen_header(self):
+        counts = 'errors="{}" failures="{}" skipped="{}" tests="{}" time="{}"'.format(
+            self.errors, self.failures, self.skipped, self.tests, self.time)
+        return '{}<testsuites {}>\n\t<testsuite {} {}'.format(XML_DECLARATION, counts, counts, self.name_attr)
+
+    def _pad_header(self, header):
+        # Spaces are allowed before the end of tag.
+        return header + ' ' * (self.header_size - len(header) - 2) + '>\n'
+
+    def append(self, test_case):
+        """ Append junit_xml.TestCase. """
+        self.tests += 1
+        if test_case.is_failure(): self.failures += 1
+        if test_case.is_error(): self.errors += 1
+        if test_case.is_skipped(): self.skipped += 1
+        if test_case.elapsed_sec: self.time += test_case.elapsed_sec
+        element = TestSuite.build_test_case_element(test_case, encoding=self.encoding)
+        xml_string = TestSuite._clean_illegal_xml_chars(ET.tostring(element, encoding='utf-8').decode('utf-8'))
+        self.file.seek(self.offset)
+        self.file.write('\t\t{}\n'.format(xml_string.encode('utf-8')))
+        self.offset = self.file.tell()
+        self.file.write(XML_TAIL)
+        self.file.truncate()
+        header = self._gen_header()
+        if len(header) + 2 <= self.header_size: # Counts are only for reading, Jenkins counts test cases by itself.
+            self.file.seek(0)
+            self.file.write(self._pad_header(header))
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed: self.file.close()
+
+
+class LoopResultStore(object):
+    """ Journal, JUnit XML and summary index of a loop test. """
+
+    def __init__(self, journal_path, junit_path, summary_path, suite_name, summary_save_interval=SUMMARY_SAVE_INTERVAL):
+        self.journal_path = journal_path
+        self.summary_path = summary_path
+        self.summary_save_interval = summary_save_interval
+        self.summary = ResultSummary()
+        self.last_summary_save = 0
+        self.journal = open(journal_path, 'w')
+        self.junit = JUnitStreamWriter(junit_path, suite_name)
+        self.save_summary()
+
+    def append(self, test_result):
+        """ Save a summarized TestResult. """
+        line = json.dumps(test_result, ensure_ascii=False)
+        if isinstance(line, unicode): line = line.encode('utf-8')
+        self.journal.write(line + '\n')
+        self.journal.flush()
+        self.summary.add(test_result)
+        self.junit.append(test_result.convert_to_TestCase())
+        if time.time() - self.last_summary_save > self.summary_save_interval:
+            self.save_summary()
+
+    def save_summary(self):
+        self.last_summary_save = time.time()
+        tmp_path = '{}.tmp'.format(self.summary_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.summary.to_dict(), f)
+        os.rename(tmp_path, self.summary_path)
+
+    def close(self):
+        if self.journal.closed:
+            return
+        self.journal.close()
+        self.junit.close()
+        self.save_summary()
+
+
+def read_journal(path):
+    """ Generate dicts of test results in journal. """
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def load_summary(path):
+    with open(path, 'r') as f:
+        return ResultSummary.from_dict(json.load(f))
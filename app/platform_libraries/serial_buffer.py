@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+""" Bounded buffer of console lines with pattern waiters.
+
+Lines are kept in a ring buffer with sequence numbers, and a read cursor gives the same "read once" behavior
+as Queue. A waiter registers a match function, which is checked once for each line on its arrival (and for the
+unread lines at registration), and the waiting thread is woken through condition variable when it's matched:
+
+    buffer = SerialLineBuffer()
+    # Reader thread:
+    buffer.put('FINISHED')
+    # Test thread, return all lines until the first line containing "FINISHED":
+    lines = buffer.wait_for(lambda line: 'FINISHED' in line, timeout=20)
+"""
+# std modules
+import Queue
+import threading
+import time
+from collections import deque
+
+
+MAX_LINES = 50000 # Recent lines kept in buffer.
+
+
+class _LineWaiter(object):
+
+    def __init__(self, match):
+        self.match = match
+        self.seq = None # Sequence number of the matched line.
+
+
+class SerialLineBuffer(object):
+
+    def __init__(self, max_lines=MAX_LINES):
+        """
+        :param max_lines: Max lines kept in buffer, the oldest lines are dropped even they are not read.
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._lines = deque(maxlen=max_lines)
+        self._next_seq = 0 # Sequence number of the next line.
+        self._read_seq = 0 # Sequence number of the next line to read.
+        self._waiters = []
+        self.dropped = 0 # Lines dropped before they are read.
+
+    def _first_seq(self):
+        return self._next_seq - len(self._lines)
+
+    def _line(self, seq):
+        return self._lines[seq - self._first_seq()]
+
+    def _read_to(self, seq):
+        """ Return unread lines until seq (excluded) and move read cursor to seq. """
+        start = max(self._read_seq, self._first_seq())
+        lines = [self._line(idx) for idx in xrange(start, seq)]
+        self._read_seq = max(self._read_seq, seq)
+        return lines
+
+    def _wait(self, predicate, timeout):
+        """ Wait until predicate() is True or timeout (None to wait forever), return the last result. """
+        deadline = None if timeout is None else time.time() + timeout
+        result = predicate()
+        while not result:
+            if deadline is None:
+                self._cond.wait()
+            else:
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            result = predicate()
+        return result
+
+    #
+    # Queue Compatible Methods
+    #
+    def put(self, line, block=True, timeout=None):
+        """ Append line, match it with the waiters and wake them up. Never blocks. """
+        with self._cond:
+            seq = self._next_seq
+            self._lines.append(line)
+            self._next_seq += 1
+            if self._read_seq < self._first_seq():
+                self.dropped += self._first_seq() - self._read_seq
+                self._read_seq = self._first_seq()
+            for waiter in self._waiters:
+                if waiter.seq is None and waiter.match(line):
+                    waiter.seq = seq
+            self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """ Return the next unread line, raise Queue.Empty if there is no line in timeout seconds. """
+        with self._cond:
+            if not self._wait(lambda: self._read_seq < self._next_seq, timeout if block else 0):
+                raise Queue.Empty
+            return self._read_to(self._read_seq + 1)[0]
+
+    def empty(self):
+        with self._cond:
+            return self._read_seq >= self._next_seq
+
+    def qsize(self):
+        with self._cond:
+            return self._next_seq - self._read_seq
+
+    #
+    # Buffer Methods
+    #
+    def clear(self):
+        """ Mark all lines as read. """
+        with self._cond:
+            self._read_seq = self._next_seq
+
+    def read_all(self, timeout=0):
+        """ Wait until there is any unread line or timeout, return all unread lines. """
+        with self._cond:
+            self._wait(lambda: self._read_seq < self._next_seq, timeout)
+            return self._read_to(self._next_seq)
+
+    def wait_for(self, match, timeout=None):
+        """ Wait for the first unread line which match(line) is True, return unread lines until the matched line.
+        Return None if it's timeout, and all unread lines are discarded.
+
+        :param match: Function which gets a line and return True if it's matched.
+        """
+        waiter = _LineWaiter(match)
+        with self._cond:
+            for seq in xrange(max(self._read_seq, self._first_seq()), self._next_seq):
+                if match(self._line(seq)):
+                    waiter.seq = seq
+                    break
+            else:
+                self._waiters.append(waiter)
+                try:
+                    self._wait(lambda: waiter.seq is not None, timeout)
+                finally:
+                    self._waiters.remove(waiter)
+            if waiter.seq is None:
+                self._read_to(self._next_seq)
+                return None
+            return self._read_to(waiter.seq + 1)
+
+    def get_recent_lines(self, count=None):
+        """ Return recent lines in buffer no matter they are read or not. """
+        with self._cond:
+            lines = list(self._lines)
+        return lines[-count:] if count else lines
@@ -6,6 +6,7 @@
 """
 # std modules
 import Queue
+import select
 import socket
 import sys
 import telnetlib
@@ -17,8 +18,18 @@ import hashlib
 # platform modules
 import common_utils
 from pyutils import decode_unicode_args, replace_escape_sequence, retry
+from serial_buffer import SerialLineBuffer
 
 
+READ_INTERVAL = 0.5 # Max seconds to wait for console data in each loop of reader thread.
+PARTIAL_LINE_TIMEOUT = 1 # Regard data without "\n" as a line if there is no more data, e.g. "Password:" prompt.
+# Syslog like "[  270.971988] audit: rate limit exceeded", which may break a line from console.
+SYSLOG_PATTERN = re.compile(r'\[[\t\s]*\d*.\d*\] [\S\s]*')
+SYSLOG_LINE_PATTERN = re.compile(r'^[\t\s]*\[[\t\s]*\d*.\d*\] [\S\s]*')
+EXIT_CODE_PATTERN = re.compile(r'\d+?\|')
+PROMPT_STRINGS = ['root@yodaplus32_mini:/ #', 'root@yoda32_mini:/ #', 'root@monarch32_mini:/ #',
+    'root@pelican32_mini:/ #', '/ #']
+
 serial_lock = threading.RLock()
 lock_log = common_utils.create_logger(root_log='KAT.serial_lock')
 
@@ -90,7 +101,8 @@ class SerialClient(object):
         self.input_queue = Queue.Queue() # Queue to save debug message, and these message only created by our logic.
         self.logger = common_utils.create_logger(root_log='KAT.serialclient', stream_log_level=stream_log_level)
         self.logging_thread = None
-        self.read_queue = None # Queue to save serial message from console.
+        self.read_queue = None # SerialLineBuffer to save serial message from console.
+        self._broken_line = None # (head part, syslog) of the line broken by syslog.
         self.serial = None
         # thread lock used for telling serial reader thread to stop
         self.serial_connected = thread.allocate_lock()
@@ -140,7 +152,7 @@ class SerialClient(object):
         if self.debug: self.serial.set_debuglevel(1)
         self.check_connection_available()
         if not self.read_queue:
-            self.read_queue = Queue.Queue()
+            self.read_queue = SerialLineBuffer()
 
     @synchronize
     def check_connection_available(self, raise_error=True):
@@ -169,7 +181,10 @@ class SerialClient(object):
     @synchronize
     def init_read_queue(self):
         self.logger.debug('Clean read queue.')
-        self.read_queue = Queue.Queue()
+        if self.read_queue:
+            self.read_queue.clear()
+        else:
+            self.read_queue = SerialLineBuffer()
 
     @synchronize
     def close_serial_connection(self):
@@ -299,68 +314,12 @@ class SerialClient(object):
     def _log_serial_messages(self):
         """Loop that runs inside self.logging_thread.
 
-        Output string is split by "\n", each string is regarded as one single line.
+        Raw data from console is buffered and split by "\n", each string is regarded as one single line.
+        The data left without "\n" is regarded as a line if there is no more data for PARTIAL_LINE_TIMEOUT seconds.
         """
-        def put_in_read_queue(msg):
-            if data:
-                if self.daemon_msg: self.logger.debug('READ SERIAL (Daemon): {0}'.format(data))
-                self.read_queue.put(data, timeout=10)
-
-        def get_msg_from_console():
-            """ Read meesage from console and hanlde any exception case. """
-            line = self.serial.read_until('\n', timeout=5)
-            if not line:
-                return line
-
-            if self.pure_msg:
-                return line
-
-            # Filter out mssage like "[  270.971988] audit: rate limit exceeded"
-            matched_strs = re.findall(r'\[[\t\s]*\d*.\d*\] [\S\s]*', line)
-            if not matched_strs:
-                return line
-            # Remove exit code and remove BASH prompt string by the following fixed strings.
-            # e.g. "255|root@yodaplus32_mini:/ # [   60.010688] type=1400 audit(1388534"
-            cleaned_str = re.sub(r'\d+?\|', '', line).replace('root@yodaplus32_mini:/ #', ''). \
-                replace('root@yoda32_mini:/ #', '').replace('root@monarch32_mini:/ #', ''). \
-                replace('root@pelican32_mini:/ #', '').replace('/ #', '')
-            # Check output string is break or not.
-            if re.findall(r'^[\t\s]*\[[\t\s]*\d*.\d*\] [\S\s]*', cleaned_str): # Not break anything.
-                return line
-            # Now we consider the line is broken by a syslog, and we try to recover it.
-            syslog = matched_strs[0]
-            line_head_part = line.replace(syslog, '') # Broken head part.
-            line_tail_part = self.serial.read_until('\n', timeout=5) # Broken tail part.
-            self.logger.warning('Recover broken string from:')
-            self.logger.warning(line)
-            self.logger.warning('To:')
-            if re.findall(r'\[[\t\s]*\d*.\d*\] [\S\s]*', line_tail_part):
-                # The next line is syslog, that means this log not at middle of line. e.g.:
-                # from "RX bytes:6346 TX bytes:6346 [   60.010688] type=1400 audit(1388534" 
-                #      "[   64.393722] init: no such service 'bootanim'" 
-                #  to  "RX bytes:6346 TX bytes:6346 "
-                #      "[   60.010688] type=1400 audit(1388534"
-                #      "[   64.393722] init: no such service 'bootanim'" 
-                put_in_read_queue(line_head_part)
-                put_in_read_queue(syslog)
-                put_in_read_queue(line_tail_part)
-                self.logger.warning(line_head_part)
-                self.logger.warning(syslog)
-                self.logger.warning(line_tail_part)
-            else: # Recover messages. e.g.:
-                # from "configURL = "https://qa[   60.010688] type=1400 audit(1388534" 
-                #      "1.wdtest1.com"" 
-                #  to  "configURL = "https://qa1.wdtest1.com"" 
-                #      "[   60.010688] type=1400 audit(1388534"
-                line = line_head_part + line_tail_part
-                put_in_read_queue(line)
-                put_in_read_queue(syslog)
-                self.logger.warning(line)
-                self.logger.warning(syslog)
-            return ''
-
         self.logger.debug('Daemon started.')
-        data = ''
+        raw_data = ''
+        last_data_time = time.time()
         while self.serial_connected.locked():
             while not self.input_queue.empty():
                 self.logger.debug(str(self.input_queue.get()))
@@ -372,22 +331,91 @@ class SerialClient(object):
             if not self.serial:
                 self._connect()
             try:
-                #print 'Wait for READ!'
-                data = replace_escape_sequence(get_msg_from_console())
-                #data = data.replace('\n', '\r\n') # Why Need this???
-                put_in_read_queue(msg=data)
-                #print 'GO Next READ!'
+                lines = []
+                if select.select([self.serial.get_socket()], [], [], READ_INTERVAL)[0]:
+                    data = self.serial.read_very_eager() # Raise EOFError if connection is closed.
+                    if data:
+                        last_data_time = time.time()
+                        lines = (raw_data + data).split('\n')
+                        raw_data = lines.pop()
+                if time.time() - last_data_time > PARTIAL_LINE_TIMEOUT:
+                    if raw_data:
+                        lines.append(raw_data)
+                        raw_data = ''
+                    elif self._broken_line: # No tail part.
+                        lines.append('')
+                for line in lines:
+                    self._handle_console_line(line)
             except Exception as e:
                 if self.serial_connected.locked():
                     self.logger.warning(
                         'Error reading from serial port: {0} at {1}'.format(str(e), time.asctime()), exc_info=True)
                     self.logger.debug('Reopening serial connection')
+                    raw_data = ''
+                    self._broken_line = None
                     self._connect()
                 else:
                     self.logger.debug('serial port logging thread exiting')
                     return
         self.logger.debug('Serial port logging thread exiting since exit the loop.')
 
+    def _put_in_read_queue(self, line):
+        data = replace_escape_sequence(line)
+        if data:
+            if self.daemon_msg: self.logger.debug('READ SERIAL (Daemon): {0}'.format(data))
+            self.read_queue.put(data)
+
+    def _handle_console_line(self, line):
+        """ Put a line from console into read queue, and recover the line if it's broken by a syslog. """
+        if self._broken_line:
+            self._recover_broken_line(line_tail_part=line)
+            return
+        if self.pure_msg:
+            self._put_in_read_queue(line)
+            return
+
+        # Filter out mssage like "[  270.971988] audit: rate limit exceeded"
+        matched = SYSLOG_PATTERN.search(line)
+        if not matched:
+            self._put_in_read_queue(line)
+            return
+        # Remove exit code and remove BASH prompt string by the following fixed strings.
+        # e.g. "255|root@yodaplus32_mini:/ # [   60.010688] type=1400 audit(1388534"
+        cleaned_str = EXIT_CODE_PATTERN.sub('', line)
+        for prompt in PROMPT_STRINGS:
+            cleaned_str = cleaned_str.replace(prompt, '')
+        # Check output string is break or not.
+        if SYSLOG_LINE_PATTERN.match(cleaned_str): # Not break anything.
+            self._put_in_read_queue(line)
+            return
+        # Now we consider the line is broken by a syslog, and we try to recover it with the next line.
+        syslog = matched.group()
+        self._broken_line = (line.replace(syslog, ''), syslog)
+        self.logger.warning('Recover broken string from:')
+        self.logger.warning(line)
+
+    def _recover_broken_line(self, line_tail_part):
+        line_head_part, syslog = self._broken_line
+        self._broken_line = None
+        self.logger.warning('To:')
+        if SYSLOG_PATTERN.search(line_tail_part):
+            # The next line is syslog, that means this log not at middle of line. e.g.:
+            # from "RX bytes:6346 TX bytes:6346 [   60.010688] type=1400 audit(1388534"
+            #      "[   64.393722] init: no such service 'bootanim'"
+            #  to  "RX bytes:6346 TX bytes:6346 "
+            #      "[   60.010688] type=1400 audit(1388534"
+            #      "[   64.393722] init: no such service 'bootanim'"
+            lines = [line_head_part, syslog, line_tail_part]
+        else: # Recover messages. e.g.:
+            # from "configURL = "https://qa[   60.010688] type=1400 audit(1388534"
+            #      "1.wdtest1.com""
+            #  to  "configURL = "https://qa1.wdtest1.com""
+            #      "[   60.010688] type=1400 audit(1388534"
+            lines = [line_head_part + line_tail_part, syslog]
+        for line in lines:
+            self._put_in_read_queue(line)
+            self.logger.warning(line)
+
     def serial_debug(self, msg):
         """
         Places a given message into the input queue
@@ -403,16 +431,11 @@ class SerialClient(object):
         if not self.read_queue:
             self.error('Cannot read all from serial port, serial port not connected')
 
-        output = []
         # Wait few seconds to waiting for daemon read message into read_queue.
-        start = time.time()
-        while self.read_queue.empty() and (time.time() - start < time_for_read):
-            time.sleep(1)
-
-        while not self.read_queue.empty():
-            out = self.read_queue.get()
-            if debug_logs: self.logger.debug('READ SERIAL: {0}'.format(out))
-            output.append(out)
+        output = self.read_queue.read_all(timeout=time_for_read)
+        if debug_logs:
+            for out in output:
+                self.logger.debug('READ SERIAL: {0}'.format(out))
         return output
 
     @synchronize
@@ -496,22 +519,11 @@ class SerialClient(object):
         self.logger.debug('Waiting for string: {0}'.format(string))
         if not string:
             return self.serial_read()
-        output = []
-        start = time.time()
-        while True:
-            buff = None
-            if time.time() - start > timeout:
-                self.error('Wait for string "{}" timeout {}s'.format(string, timeout), raise_error)
-                return [] # We may return output here.
-            try:
-                buff = self.read_queue.get(timeout=5)
-            except Queue.Empty:
-                time.sleep(1)
-            if not buff:
-                continue
-            output.append(buff)
-            if string in buff:
-                return output
+        output = self.read_queue.wait_for(lambda line: string in line, timeout=timeout)
+        if output is None:
+            self.error('Wait for string "{}" timeout {}s'.format(string, timeout), raise_error)
+            return [] # We may return output here.
+        return output
 
     def serial_wait_for_string_and_return_string(self, string, sep='\n', timeout=5, raise_error=True):
         """Wait for the given string and return all message in a string or for the timeout (in seconds, default 5)."""
@@ -529,12 +541,13 @@ class SerialClient(object):
 
     def _serial_filter_read_for_seconds(self, re_pattern, timeout_for_each_read=1, time_for_read=20):
         """ Read output for time_for_read seconds and filter out all console string. """
+        pattern = re.compile(re_pattern)
         start = time.time()
         while time.time() - start < time_for_read:
             try:
-                line = self.serial_readline(timeout_for_each_read)
+                line = self.serial_readline(min(timeout_for_each_read, max(time_for_read - (time.time() - start), 0)))
                 if line:
-                    if re.findall(re_pattern, line):
+                    if pattern.search(line):
                         yield line
                     else:
                         yield None # Treat as a ignored message.
@@ -543,9 +556,13 @@ class SerialClient(object):
 
     def serial_wait_for_filter_string(self, re_pattern, timeout=5):
         """ Wait for the first matched string or for the timeout. """
-        for msg in self._serial_filter_read_for_seconds(re_pattern, 1, timeout):
-            if msg:
-                return msg
+        if not self.read_queue:
+            self.error('Cannot wait for "{0}" from serial port, serial port not connected'.format(re_pattern))
+        pattern = re.compile(re_pattern)
+        output = self.read_queue.wait_for(lambda line: pattern.search(line), timeout=timeout)
+        if output:
+            self.logger.debug('READ SERIAL: {0}'.format(output[-1]))
+            return output[-1]
         return None
 
     def serial_filter_read(self, re_pattern, timeout_for_each_read=10, time_for_read=20):
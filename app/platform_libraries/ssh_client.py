@@ -5,6 +5,7 @@ import os
 import re
 import math
 import json
+import shlex
 import time
 from datetime import datetime
 from base64 import b64encode
@@ -19,6 +20,13 @@ from constants import Godzilla as GZA, KDP
 from platform_libraries.common_utils import execute_local_cmd
 from platform_libraries.pyutils import retry, NotSet
 from platform_libraries.paser_utls import parse_mdstat, parse_mdadm, parse_smart
+from platform_libraries.remote_hash import RemoteHasher
+from platform_libraries.ssh_executor import SSHCommandExecutor
+from platform_libraries.ssh_shell import SSHShellSession
+from platform_libraries.ssh_transfer import SSHTransferEngine
+
+
+RESTSDK_SERVICE_CMD = 'ps aux | grep restsdk-server | grep -v grep | grep -v restsdk-serverd'
 
 
 def retry_connect(method):
@@ -78,6 +86,15 @@ class SSHClient(object):
         self.timeout = timeout
         # set default cert. it should no effect to the devices not use securing access.
         self.key_filename = os.path.dirname(__file__) + '/ssh_cert/id_ecdsa'
+        # Run execute_cmd() commands in channels of the same transport.
+        self.executor = SSHCommandExecutor(get_transport=lambda: self.client.get_transport())
+        # Persistent shell for batch().
+        self.shell_session = SSHShellSession(get_transport=lambda: self.client.get_transport(), timeout=timeout)
+        # Parallel and resumable file transfer.
+        self.transfer = SSHTransferEngine(get_transport=lambda: self.client.get_transport())
+        # Batched file hashing with cache of unchanged files.
+        self.hasher = RemoteHasher(
+            run_cmd=lambda cmd, timeout=60*30: self.execute_cmd(cmd, quiet=True, timeout=timeout)[0])
 
     def connect(self, retry=True, max_times=12):
         if not retry:
@@ -145,14 +162,12 @@ class SSHClient(object):
         stdin, stdout, stderr = self.client.exec_command(command, timeout=timeout)
         return self._response(command, stdin, stdout, stderr)
 
-    def _execute_cmd(self, cmd):
+    def _execute_cmd(self, cmd, timeout=None):
         """
             Used to retry the ssh connection in the execute_cmd method
         """
         try:
-            stdin, stdout, stderr = self.client.exec_command(cmd)
-            stdin.close()
-            return stdin, stdout, stderr
+            return self.executor.submit(cmd, timeout=timeout)
         except Exception as e:
             self.log.info("Send command failed due to: {}, try to reconnect the ssh after 60 seconds".format(repr(e)))
             time.sleep(60)
@@ -163,26 +178,35 @@ class SSHClient(object):
         # For Godzilla project
         if not timeout:
             timeout = self.timeout
-        log_msg = 'Executing command: {}'.format(command)
 
-        stdin, stdout, stderr = retry(func=self._execute_cmd, excepts=Exception, cmd=command, log=self.log.info)
+        result = retry(func=self._execute_cmd, excepts=Exception, cmd=command, timeout=timeout, log=self.log.info)
+        result.wait()
+        return self._cmd_result(result, quiet, stop_on_timeout)
 
-        # This is a workaround to force stdout close when it's hanged
-        endtime = time.time() + timeout
-        while not stdout.channel.eof_received:
-            time.sleep(5)
-            if time.time() > endtime:
-                self.log.warning(
-                    'stdout hanged for {} seconds while executing "{}", force to close the channel!'.format(timeout,
-                                                                                                            command))
-                stdout.channel.close()
-                if stop_on_timeout:
-                    raise Exception("The ssh command was timed out after {} seconds!".format(timeout))
-                else:
-                    break
+    def execute_cmds(self, commands, quiet=False, timeout="", stop_on_timeout=False):
+        """ Run commands concurrently in channels of the same connection and return list of (stdout, stderr). """
+        if not timeout:
+            timeout = self.timeout
 
-        stdout = str(stdout.read()).strip()
-        stderr = str(stderr.read()).strip()
+        results = [retry(func=self._execute_cmd, excepts=Exception, cmd=command, timeout=timeout, log=self.log.info)
+            for command in commands]
+        for result in results:
+            result.wait()
+        return [self._cmd_result(result, quiet, stop_on_timeout) for result in results]
+
+    def _cmd_result(self, result, quiet, stop_on_timeout):
+        log_msg = 'Executing command: {}'.format(result.command)
+        if result.timed_out:
+            self.log.warning(
+                'stdout hanged for {} seconds while executing "{}", force to close the channel!'.format(result.timeout,
+                                                                                                        result.command))
+            if stop_on_timeout:
+                raise Exception("The ssh command was timed out after {} seconds!".format(result.timeout))
+        elif result.error:
+            raise result.error
+
+        stdout = str(result.stdout).strip()
+        stderr = str(result.stderr).strip()
         if quiet:
             self.log.debug(log_msg)
             self.log.debug("\tstdout: {}".format(stdout))
@@ -194,6 +218,29 @@ class SSHClient(object):
                 self.log.warning("\tstderr: {}".format(stderr))
         return stdout, stderr
 
+    def batch(self, timeout=None):
+        """ Collect commands and run them in the persistent shell with one round trip.
+
+            with ssh.batch() as batch:
+                version = batch.execute('cat /etc/version')
+                model = batch.execute('cat /etc/model')
+            status, output = version.get()
+        """
+        return self.shell_session.batch(timeout=timeout)
+
+    def shell_execute(self, command, timeout=None):
+        """ Run command in the persistent shell, return (status, output) like execute(). """
+        status, stdout, stderr = self.shell_session.execute(command, timeout=timeout)
+        self.log.info(command)
+        self.log.info('{}'.format(stdout))
+        if stderr:
+            self.log.warning('Execute command: {} failed, error message: {}'.format(command, stderr))
+        return status, stdout
+
+    def get_cmd_stats(self):
+        """ Return count and latency summary of commands run by execute_cmd(). """
+        return self.executor.get_stats()
+
     def remount_and_execute_cmd(self, remount_path, command):
         self.execute_cmd('mount -o rw,remount {}'.format(remount_path))
         self.execute_cmd(command)
@@ -257,6 +304,8 @@ class SSHClient(object):
         return self._response(command, stdin, stdout, stderr)
 
     def close(self):
+        self.executor.close()
+        self.shell_session.close()
         if self.client:
             self.log.info('Closing SSH connection')
             try:
@@ -276,11 +325,11 @@ class SSHClient(object):
     def sftp_connect(self):
         self.sftp = self.client.open_sftp()
 
-    def sftp_upload(self, localpath, remotepath):
-        self.sftp.put(localpath, remotepath)
+    def sftp_upload(self, localpath, remotepath, resume=False):
+        return self.transfer.upload(localpath, remotepath, resume=resume, sftp=self.sftp)
 
-    def sftp_download(self, remotepath, localpath):
-        self.sftp.get(remotepath, localpath)
+    def sftp_download(self, remotepath, localpath, resume=False):
+        return self.transfer.download(remotepath, localpath, resume=resume, sftp=self.sftp)
 
     def sftp_stat(self, path):
         """ Retrieve a file information on the remote system """
@@ -298,6 +347,32 @@ class SSHClient(object):
                 self.log.warning(e)
             self.sftp = None
 
+    # ======================================================================================#
+    #                                  Parallel Transfer                                    #
+    # ======================================================================================#
+
+    """
+        Transfer files with SSHTransferEngine. SFTP is used if device supports it, otherwise files are
+        streamed with exec channels. Set compress=True to gzip data on the fly for slow links.
+    """
+
+    def upload_files(self, pairs, resume=False, compress=None):
+        """ Upload list of (localpath, remotepath) in parallel. """
+        return self.transfer.upload_many(pairs, resume=resume, compress=compress)
+
+    def download_files(self, pairs, resume=False, compress=None):
+        """ Download list of (remotepath, localpath) in parallel. """
+        return self.transfer.download_many(pairs, resume=resume, compress=compress)
+
+    def upload_dir(self, localdir, remotedir, resume=False, compress=None):
+        return self.transfer.upload_dir(localdir, remotedir, resume=resume, compress=compress)
+
+    def download_dir(self, remotedir, localdir, resume=False, compress=None):
+        return self.transfer.download_dir(remotedir, localdir, resume=resume, compress=compress)
+
+    def get_transfer_stats(self):
+        return self.transfer.get_stats()
+
     # ======================================================================================#
     # ..                                        SCP                                         #
     # ======================================================================================#
@@ -577,6 +652,10 @@ class SSHClient(object):
 
     def get_model_name(self):
         status, output = self.execute('cat /etc/model')
+        return self._parse_model_name(status, output)
+
+    @staticmethod
+    def _parse_model_name(status, output):
         if status != 0 or not output:
             return None
         else:
@@ -596,7 +675,7 @@ class SSHClient(object):
             return output
 
     def get_restsdk_service(self):
-        status, output = self.execute('ps aux | grep restsdk-server | grep -v grep | grep -v restsdk-serverd')
+        status, output = self.execute(RESTSDK_SERVICE_CMD)
         if status != 0 or not output:
             return None
         else:
@@ -629,8 +708,12 @@ class SSHClient(object):
             return None
 
         stdout, stderr = self.execute_cmd('cat {} | grep configURL'.format(restsdk_cfg_file), timeout=30)
-        if stdout:
-            return stdout.split()[-1].strip('"')
+        return self._parse_configurl(stdout)
+
+    @staticmethod
+    def _parse_configurl(output):
+        if output:
+            return output.split()[-1].strip('"')
         else:
             return None
 
@@ -657,7 +740,10 @@ class SSHClient(object):
 
     def get_device_environment(self):
         # Get cloud environment type: qa1, dev1, prod
-        config_url = self.get_restsdk_configurl()
+        return self._parse_device_environment(self.get_restsdk_configurl())
+
+    @staticmethod
+    def _parse_device_environment(config_url):
         if not config_url: # fake env for RND
             return 'qa1'
         if 'dev1' in config_url:
@@ -668,11 +754,39 @@ class SSHClient(object):
 
     def get_mac_address(self, interface='eth0'):
         stdout, stderr = self.execute_cmd('cat /sys/class/net/{}/address'.format(interface))
-        mac_address = stdout.strip()
+        return self._parse_mac_address(stdout)
+
+    @staticmethod
+    def _parse_mac_address(output):
+        mac_address = output.strip()
         if len(mac_address) != 17:
             return None
         return mac_address
 
+    def get_device_info_in_batch(self, mac_interfaces=('eth0', 'wlan0', 'egiga0')):
+        """ Get firmware, model, config URL, serial number and MAC addresses with one round trip.
+        The field is None if it's failed to get, ex: config URL when RestSDK is in minimal mode.
+        """
+        with self.batch(timeout=60) as batch:
+            firmware = batch.execute('cat /etc/version')
+            model = batch.execute('cat /etc/model')
+            config_url = batch.execute(
+                "grep configURL \"$({} | grep -v minimal | sed -n 's/.*restsdk-server -configPath \\(.*\\) -crashLog.*/\\1/p'"
+                " | head -n 1)\"".format(RESTSDK_SERVICE_CMD))
+            serial_number = batch.execute('cat /proc/device-tree/factory/serial')
+            mac_addresses = {interface: batch.execute('cat /sys/class/net/{}/address'.format(interface))
+                for interface in mac_interfaces}
+        data = {
+            'firmware': firmware.stdout if firmware.status == 0 and firmware.stdout else None,
+            'model': self._parse_model_name(*model.get()),
+            'config_url': self._parse_configurl(config_url.stdout),
+            'serial_number': serial_number.stdout.strip('\x00') if serial_number.status == 0 and serial_number.stdout else None,
+            'mac_addresses': {interface: self._parse_mac_address(result.stdout) for interface, result in mac_addresses.iteritems()}
+        }
+        data['environment'] = self._parse_device_environment(data['config_url']) if data['config_url'] else None
+        self.log.info('Device information: {}'.format(data))
+        return data
+
     def get_restsdk_version(self):
         return self.get_device_info(fields='version').get('version')
 
@@ -884,10 +998,17 @@ class SSHClient(object):
         self.log.warning("Cannot find FTS rebuild info!")
         return None
 
+    @staticmethod
+    def _unescape_path(path):
+        """ Return the real path of a shell escaped path, ex: '/auth0\|xxx/a\ b' => '/auth0|xxx/a b'. """
+        try:
+            tokens = shlex.split(path)
+        except ValueError:
+            return path
+        return tokens[0] if len(tokens) == 1 else path
+
     def get_folder_md5_checksum(self, path):
-        result = self.execute_cmd("find " + path +
-                                  " -type f -exec busybox md5sum {} + | awk '{print $1}'" 
-                                  " | sort | busybox md5sum | awk '{print $1}'")[0]
+        result = self.hasher.hash_folder(self._unescape_path(path))
         if result:
             self.log.info("Folder MD5 checksum: {}".format(result))
             return result
@@ -1485,14 +1606,15 @@ class SSHClient(object):
         self.execute_cmd('dd if=/dev/urandom of={0} bs=1 count={1}'.format(file_path, file_size))
 
     def get_file_md5_checksum(self, file_path):
-        if not self.check_file_in_device(file_path):
+        # File is hashed again only if its size or mtime is changed.
+        record = self.hasher.hash_files([self._unescape_path(file_path)]).get(self._unescape_path(file_path))
+        if not record:
             raise RuntimeError("Cannot find the file: {} in test device!".format(file_path))
-        result = self.execute_cmd('busybox md5sum {}'.format(file_path))[0]
-        if result:
-            md5_checksum = result.strip().split()[0]
-        else:
-            md5_checksum = None
-        return md5_checksum
+        return record.digest
+
+    def get_files_md5_checksum(self, paths):
+        """ Return {file path: md5} of files and files under folders in paths with one or two round trips. """
+        return {path: record.digest for path, record in self.hasher.hash_files(paths).iteritems()}
 
     def stop_logpp(self):
         self.log.info("Stopping LogPP process")
@@ -1770,8 +1892,14 @@ class SSHClient(object):
         self.execute_cmd("[ -e {0} ] && rm {0}".format(device_tmp_log))
         # Compressing log folder to a file.
         self.execute_cmd("tar cvzfp {0} /var/log/*".format(device_tmp_log))
-        if not self.scp: self.scp_connect()
-        self.scp_download(device_tmp_log, file_name)
+        # Not to resume a stale file of previous run.
+        if os.path.exists(file_name): os.remove(file_name)
+        # Resume the partial file if the download is interrupted by slow link.
+        attempts = []
+        def download():
+            attempts.append(1)
+            return self.transfer.download(remotepath=device_tmp_log, localpath=file_name, resume=len(attempts) > 1)
+        retry(func=download, excepts=Exception, delay=10, max_retry=3, log=self.log.info)
 
     def clean_device_logs(self):
         self.log.info('Clean up logs...')
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+""" Event-driven command executor over one SSH transport.
+
+Every command runs in its own exec channel of the shared paramiko transport, and one daemon thread waits for
+all channels with select(): outputs are read as soon as they arrive and a command is completed as soon as
+its exit status is received, so there is no fixed sleep between polls. Commands from different threads run
+concurrently (up to max_channels at a time), each one with its own timeout, and latencies are recorded in a
+histogram.
+"""
+# std modules
+import os
+import select
+import threading
+import time
+
+# platform modules
+import common_utils
+from platform_libraries.histogram import LatencyHistogram
+
+
+#
+# Executor Settings
+#
+MAX_CHANNELS = 8 # OpenSSH and dropbear allow 10 sessions per connection by default.
+RECV_SIZE = 32768
+STATUS_WAIT = 0.01 # Seconds. Short wait for exit status after EOF is received (it is sent right after EOF).
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class CommandResult(object):
+    """ Result of one command, which is completed by the executor thread. """
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.channel = None
+        self.start_time = time.time()
+        self.end_time = None
+        self.deadline = self.start_time + timeout if timeout else None
+        self.exit_status = None
+        self.timed_out = False
+        self.error = None
+        self._stdout = []
+        self._stderr = []
+        self._done = threading.Event()
+
+    @property
+    def stdout(self):
+        return ''.join(self._stdout)
+
+    @property
+    def stderr(self):
+        return ''.join(self._stderr)
+
+    @property
+    def latency(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ Block until the command is completed. Return True if it's completed. """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+
+@common_utils.logger()
+class SSHCommandExecutor(object):
+
+    def __init__(self, get_transport, max_channels=MAX_CHANNELS):
+        """
+        :param get_transport: Function without argument which returns the connected paramiko Transport.
+        :param max_channels: Max number of commands running at the same time.
+        """
+        self.get_transport = get_transport
+        self.max_channels = max_channels
+        self._slots = threading.BoundedSemaphore(max_channels)
+        self._lock = threading.Lock()
+        self._running = {} # channel: CommandResult
+        self._thread = None
+        self._wakeup_r = self._wakeup_w = None # Pipe to wake up event loop, created by submit().
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.latency = LatencyHistogram()
+        self.commands = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.max_in_flight = 0
+
+    def get_stats(self):
+        stats = self.latency.summary(percents=(50, 90, 99))
+        stats.update({
+            'commands': self.commands,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'max_in_flight': self.max_in_flight
+        })
+        return stats
+
+    #
+    # Public Methods
+    #
+    def submit(self, command, timeout=None):
+        """ Start command and return its CommandResult without waiting. Block if max_channels commands are running.
+
+        :param timeout: Seconds to force close the channel. None means no timeout.
+        """
+        self._slots.acquire()
+        result = CommandResult(command, timeout)
+        try:
+            channel = self.get_transport().open_session(timeout=timeout)
+            channel.exec_command(command)
+            channel.shutdown_write() # Same as closing stdin.
+            channel.setblocking(0)
+            channel.fileno() # Create the pipe to select before the channel is registered.
+        except:
+            self._slots.release()
+            with self._lock:
+                self.errors += 1
+            raise
+        result.channel = channel
+        with self._lock:
+            self._running[channel] = result
+            self.commands += 1
+            self.max_in_flight = max(self.max_in_flight, len(self._running))
+            self._open_pipe()
+            self._start_thread()
+        self._wakeup()
+        return result
+
+    def execute(self, command, timeout=None):
+        """ Run command and return its CommandResult after it's completed or timed out. """
+        result = self.submit(command, timeout)
+        result.wait()
+        return result
+
+    def execute_many(self, commands, timeout=None):
+        """ Run commands concurrently and return their CommandResult in the same order. """
+        results = [self.submit(command, timeout) for command in commands]
+        for result in results:
+            result.wait()
+        return results
+
+    def close(self):
+        """ Force close all running commands and the wakeup pipe. Executor can still be used after closing. """
+        with self._lock:
+            results = self._running.values()
+        for result in results:
+            self._finish(result, error=RuntimeError('Executor is closed'))
+        thread = self._thread
+        if thread and thread.is_alive(): # Let event loop exit before closing the pipe it selects.
+            self._wakeup()
+            thread.join(1)
+        with self._lock:
+            if not self._thread: # Not started again by other thread.
+                self._close_pipe()
+
+    def __del__(self):
+        self._close_pipe()
+
+    #
+    # Event Loop
+    #
+    def _open_pipe(self):
+        # you are holding the lock.
+        if self._wakeup_r is None:
+            self._wakeup_r, self._wakeup_w = os.pipe()
+
+    def _close_pipe(self):
+        for fd in (self._wakeup_r, self._wakeup_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._wakeup_r = self._wakeup_w = None
+
+    def _wakeup(self):
+        if self._wakeup_w is not None:
+            os.write(self._wakeup_w, 'x')
+
+    def _start_thread(self):
+        # you are holding the lock.
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._event_loop, name='SSHCommandExecutor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _event_loop(self):
+        while True:
+            with self._lock:
+                if not self._running: # Exit when idle, it's started again by next submit().
+                    self._thread = None
+                    return
+                results = self._running.values()
+
+            now = time.time()
+            wait_time = None
+            readers = [self._wakeup_r]
+            for result in results:
+                if result.deadline:
+                    left = max(0, result.deadline - now)
+                    wait_time = left if wait_time is None else min(wait_time, left)
+                if result.channel.eof_received: # Channel pipe keeps readable after EOF, wait exit status by time.
+                    wait_time = STATUS_WAIT if wait_time is None else min(wait_time, STATUS_WAIT)
+                else:
+                    readers.append(result.channel)
+            try:
+                readable, _, _ = select.select(readers, [], [], wait_time)
+            except (select.error, IOError, ValueError) as e: # Channel is closed by other thread.
+                self.log.debug('select() failed: {}'.format(e))
+                readable = []
+            if self._wakeup_r in readable:
+                os.read(self._wakeup_r, 4096)
+
+            now = time.time()
+            for result in results:
+                if result.done():
+                    continue
+                try:
+                    self._read(result)
+                    if result.channel.exit_status_ready() and not self._has_data(result.channel):
+                        self._finish(result)
+                    elif result.deadline and now >= result.deadline:
+                        self._finish(result, timed_out=True)
+                except Exception as e:
+                    self._finish(result, error=e)
+
+    @staticmethod
+    def _has_data(channel):
+        return channel.recv_ready() or channel.recv_stderr_ready()
+
+    def _read(self, result):
+        channel = result.channel
+        while channel.recv_ready():
+            result._stdout.append(channel.recv(RECV_SIZE))
+        while channel.recv_stderr_ready():
+            result._stderr.append(channel.recv_stderr(RECV_SIZE))
+
+    def _finish(self, result, timed_out=False, error=None):
+        with self._lock:
+            if self._running.pop(result.channel, None) is None: # Finished by other thread.
+                return
+            if timed_out: self.timeouts += 1
+            if error: self.errors += 1
+        result.end_time = time.time()
+        result.timed_out = timed_out
+        result.error = error
+        if not timed_out and not error:
+            result.exit_status = result.channel.exit_status
+        try:
+            result.channel.close()
+        except Exception:
+            pass
+        self.latency.record(result.latency)
+        self._slots.release()
+        result._done.set()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+""" Persistent remote shell session to run many commands in one round trip.
+
+One "sh" process is kept running in an exec channel, and commands are written to its stdin. Each command runs
+in a subshell with stdin from /dev/null, followed by sentinel lines on stdout and stderr which carry the exit
+status, so outputs of pipelined commands can be split back to each command:
+
+    session = SSHShellSession(ssh.client.get_transport)
+    with session.batch() as batch:
+        version = batch.execute('cat /etc/version')
+        model = batch.execute('cat /etc/model')
+    # All commands are sent in one write, results are ready here.
+    print version.status, version.stdout, model.stdout
+
+Commands run in subshells, so "cd", "exit" or variables of one command do not affect the others.
+"""
+# std modules
+import select
+import re
+import threading
+import time
+import uuid
+
+# platform modules
+import common_utils
+
+
+RECV_SIZE = 32768
+
+
+class ShellSessionError(Exception):
+    pass
+
+
+class ShellResult(object):
+    """ Result of one command, which is filled after the command is done. """
+
+    def __init__(self, command):
+        self.command = command
+        self.status = None
+        self.stdout = None
+        self.stderr = None
+        self.latency = None
+        self.error = None
+
+    def done(self):
+        return self.status is not None or self.error is not None
+
+    def get(self):
+        """ Return (status, stdout) like SSHClient.execute(), raise error if the command is failed to run. """
+        if self.error:
+            raise self.error
+        if not self.done():
+            raise ShellSessionError('Command is not executed yet: {}'.format(self.command))
+        return self.status, self.stdout
+
+
+class ShellBatch(object):
+    """ Commands collected in SSHShellSession.batch(). """
+
+    def __init__(self):
+        self.results = []
+
+    def execute(self, command):
+        """ Queue command and return its ShellResult which is ready after the batch is done. """
+        result = ShellResult(command)
+        self.results.append(result)
+        return result
+
+
+class _ShellBatchContext(object):
+
+    def __init__(self, session, timeout):
+        self.session = session
+        self.timeout = timeout
+        self.batch = ShellBatch()
+
+    def __enter__(self):
+        return self.batch
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.batch.results:
+            self.session.run(self.batch.results, timeout=self.timeout)
+
+
+@common_utils.logger()
+class SSHShellSession(object):
+
+    def __init__(self, get_transport, shell='sh', timeout=300):
+        """
+        :param get_transport: Function without argument which returns the connected paramiko Transport.
+        :param shell: Remote shell command to run.
+        :param timeout: Default seconds to wait for a batch of commands.
+        """
+        self.get_transport = get_transport
+        self.shell = shell
+        self.timeout = timeout
+        self.channel = None
+        self._lock = threading.Lock()
+        self._token = None
+        self._seq = 0
+        self._stdout_buffer = ''
+        self._stderr_buffer = ''
+        self.round_trips = 0
+        self.commands = 0
+
+    #
+    # Session Methods
+    #
+    def is_open(self):
+        return bool(self.channel) and not self.channel.closed and not self.channel.exit_status_ready()
+
+    def open(self):
+        self.close()
+        self.log.debug('Opening shell session')
+        self.channel = self.get_transport().open_session()
+        self.channel.exec_command(self.shell)
+        self.channel.setblocking(0)
+        self._token = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._stdout_buffer = ''
+        self._stderr_buffer = ''
+
+    def close(self):
+        if not self.channel:
+            return
+        try:
+            self.channel.close()
+        except Exception as e:
+            self.log.debug('Close shell session failed: {}'.format(e))
+        self.channel = None
+
+    def batch(self, timeout=None):
+        """ Context manager to collect commands and run them in one round trip at the end of with block. """
+        return _ShellBatchContext(self, timeout)
+
+    def execute(self, command, timeout=None):
+        """ Run one command, return (status, stdout, stderr). """
+        result = ShellResult(command)
+        self.run([result], timeout=timeout)
+        if result.error:
+            raise result.error
+        return result.status, result.stdout, result.stderr
+
+    def run(self, results, timeout=None):
+        """ Send commands of ShellResult list in one write and fill their outputs.
+
+        :param timeout: Seconds to wait for all commands. The session is closed if it's timed out.
+        """
+        timeout = timeout or self.timeout
+        with self._lock:
+            if not self.is_open():
+                self.open()
+            start_time = time.time()
+            scripts = []
+            pending = []
+            for result in results:
+                self._seq += 1
+                sentinel = '__KAT_{}_{}_END'.format(self._token, self._seq)
+                scripts.append(self._wrap(result.command, sentinel))
+                pending.append((result, sentinel))
+            try:
+                self.channel.sendall(''.join(scripts))
+                self.round_trips += 1
+                self.commands += len(results)
+                self._wait(pending, start_time + timeout)
+            except Exception as e:
+                self.log.warning('Shell session is broken: {}'.format(repr(e)))
+                self.close()
+                for result, _ in pending:
+                    if not result.done(): result.error = e
+                raise
+            finally:
+                latency = time.time() - start_time
+                for result in results:
+                    result.latency = latency
+
+    @staticmethod
+    def _wrap(command, sentinel):
+        # Leading newline of sentinel makes it start at a new line even if the output has no trailing newline.
+        return ("(\n{cmd}\n) </dev/null\n"
+                "printf '\\n{sentinel}_%d__\\n' $?\n"
+                "printf '\\n{sentinel}__\\n' >&2\n").format(cmd=command, sentinel=sentinel)
+
+    def _wait(self, pending, deadline):
+        index = 0
+        while index < len(pending):
+            result, sentinel = pending[index]
+            stdout_match = re.search('\n{}_(\\d+)__\n'.format(sentinel), self._stdout_buffer)
+            stderr_pos = self._stderr_buffer.find('\n{}__\n'.format(sentinel))
+            if stdout_match and stderr_pos >= 0:
+                result.stdout = self._stdout_buffer[:stdout_match.start()].strip()
+                result.stderr = self._stderr_buffer[:stderr_pos].strip()
+                result.status = int(stdout_match.group(1))
+                self._stdout_buffer = self._stdout_buffer[stdout_match.end():]
+                self._stderr_buffer = self._stderr_buffer[stderr_pos+len(sentinel)+4:]
+                index += 1
+                continue
+            self._recv(deadline)
+
+    def _recv(self, deadline):
+        left = deadline - time.time()
+        if left <= 0:
+            raise ShellSessionError('Commands are timed out')
+        if not self.channel.recv_ready() and not self.channel.recv_stderr_ready():
+            if self.channel.closed or self.channel.eof_received:
+                raise ShellSessionError('Shell is exited with status {}'.format(self.channel.exit_status))
+            select.select([self.channel], [], [], left)
+        while self.channel.recv_ready():
+            self._stdout_buffer += self.channel.recv(RECV_SIZE)
+        while self.channel.recv_stderr_ready():
+            self._stderr_buffer += self.channel.recv_stderr(RECV_SIZE)
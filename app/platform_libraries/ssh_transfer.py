@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+""" Parallel, pipelined and resumable file transfer over one SSH connection.
+
+Files are transferred with SFTP when the device has SFTP subsystem: reads are sent as windows of many
+outstanding requests (readv) and writes are pipelined, so a transfer is not bound by round trips. Otherwise,
+or when compression is asked, files are streamed through an exec channel ("cat"/"tail -c" on the device),
+optionally gzipped on the fly. Several files are transferred at the same time over different channels, and
+a transfer can be resumed from the size of the partial destination file.
+"""
+# std modules
+import Queue
+import os
+import pipes
+import sys
+import threading
+import time
+import zlib
+
+# 3rd party modules
+import paramiko
+
+# platform modules
+import common_utils
+
+
+#
+# Transfer Settings
+#
+BLOCK_SIZE = 32768 # Bytes of each SFTP request, which is the max size most servers accept.
+MAX_REQUESTS = 64 # Outstanding SFTP read requests of one file.
+CHANNELS = 4 # Files transferred at the same time.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class TransferReport(object):
+    """ Throughput report of one transferred file. """
+
+    def __init__(self, direction, localpath, remotepath, mode):
+        self.direction = direction # 'upload' or 'download'
+        self.localpath = localpath
+        self.remotepath = remotepath
+        self.mode = mode # 'sftp', 'exec' or 'exec+gzip'
+        self.size = 0
+        self.start_offset = 0
+        self.transferred_bytes = 0
+        self.wire_bytes = 0 # Bytes sent or received on the channel (compressed size with gzip).
+        self.elapsed = 0
+
+    def mb_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.transferred_bytes / 1024.0 / 1024.0 / self.elapsed
+
+    def to_dict(self):
+        return {
+            'direction': self.direction,
+            'localpath': self.localpath,
+            'remotepath': self.remotepath,
+            'mode': self.mode,
+            'size': self.size,
+            'start_offset': self.start_offset,
+            'transferred_bytes': self.transferred_bytes,
+            'wire_bytes': self.wire_bytes,
+            'elapsed_sec': round(self.elapsed, 3),
+            'mb_per_sec': round(self.mb_per_sec(), 3)
+        }
+
+    def __str__(self):
+        return '{} {} {} {}: {} bytes from offset {} in {:.2f} sec ({:.2f} MB/s, {} bytes on wire, {})'.format(
+            self.direction, self.localpath, '->' if self.direction == 'upload' else '<-', self.remotepath,
+            self.transferred_bytes, self.start_offset, self.elapsed, self.mb_per_sec(), self.wire_bytes, self.mode)
+
+
+@common_utils.logger()
+class SSHTransferEngine(object):
+
+    def __init__(self, get_transport, channels=CHANNELS, block_size=BLOCK_SIZE, max_requests=MAX_REQUESTS,
+            compress=False, timeout=600):
+        """
+        :param get_transport: Function without argument which returns the connected paramiko Transport.
+        :param channels: Number of files transferred at the same time.
+        :param block_size: Bytes of each read/write.
+        :param max_requests: Max outstanding SFTP read requests of one file.
+        :param compress: Default value to gzip data on the fly, device needs "gzip" command.
+        :param timeout: Seconds to wait for data of exec channel.
+        """
+        self.get_transport = get_transport
+        self.channels = channels
+        self.block_size = block_size
+        self.max_requests = max_requests
+        self.compress = compress
+        self.timeout = timeout
+        self.sftp_supported = None # Checked at the first transfer.
+        self._lock = threading.Lock()
+        self.reports = []
+
+    def get_stats(self):
+        """ Return summary of all transfers. """
+        with self._lock:
+            reports = list(self.reports)
+        transferred_bytes = sum(report.transferred_bytes for report in reports)
+        elapsed = sum(report.elapsed for report in reports)
+        return {
+            'files': len(reports),
+            'transferred_bytes': transferred_bytes,
+            'wire_bytes': sum(report.wire_bytes for report in reports),
+            'elapsed_sec': round(elapsed, 3),
+            'mb_per_sec': round(transferred_bytes / 1024.0 / 1024.0 / elapsed, 3) if elapsed else 0.0
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.reports = []
+
+    #
+    # Public Methods
+    #
+    def upload(self, localpath, remotepath, resume=False, compress=None, sftp=None):
+        """ Upload one file and return its TransferReport.
+
+        :param resume: Continue from the size of the existing remote file.
+        :param sftp: SFTPClient to use, ex: a client changed its current directory.
+        """
+        return self._transfer(self._upload, localpath, remotepath, resume, compress, sftp)
+
+    def download(self, remotepath, localpath, resume=False, compress=None, sftp=None):
+        """ Download one file and return its TransferReport.
+
+        :param resume: Continue from the size of the existing local file.
+        """
+        return self._transfer(self._download, remotepath, localpath, resume, compress, sftp)
+
+    def upload_many(self, pairs, resume=False, compress=None):
+        """ Upload list of (localpath, remotepath) in parallel, return TransferReport list in the same order. """
+        return self._run_parallel(self._upload, pairs, resume, compress)
+
+    def download_many(self, pairs, resume=False, compress=None):
+        """ Download list of (remotepath, localpath) in parallel, return TransferReport list in the same order. """
+        return self._run_parallel(self._download, pairs, resume, compress)
+
+    def upload_dir(self, localdir, remotedir, resume=False, compress=None):
+        """ Upload files under localdir into remotedir recursively. """
+        localdir = os.path.abspath(localdir)
+        folders = set([remotedir])
+        pairs = []
+        for root, dirs, files in os.walk(localdir):
+            rel_root = os.path.relpath(root, localdir)
+            remote_root = remotedir if rel_root == '.' else '/'.join([remotedir] + rel_root.split(os.sep))
+            folders.add(remote_root)
+            for file_name in sorted(files):
+                pairs.append((os.path.join(root, file_name), '{}/{}'.format(remote_root, file_name)))
+        self._exec('mkdir -p {}'.format(' '.join(pipes.quote(folder) for folder in sorted(folders))))
+        return self.upload_many(pairs, resume=resume, compress=compress)
+
+    def download_dir(self, remotedir, localdir, resume=False, compress=None):
+        """ Download files under remotedir into localdir recursively. """
+        remotedir = remotedir.rstrip('/')
+        output = self._exec('find {} -type f'.format(pipes.quote(remotedir)))
+        pairs = []
+        for remotepath in output.splitlines():
+            if not remotepath.startswith(remotedir + '/'):
+                continue
+            localpath = os.path.join(localdir, *remotepath[len(remotedir)+1:].split('/'))
+            if not os.path.exists(os.path.dirname(localpath)):
+                os.makedirs(os.path.dirname(localpath))
+            pairs.append((remotepath, localpath))
+        return self.download_many(pairs, resume=resume, compress=compress)
+
+    #
+    # Transfer Flow
+    #
+    def _open_sftp(self):
+        """ Return a new SFTPClient, or None if device doesn't support SFTP. """
+        if self.sftp_supported is False:
+            return None
+        try:
+            sftp = paramiko.SFTPClient.from_transport(self.get_transport())
+        except paramiko.SSHException as e:
+            self.log.warning('SFTP is not supported ({}), transfer files with exec channel'.format(e))
+            self.sftp_supported = False
+            return None
+        self.sftp_supported = True
+        return sftp
+
+    def _transfer(self, func, src, dst, resume, compress, sftp):
+        compress = self.compress if compress is None else compress
+        own_sftp = None
+        if not sftp and not compress:
+            sftp = own_sftp = self._open_sftp()
+        try:
+            return func(src, dst, resume, compress, sftp)
+        finally:
+            if own_sftp: own_sftp.close()
+
+    def _run_parallel(self, func, pairs, resume, compress):
+        compress = self.compress if compress is None else compress
+        task_queue = Queue.Queue()
+        for idx, (src, dst) in enumerate(pairs):
+            task_queue.put((idx, src, dst))
+        results = [None] * len(pairs)
+        errors = []
+
+        def worker():
+            sftp = None
+            try:
+                if not compress: sftp = self._open_sftp()
+                while not errors:
+                    try:
+                        idx, src, dst = task_queue.get_nowait()
+                    except Queue.Empty:
+                        return
+                    results[idx] = func(src, dst, resume, compress, sftp)
+            except:
+                errors.append(sys.exc_info())
+            finally:
+                if sftp: sftp.close()
+
+        start_time = time.time()
+        threads = []
+        for idx in xrange(min(self.channels, len(pairs))):
+            thread = threading.Thread(target=worker, name='SSHTransfer-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            self.log.error('Catch an exception from transfer worker, and re-raise this exception')
+            raise errors[0][0], errors[0][1], errors[0][2]
+        elapsed = time.time() - start_time
+        total_bytes = sum(report.transferred_bytes for report in results)
+        self.log.info('Transferred {} files, {} bytes in {:.2f} sec ({:.2f} MB/s)'.format(
+            len(results), total_bytes, elapsed, total_bytes / 1024.0 / 1024.0 / elapsed if elapsed else 0))
+        return results
+
+    def _finish(self, report, start_time):
+        report.elapsed = time.time() - start_time
+        with self._lock:
+            self.reports.append(report)
+        self.log.info(str(report))
+        return report
+
+    def _upload(self, localpath, remotepath, resume, compress, sftp):
+        start_time = time.time()
+        report = TransferReport('upload', localpath, remotepath,
+            mode='sftp' if sftp else 'exec+gzip' if compress else 'exec')
+        report.size = os.path.getsize(localpath)
+        offset = 0
+        if resume:
+            remote_size = self._remote_size(remotepath, sftp)
+            if remote_size and remote_size <= report.size:
+                offset = remote_size
+        report.start_offset = offset
+        if offset < report.size or not offset:
+            with open(localpath, 'rb') as local_file:
+                local_file.seek(offset)
+                if sftp:
+                    self._sftp_write(sftp, local_file, remotepath, offset, report)
+                else:
+                    self._exec_write(local_file, remotepath, offset, compress, report)
+        remote_size = self._remote_size(remotepath, sftp)
+        if remote_size != report.size:
+            raise IOError('Size of uploaded {} is {}, expected: {}'.format(remotepath, remote_size, report.size))
+        return self._finish(report, start_time)
+
+    def _download(self, remotepath, localpath, resume, compress, sftp):
+        start_time = time.time()
+        report = TransferReport('download', localpath, remotepath,
+            mode='sftp' if sftp else 'exec+gzip' if compress else 'exec')
+        report.size = self._remote_size(remotepath, sftp)
+        if report.size is None:
+            raise IOError('Remote file not found: {}'.format(remotepath))
+        offset = 0
+        if resume and os.path.exists(localpath) and os.path.getsize(localpath) <= report.size:
+            offset = os.path.getsize(localpath)
+        report.start_offset = offset
+        with open(localpath, 'ab' if offset else 'wb') as local_file:
+            if offset < report.size:
+                if sftp:
+                    self._sftp_read(sftp, remotepath, local_file, offset, report)
+                else:
+                    self._exec_read(remotepath, local_file, offset, compress, report)
+        if os.path.getsize(localpath) != report.size:
+            raise IOError('Size of downloaded {} is {}, expected: {}'.format(
+                localpath, os.path.getsize(localpath), report.size))
+        return self._finish(report, start_time)
+
+    def _remote_size(self, remotepath, sftp):
+        """ Return size of remote file, or None if it doesn't exist. """
+        if sftp:
+            try:
+                return sftp.stat(remotepath).st_size
+            except IOError:
+                return None
+        output = self._exec('[ -f {0} ] && wc -c < {0} || true'.format(pipes.quote(remotepath)))
+        return int(output) if output.strip() else None
+
+    #
+    # SFTP
+    #
+    def _sftp_write(self, sftp, local_file, remotepath, offset, report):
+        with sftp.open(remotepath, 'r+b' if offset else 'wb') as remote_file:
+            remote_file.set_pipelined(True) # Don't wait for the status of each write.
+            remote_file.seek(offset)
+            while True:
+                data = local_file.read(self.block_size)
+                if not data:
+                    break
+                remote_file.write(data)
+                report.transferred_bytes += len(data)
+        report.wire_bytes = report.transferred_bytes
+
+    def _sftp_read(self, sftp, remotepath, local_file, offset, report):
+        chunks = [(pos, min(self.block_size, report.size - pos)) for pos in xrange(offset, report.size, self.block_size)]
+        with sftp.open(remotepath, 'rb') as remote_file:
+            # Send requests of a window at once, so there are at most max_requests requests in flight.
+            for idx in xrange(0, len(chunks), self.max_requests):
+                for data in remote_file.readv(chunks[idx:idx+self.max_requests]):
+                    local_file.write(data)
+                    report.transferred_bytes += len(data)
+        report.wire_bytes = report.transferred_bytes
+
+    #
+    # Exec Channel
+    #
+    def _open_channel(self, command):
+        channel = self.get_transport().open_session()
+        channel.settimeout(self.timeout)
+        channel.exec_command(command)
+        return channel
+
+    def _close_channel(self, channel, command):
+        status = channel.recv_exit_status()
+        stderr = channel.makefile_stderr('rb').read()
+        channel.close()
+        if status != 0:
+            raise IOError('Command: {} failed with status {}: {}'.format(command, status, stderr.strip()))
+
+    def _exec(self, command):
+        """ Run command and return its stdout. """
+        channel = self._open_channel(command)
+        stdout = channel.makefile('rb').read()
+        self._close_channel(channel, command)
+        return stdout
+
+    def _exec_write(self, local_file, remotepath, offset, compress, report):
+        command = '{} {} {}'.format('gzip -dc' if compress else 'cat', '>>' if offset else '>', pipes.quote(remotepath))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS) if compress else None
+        channel = self._open_channel(command)
+        while True:
+            data = local_file.read(self.block_size * 8)
+            if not data:
+                break
+            report.transferred_bytes += len(data)
+            if compressor: data = compressor.compress(data)
+            channel.sendall(data)
+            report.wire_bytes += len(data)
+        if compressor:
+            data = compressor.flush()
+            channel.sendall(data)
+            report.wire_bytes += len(data)
+        channel.shutdown_write()
+        self._close_channel(channel, command)
+
+    def _exec_read(self, remotepath, local_file, offset, compress, report):
+        if offset:
+            command = 'tail -c +{} {}'.format(offset + 1, pipes.quote(remotepath))
+        else:
+            command = 'cat {}'.format(pipes.quote(remotepath))
+        if compress:
+            command += ' | gzip -c'
+        decompressor = zlib.decompressobj(GZIP_WBITS) if compress else None
+        channel = self._open_channel(command)
+        while True:
+            data = channel.recv(self.block_size * 8)
+            if not data:
+                break
+            report.wire_bytes += len(data)
+            if decompressor: data = decompressor.decompress(data)
+            local_file.write(data)
+            report.transferred_bytes += len(data)
+        if decompressor:
+            data = decompressor.flush()
+            local_file.write(data)
+            report.transferred_bytes += len(data)
+        self._close_channel(channel, command)
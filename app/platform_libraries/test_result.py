@@ -38,6 +38,8 @@ class ResultList(list):
     TEST_MAX_ELAPSED_SEC = None
     TEST_MIN_ELAPSED_SEC = None
     TEST_LAST_ERR_ELAPSED_SEC = None
+    # ResultSummary of all results, summarize() uses it instead of going through results.
+    summary_index = None
 
 
     def set_common_data(self, **kwargs):
@@ -77,11 +79,18 @@ class ResultList(list):
         self.extend(import_list)
         return self
 
-    def upload_to_logstash(self, server_url=None):
+    def logstash_records(self):
+        """ Return list of dicts to upload to logstash. """
         self._update_data_to_all() # Update common data before uploading.
 
+        records = []
         for test_result in self:
-            test_result.upload_to_logstash(server_url)
+            records.extend(test_result.logstash_records())
+        return records
+
+    def upload_to_logstash(self, server_url=None, session=None):
+        for record in self.logstash_records():
+            upload_to_logstash(record, server_url, session)
         return True
 
     def convert_to_TestSuite(self):
@@ -107,6 +116,8 @@ class ResultList(list):
 
     def summarize(self, print_out=False, print_executed_test=False):
         """ Determine test is pass or failed. """
+        if self.summary_index is not None and self.summary_index.tests == len(self):
+            return self._summarize_by_index(print_out, print_executed_test)
         failed_tests = []
         passed_tests = []
         skipped_tests = []
@@ -163,6 +174,37 @@ class ResultList(list):
 
         return self.TEST_PASS
 
+    def _summarize_by_index(self, print_out=False, print_executed_test=False):
+        summary = self.summary_index
+        self.TEST_AVG_ELAPSED_SEC = summary.avg_passed_time()
+        self.TEST_MAX_ELAPSED_SEC = summary.max_passed_time
+        self.TEST_MIN_ELAPSED_SEC = summary.min_passed_time
+        self.TEST_LAST_ERR_ELAPSED_SEC = summary.last_err_time
+
+        # Print message.
+        if print_out:
+            log.info('-'*75)
+            log.info('Total tests : {}'.format(summary.tests))
+            if print_executed_test:
+                for test in self:
+                    log.info("=> {}".format(getattr(test, 'TEST_NAME', 'Unknown')))
+            log.info('Failed tests: {}'.format(summary.failed))
+            for test_name in summary.failed_tests:
+                log.info("=> {} is FAILED".format(test_name))
+            for test_name in summary.skipped_tests:
+                log.info("=> {} is SKIPPED".format(test_name))
+            log.info('-'*75)
+            log.info('Average Elapsed Time: {}'.format(self.TEST_AVG_ELAPSED_SEC))
+            log.info('Maximum Elapsed Time: {}'.format(self.TEST_MAX_ELAPSED_SEC))
+            log.info('Minimum Elapsed Time: {}'.format(self.TEST_MIN_ELAPSED_SEC))
+            log.info('Last Error Elapsed Time: {}'.format(self.TEST_LAST_ERR_ELAPSED_SEC))
+            log.info('-'*75)
+
+        # Determine result by sub-testcases.
+        if self.TEST_PASS is None:
+            self.TEST_PASS = not summary.failed
+        return self.TEST_PASS
+
 
 class ELKLoopingResult(ResultList):
     """ Looping result for upload to ELK. """
@@ -181,7 +223,7 @@ class ELKLoopingResult(ResultList):
 
         super(ELKLoopingResult, self).__init__(*args)
 
-    def upload_to_logstash(self, server_url=None):
+    def logstash_records(self):
         upload_dict = {
             "testSuite": self.TEST_SUITE,
             "testName" : self.TEST_NAME,
@@ -195,12 +237,12 @@ class ELKLoopingResult(ResultList):
             "test_pass": self.TEST_PASS
         }
         upload_dict.update(self.additional_dict)
-        return upload_to_logstash(upload_dict, server_url)
+        return [upload_dict]
 
 
 class IntegrationLoopingResult(ELKLoopingResult):
 
-    def upload_to_logstash(self, server_url=None):
+    def logstash_records(self):
         upload_dict = {
             "testSuite": self.TEST_SUITE,
             "testName" : self.TEST_NAME,
@@ -215,7 +257,7 @@ class IntegrationLoopingResult(ELKLoopingResult):
             "test_pass": self.TEST_PASS
         }
         upload_dict.update(self.additional_dict)
-        return upload_to_logstash(upload_dict, server_url)
+        return [upload_dict]
 
 
 class IntegrationResult(ELKLoopingResult):
@@ -273,7 +315,7 @@ class IntegrationResult(ELKLoopingResult):
 
         return self.TEST_PASS
 
-    def upload_to_logstash(self, server_url=None):
+    def logstash_records(self):
         upload_dict = {
             "testSuite": self.TEST_SUITE,
             "testName" : self.TEST_NAME,
@@ -283,7 +325,7 @@ class IntegrationResult(ELKLoopingResult):
             "test_pass": self.TEST_PASS
         }
         upload_dict.update(self.additional_dict)
-        return upload_to_logstash(upload_dict, server_url)
+        return [upload_dict]
 
 
 class TestResult(dict):
@@ -325,9 +367,12 @@ class TestResult(dict):
         self.update(import_dict)
         return self
 
-    def upload_to_logstash(self, server_url=None):
+    def logstash_records(self):
         self['test_pass'] = self.TEST_PASS # Update before upload.
-        return upload_to_logstash(self, server_url)
+        return [self]
+
+    def upload_to_logstash(self, server_url=None, session=None):
+        return upload_to_logstash(self.logstash_records()[0], server_url, session)
 
     def convert_to_TestCase(self):
         """ 
@@ -401,10 +446,13 @@ class ELKTestResult(TestResult):
 #
 # Tool Kits Area
 #
-def upload_to_logstash(dict_data, server_url=None):
+def upload_to_logstash(dict_data, server_url=None, session=None):
     """ 
     Upload the given dict data to specified logstash server via HTTP.
 
+    [Arguments]
+        session: requests.Session to send request, or use requests.post() if it's not given.
+
     [Raise]
         Raise TestResultError if data upload failed.
     """
@@ -412,7 +460,7 @@ def upload_to_logstash(dict_data, server_url=None):
         server_url = LOGSTASH_SERVER_TW
 
     headers = {'Content-Type': 'application/json'}
-    response = requests.post(url=server_url, data=json.dumps(dict_data, ensure_ascii=False), headers=headers)
+    response = (session or requests).post(url=server_url, data=json.dumps(dict_data, ensure_ascii=False), headers=headers)
     if response.status_code != 200:
         raise TestResultError('Upload to logstash server {0} failed. Status Code: {1}, Content: {2}'.format(
             server_url, response.status_code, response.content))
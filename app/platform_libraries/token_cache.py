@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+""" Process wide cache of cloud ID tokens shared by RestAPI instances.
+
+Tokens are keyed by (env, username), so RestAPI objects of the same user (even in different threads) share one
+login. Only one thread logs in or refreshes a key at a time, the others wait and take its result. A daemon thread
+refreshes tokens a little before they expire, and tokens can be saved to an encrypted file to skip the cloud login
+when the next test process starts.
+
+Disk cache is enabled by configure(disk_cache_path=..., secret=...) or by environment variables
+KAT_TOKEN_CACHE_FILE and KAT_TOKEN_CACHE_SECRET.
+"""
+# std modules
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+
+# 3rd party modules
+try: # Installed along with paramiko.
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+# platform modules
+import common_utils
+from platform_libraries.pyutils import Singleton
+
+
+#
+# Cache Settings
+#
+DEFAULT_EXPIRED_TIME = 23 * 60 * 60 # Seconds. Auth0 token is expired in 24 hours.
+REFRESH_AHEAD = 5 * 60 # Seconds. Refresh token in background when it will be expired within this time.
+CHECK_INTERVAL = 60 # Seconds. How often the background refresher checks tokens.
+
+
+class TokenEntry(object):
+    """ Tokens of one user. """
+
+    def __init__(self, id_token, access_token=None, refresh_token=None, expired_time=DEFAULT_EXPIRED_TIME,
+            token_time=None):
+        """
+        :param expired_time: Seconds the ID token can be used since token_time.
+        :param token_time: Epoch time when ID token is got.
+        """
+        self.id_token = id_token
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expired_time = expired_time
+        self.token_time = token_time or time.time()
+
+    @classmethod
+    def from_auth_response(cls, response):
+        """ Create entry from the response of /oauth/ro. """
+        expired_time = DEFAULT_EXPIRED_TIME
+        if response.get('expires_in'):
+            expired_time = int(response['expires_in']) - 600 # Minus 600 seconds is for buffer.
+        return cls(id_token=response['id_token'], access_token=response.get('access_token'),
+            refresh_token=response.get('refresh_token'), expired_time=expired_time)
+
+    def time_left(self):
+        return self.token_time + self.expired_time - time.time()
+
+    def is_valid(self):
+        return bool(self.id_token) and self.time_left() > 0
+
+    def to_dict(self):
+        return {
+            'id_token': self.id_token,
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'expired_time': self.expired_time,
+            'token_time': self.token_time
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class WeakMethod(object):
+    """ Reference to a function, or to a bound method without keeping its instance alive (weakref.WeakMethod of
+    python 3). Call it to get the function, which is None if the instance is gone.
+    """
+
+    def __init__(self, func):
+        obj = getattr(func, '__self__', None)
+        if obj is None or not hasattr(func, '__func__'):
+            self.obj_ref = None
+            self.func = func
+        else:
+            self.obj_ref = weakref.ref(obj)
+            self.func = func.__func__
+
+    def __call__(self):
+        if self.obj_ref is None:
+            return self.func
+        obj = self.obj_ref()
+        if obj is None:
+            return None
+        return self.func.__get__(obj, type(obj))
+
+
+@common_utils.logger()
+class TokenCache(object):
+    """ Shared token cache with single-flight login/refresh and background refresh. """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {} # key: lock for login/refresh of the key.
+        self._entries = {} # key: TokenEntry
+        self._refresh_funcs = {} # key: WeakMethod of function to refresh token in background.
+        self._refresher = None
+        self._stop_event = threading.Event()
+        self.proactive_refresh = True
+        self.refresh_ahead = REFRESH_AHEAD
+        self.check_interval = CHECK_INTERVAL
+        self.disk_cache_path = None
+        self._fernet = None
+        self.reset_stats()
+        if os.environ.get('KAT_TOKEN_CACHE_FILE') and os.environ.get('KAT_TOKEN_CACHE_SECRET'):
+            self.configure(disk_cache_path=os.environ['KAT_TOKEN_CACHE_FILE'], secret=os.environ['KAT_TOKEN_CACHE_SECRET'])
+
+    def configure(self, disk_cache_path=None, secret=None, proactive_refresh=None, refresh_ahead=None,
+            check_interval=None):
+        """ Update cache settings.
+
+        :param disk_cache_path: File to save encrypted tokens. Tokens in this file are loaded immediately.
+        :param secret: Pass phrase to encrypt disk cache.
+        """
+        if proactive_refresh is not None: self.proactive_refresh = proactive_refresh
+        if refresh_ahead is not None: self.refresh_ahead = refresh_ahead
+        if check_interval is not None: self.check_interval = check_interval
+        if not disk_cache_path:
+            return
+        if not Fernet:
+            self.log.warning('cryptography is not installed, disk token cache is disabled')
+            return
+        if not secret:
+            self.log.warning('No secret for disk token cache, disk token cache is disabled')
+            return
+        self.disk_cache_path = disk_cache_path
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret).digest()))
+        self._load_disk_cache()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.logins = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+        self.disk_loads = 0
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'logins': self.logins,
+            'refreshes': self.refreshes,
+            'background_refreshes': self.background_refreshes,
+            'refresh_failures': self.refresh_failures,
+            'disk_loads': self.disk_loads,
+            'cached_users': len(self._entries)
+        }
+
+    def _incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def get_entry(self, key):
+        return self._entries.get(key)
+
+    def get_token(self, key, login_func, refresh_func=None):
+        """ Return a valid TokenEntry of key. Login or refresh token if it is needed.
+
+        :param key: (env, username)
+        :param login_func: Function without argument which returns the response of /oauth/ro in dict.
+        :param refresh_func: Function with refresh token as argument which returns the response of /delegation in dict.
+        """
+        if refresh_func: self._refresh_funcs[key] = WeakMethod(refresh_func)
+        entry = self._entries.get(key)
+        if entry and entry.is_valid():
+            self._incr('hits')
+            return entry
+        with self._get_key_lock(key):
+            entry = self._entries.get(key)
+            if entry and entry.is_valid(): # Done by other thread.
+                self._incr('hits')
+                return entry
+            if entry and entry.refresh_token and refresh_func:
+                try:
+                    return self._refresh(key, entry, refresh_func)
+                except Exception as e:
+                    self._incr('refresh_failures')
+                    self.log.warning('Refresh token of {} failed: {}, login again'.format(key, e))
+            return self._login(key, login_func)
+
+    def refresh(self, key, refresh_func, stale_id_token=None):
+        """ Refresh token of key. Return the cached entry without refreshing if it is already replaced
+        by other thread since stale_id_token.
+        """
+        self._refresh_funcs[key] = WeakMethod(refresh_func)
+        with self._get_key_lock(key):
+            entry = self._entries.get(key)
+            if not entry or not entry.refresh_token:
+                raise RuntimeError('No refresh token of {} in cache'.format(key))
+            if stale_id_token and entry.id_token != stale_id_token and entry.is_valid():
+                self._incr('hits')
+                return entry
+            return self._refresh(key, entry, refresh_func)
+
+    def set_token(self, key, entry):
+        with self._get_key_lock(key):
+            self._entries[key] = entry
+            self._save_disk_cache()
+
+    def invalidate(self, key, id_token=None):
+        """ Drop token of key, only if it is still id_token when id_token is given. """
+        with self._get_key_lock(key):
+            entry = self._entries.get(key)
+            if entry and (not id_token or entry.id_token == id_token):
+                del self._entries[key]
+                self._save_disk_cache()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refresh_funcs.clear()
+
+    def _login(self, key, login_func):
+        entry = TokenEntry.from_auth_response(login_func())
+        self._incr('logins')
+        self._entries[key] = entry
+        self._save_disk_cache()
+        self._start_refresher()
+        return entry
+
+    def _refresh(self, key, entry, refresh_func):
+        response = refresh_func(entry.refresh_token)
+        new_entry = TokenEntry(id_token=response['id_token'], access_token=entry.access_token,
+            refresh_token=response.get('refresh_token') or entry.refresh_token, expired_time=entry.expired_time)
+        self._incr('refreshes')
+        self._entries[key] = new_entry
+        self._save_disk_cache()
+        self._start_refresher()
+        return new_entry
+
+    #
+    # Background Refresh
+    #
+    def _start_refresher(self):
+        if not self.proactive_refresh:
+            return
+        with self._lock:
+            if self._refresher and self._refresher.is_alive():
+                return
+            self._stop_event.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name='TokenRefresher')
+            self._refresher.daemon = True
+            self._refresher.start()
+
+    def stop_refresher(self):
+        self._stop_event.set()
+
+    def _get_refresh_func(self, key):
+        """ Return refresh function of key, or None if there is none or its RestAPI object is gone. """
+        func_ref = self._refresh_funcs.get(key)
+        refresh_func = func_ref() if func_ref else None
+        if func_ref and not refresh_func:
+            with self._lock:
+                if self._refresh_funcs.get(key) is func_ref: del self._refresh_funcs[key]
+        return refresh_func
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.check_interval):
+            for key, entry in self._entries.items():
+                if entry.time_left() > self.refresh_ahead or not entry.refresh_token:
+                    continue
+                refresh_func = self._get_refresh_func(key)
+                if not refresh_func:
+                    continue
+                key_lock = self._get_key_lock(key)
+                if not key_lock.acquire(False): # Other thread is working on it.
+                    continue
+                try:
+                    if self._entries.get(key) is not entry:
+                        continue
+                    self._refresh(key, entry, refresh_func)
+                    self._incr('background_refreshes')
+                    self.log.debug('Refreshed token of {} in background'.format(key))
+                except Exception as e:
+                    self._incr('refresh_failures')
+                    self.log.warning('Refresh token of {} in background failed: {}'.format(key, e))
+                finally:
+                    key_lock.release()
+
+    #
+    # Disk Cache
+    #
+    @staticmethod
+    def _key_to_str(key):
+        return '|'.join(str(k) for k in key)
+
+    def _load_disk_cache(self):
+        if not os.path.exists(self.disk_cache_path):
+            return
+        try:
+            with open(self.disk_cache_path, 'rb') as f:
+                data = json.loads(self._fernet.decrypt(f.read()))
+        except (IOError, ValueError, InvalidToken) as e:
+            self.log.warning('Ignore disk token cache {}: {}'.format(self.disk_cache_path, repr(e)))
+            return
+        with self._lock:
+            for str_key, entry_data in data.iteritems():
+                key = tuple(None if k == 'None' else k for k in str_key.split('|', 1))
+                if key not in self._entries:
+                    self._entries[key] = TokenEntry.from_dict(entry_data)
+                    self.disk_loads += 1
+        self.log.debug('Loaded {} tokens from {}'.format(len(data), self.disk_cache_path))
+
+    def _save_disk_cache(self):
+        if not self._fernet:
+            return
+        with self._lock:
+            data = {self._key_to_str(key): entry.to_dict() for key, entry in self._entries.items()}
+        tmp_path = '{}.{}.tmp'.format(self.disk_cache_path, threading.current_thread().ident)
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._fernet.encrypt(json.dumps(data)))
+            os.rename(tmp_path, self.disk_cache_path)
+        except (IOError, OSError) as e:
+            self.log.warning('Failed to save disk token cache {}: {}'.format(self.disk_cache_path, repr(e)))
+
+
+def get_token_cache():
+    return TokenCache()
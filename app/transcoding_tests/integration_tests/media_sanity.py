@@ -303,7 +303,10 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         if self.local_data_path: # On local.
             stdout, stderr = self.adb.executeCommand("find . -name '{}' -type f".format(test_info['rest_info']['name']))
         else: # In USB.
-            stdout, stderr = self.adb.executeShellCommand("find {} -name '{}' -type f".format(Kamino.MOUNT_PATH, test_info['rest_info']['name']))
+            # List USB files once for all sub-tests instead of running "find" for each file.
+            if not getattr(self, 'usb_files', None):
+                self.usb_files = self.adb.hasher.list_files([Kamino.MOUNT_PATH])
+            stdout = '\n'.join(path for path in self.usb_files if path.split('/')[-1] == test_info['rest_info']['name'])
         if not stdout:
             raise self.err.TestFailure('Source file: {} not found.'.format(test_info['rest_info']['name']))
         files = stdout.splitlines()
@@ -311,8 +314,11 @@ class MediaSanityTest(RESTSDKTranscoding, GetVideoPlaylistTest):
         if self.local_data_path: # On local.
             source_md5 = local_md5sum(files[0])
         else: # In USB.
-            stdout, stderr = self.adb.executeShellCommand("md5sum '{}'".format(files[0]))
-            source_md5 = stdout.split()[0]
+            # Cached digest is reused if the source file is not changed.
+            record = self.adb.hasher.hash_files([files[0]], algorithm='md5').get(files[0])
+            if not record: # Removed after listed.
+                raise self.err.TestFailure('Failed to get MD5 of source file: {}, it may be removed.'.format(files[0]))
+            source_md5 = record.digest
         self.log.info('MD5 of source file: {}'.format(source_md5))
 
         if remote_md5 != source_md5:
@@ -4,8 +4,14 @@
 __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 
 # std modules
+import errno
 import json
+import multiprocessing
+import os
+import sqlite3
 import subprocess
+import threading
+import time
 # platform modules
 from transcoding_settings import API_TRANSCODING_SETTINGS
 
@@ -96,6 +102,8 @@ def string2thousandths_float(value):
 #
 # Converter Area
 #
+FFPROBE_CMD = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams']
+
 class Converter(object):
     def __init__(self, src, logging):
         self.src = src
@@ -302,19 +310,221 @@ class FFmpegInfoConverter(Converter):
 class VideoConverter(FFmpegInfoConverter):
     """ Video file -> Information object
     """
-    def __init__(self, path, logging):
+    def __init__(self, path, logging, cache=None):
+        """
+        :param cache: ProbeCache object to reuse the ffprobe output of the same file.
+        """
         self.path = path
         self.log = logging
-        self.src = self.extract_video_with_ffprobe(path)
+        if cache:
+            self.src = cache.probe(path)
+        else:
+            self.src = self.extract_video_with_ffprobe(path)
 
     def extract_video_with_ffprobe(self, path):
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams' , path
-            ]
+            cmd = FFPROBE_CMD + [path]
             self.log.debug('Executing cmd: {}'.format(cmd))
             raw_output = subprocess.check_output(cmd)
         except subprocess.CalledProcessError as e:
             self.log.error('Parsing video failed: {}'.format(e))
             raise
         return json.loads(raw_output)
+
+
+class StreamVideoConverter(VideoConverter):
+    """ Video stream (iterable of data chunks) -> Information object
+
+    Chunks are piped into ffprobe over stdin as they arrive, so the video is never saved to disk. All chunks
+    are consumed even if ffprobe stops reading after probing, so on_chunk sees the whole stream.
+    """
+    def __init__(self, chunks, logging, on_chunk=None):
+        """
+        :param on_chunk: Function called with each chunk, e.g. to hash it or keep it for tracing.
+        """
+        self.path = 'pipe:0'
+        self.log = logging
+        self.size = 0
+        self.src = self.extract_stream_with_ffprobe(chunks, on_chunk)
+
+    def extract_stream_with_ffprobe(self, chunks, on_chunk=None):
+        cmd = FFPROBE_CMD + [self.path]
+        self.log.debug('Executing cmd: {}'.format(cmd))
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        output = []
+        # Read output in another thread, or ffprobe may block on a full stdout pipe while we block on stdin.
+        reader = threading.Thread(target=lambda: output.append(process.stdout.read()))
+        reader.daemon = True
+        reader.start()
+        stdin_open = True
+        try:
+            for chunk in chunks:
+                self.size += len(chunk)
+                if on_chunk: on_chunk(chunk)
+                if not stdin_open:
+                    continue
+                try:
+                    process.stdin.write(chunk)
+                except IOError as e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    stdin_open = False # ffprobe has got enough data.
+        finally:
+            try:
+                process.stdin.close()
+            except IOError:
+                pass
+            reader.join()
+            process.wait()
+        if process.returncode:
+            e = subprocess.CalledProcessError(process.returncode, cmd, output[0] if output else '')
+            self.log.error('Parsing video failed: {}'.format(e))
+            raise e
+        return json.loads(output[0])
+
+
+#
+# FFprobe Cache Area
+#
+def run_ffprobe(path):
+    """ Return (path, raw output, error message) of ffprobe, run in worker processes of batch probe. """
+    try:
+        return path, subprocess.check_output(FFPROBE_CMD + [path]), None
+    except Exception as e:
+        return path, None, repr(e)
+
+
+class ProbeCache(object):
+    """ Persistent cache of ffprobe output of source videos in SQLite.
+
+    Records are keyed by path, size and mtime, so a changed file is probed again. Only use it for the source
+    dataset, output of device (e.g. transcoded videos) should always be probed since it's what the tests verify.
+    Cached output can be converted by the converters as usual:
+
+        cache = ProbeCache('probe_cache.db', logging=log)
+        cache.probe_many(paths, processes=8)
+        info = VideoConverter(path, logging=log, cache=cache).convert()
+    """
+
+    def __init__(self, db_file, logging, timeout=60*5):
+        self.db_file = db_file
+        self.log = logging
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout, check_same_thread=False)
+        self.conn.text_factory = str
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS probe (
+                    key TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime REAL, probed_at REAL, output TEXT
+                );
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS probe_path ON probe(path);")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def get_key(self, path, stat=None):
+        stat = stat or os.stat(path)
+        return 'stat:{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+    def _get(self, key, raw=False):
+        with self._lock:
+            row = self.conn.execute("SELECT output FROM probe WHERE key = ?;", (key,)).fetchone()
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0] if raw else json.loads(row[0])
+
+    def _put(self, key, path, stat, raw_output):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?);",
+                (key, os.path.abspath(path), stat.st_size, stat.st_mtime, time.time(), raw_output))
+
+    def get(self, path):
+        """ Return cached ffprobe output (dict) of path, or None if it's not cached. """
+        return self._get(self.get_key(path))
+
+    def put(self, path, raw_output):
+        """ Save ffprobe output (JSON string) of path. """
+        stat = os.stat(path)
+        self._put(self.get_key(path, stat), path, stat, raw_output)
+
+    def probe(self, path):
+        """ Return ffprobe output (dict) of path, run ffprobe only if it's not cached. """
+        stat = os.stat(path) # Stat before probe, so the record is stale if file is changed during probing.
+        key = self.get_key(path, stat)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        _, raw_output, error = run_ffprobe(path)
+        if error:
+            self.log.error('Parsing video failed: {}'.format(error))
+            raise RuntimeError('ffprobe {} failed: {}'.format(path, error))
+        self._put(key, path, stat, raw_output)
+        return json.loads(raw_output)
+
+    def probe_many(self, paths, processes=None, raw=False):
+        """ Probe files which are not cached in parallel processes, return {path: ffprobe output (dict)}.
+        Files failed to probe are logged and not in the result.
+
+        :param processes: Number of ffprobe processes, CPU count by default.
+        :param raw: Return ffprobe output in JSON string instead of dict.
+        """
+        results = {}
+        to_probe = {} # path: (key, stat)
+        for path in paths:
+            stat = os.stat(path)
+            key = self.get_key(path, stat)
+            cached = self._get(key, raw)
+            if cached is None:
+                to_probe[path] = (key, stat)
+            else:
+                results[path] = cached
+        if not to_probe:
+            return results
+        processes = min(processes or multiprocessing.cpu_count(), len(to_probe))
+        self.log.info('Probe {} files with {} processes ({} cached)'.format(len(to_probe), processes, len(results)))
+        pool = multiprocessing.Pool(processes)
+        try:
+            for path, raw_output, error in pool.imap_unordered(run_ffprobe, to_probe.keys()):
+                if error:
+                    self.log.warning('Parsing video {} failed: {}'.format(path, error))
+                    continue
+                key, stat = to_probe[path]
+                self._put(key, path, stat, raw_output)
+                results[path] = raw_output if raw else json.loads(raw_output)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def get_information(self, path):
+        """ Return Information object of path for comparators. """
+        return VideoConverter(path, logging=self.log, cache=self).convert()
+
+    def invalidate(self, path=None):
+        """ Remove records of path (all records of the path no matter its size and mtime), or all records if path
+        is None. Return number of removed records.
+        """
+        with self._lock, self.conn:
+            if path is None:
+                cur = self.conn.execute("DELETE FROM probe;")
+            else:
+                cur = self.conn.execute("DELETE FROM probe WHERE path = ?;", (os.path.abspath(path),))
+            return cur.rowcount
+
+    def invalidate_older_than(self, seconds):
+        """ Remove records probed more than seconds ago, e.g. after ffprobe is upgraded. """
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM probe WHERE probed_at < ?;", (time.time() - seconds,)).rowcount
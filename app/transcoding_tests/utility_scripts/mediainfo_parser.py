@@ -5,6 +5,8 @@ __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 
 # std modules
 import csv
+import logging
+import multiprocessing
 import os
 import sqlite3
 import subprocess
@@ -12,40 +14,52 @@ from argparse import ArgumentParser
 from pprint import pprint
 
 
-def scan_and_parse(scan_path, output_csv, path_skip_level):
-    with open(output_csv, 'a') as csvfile: # Open CSV file
-        writer = csv.DictWriter(csvfile, fieldnames=['filename', 'path', 'mediainfo'])
-        writer.writeheader()
+def probe(path):
+    """ Return (path, ffprobe output), output is None if parsing failed. Run in worker processes. """
+    # Parse it by mediainfo.
+    #raw_output = subprocess.check_output(['mediainfo', '--fullscan', path])
+    # Parse it by ffprobe.
+    try:
+        return path, subprocess.check_output([
+            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams' , path
+        ])
+    except subprocess.CalledProcessError:
+        return path, None
 
-        # Scan all file
-        for dir_path, dir_names, file_names in os.walk(scan_path):
-            for file_name in file_names:
+
+def scan_and_parse(scan_path, output_csv, path_skip_level, processes=1, probe_cache_path=None):
+    """
+    :param probe_cache_path: SQLite file of ProbeCache, only new or changed files are probed if it's given.
+    """
+    # Scan all file
+    paths = [os.path.join(dir_path, file_name)
+        for dir_path, dir_names, file_names in os.walk(scan_path) for file_name in file_names]
+    pool = multiprocessing.Pool(processes) if processes > 1 and not probe_cache_path else None
+    try:
+        # Files are probed in parallel processes and written in the scan order.
+        if probe_cache_path:
+            from transcoding_tests.lib.converter import ProbeCache
+            with ProbeCache(probe_cache_path, logging=logging.getLogger('mediainfo_parser')) as cache:
+                outputs = cache.probe_many(paths, processes=processes, raw=True)
+            results = ((path, outputs.get(path)) for path in paths)
+        else:
+            results = pool.imap(probe, paths) if pool else (probe(path) for path in paths)
+        with open(output_csv, 'a') as csvfile: # Open CSV file
+            writer = csv.DictWriter(csvfile, fieldnames=['filename', 'path', 'mediainfo'])
+            writer.writeheader()
+            for path, raw_output in results:
                 # Init record
                 record = {
-                    'filename': file_name, 'path': None, 'mediainfo': None
+                    'filename': os.path.basename(path), 'path': None, 'mediainfo': None
                 }
                 try:
                     print '-'*30
-                    record_path = path = os.path.join(dir_path, file_name)
+                    record_path = path
                     if path_skip_level:
                         record_path = os.path.join(*path.split(os.sep)[path_skip_level+1:])
                     print 'Processing :{}'.format(path)
                     record['path'] = record_path
-
-                    '''
-                    # Parse it by mediainfo.
-                    try:
-                        raw_output = subprocess.check_output(['mediainfo', '--fullscan', path])
-                    except subprocess.CalledProcessError:
-                        print 'Parsing failed!'
-                        continue
-                    '''
-                    # Parse it by ffprobe.
-                    try:
-                        raw_output = subprocess.check_output([
-                            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams' , path
-                        ])
-                    except subprocess.CalledProcessError:
+                    if raw_output is None:
                         print 'Parsing failed!'
                         continue
                     #print raw_output
@@ -55,6 +69,10 @@ def scan_and_parse(scan_path, output_csv, path_skip_level):
                         writer.writerow(record)
                     except Exception, e:
                         print 'Write data failed: {}'.format(e)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
 
 def export_to_sqlite(input_csv, output_sqlite):
@@ -76,6 +94,10 @@ if __name__ == '__main__':
     parser.add_argument('-skip', '--path_skip_level', help='Level number to skip recrod path', type=int, default=0)
     parser.add_argument('-csv', '--output_csv', help='CSV file path to save', default='output.csv')
     parser.add_argument('-sqlite', '--output_sqlite', help='SQLite file path to save', default='mediainfo_db')
+    parser.add_argument('-p', '--processes', help='Number of ffprobe processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('-pcp', '--probe_cache_path', help='SQLite file to cache ffprobe results across runs', metavar='PATH')
     args = parser.parse_args()
-    scan_and_parse(scan_path=args.scan_path, output_csv=args.output_csv, path_skip_level=args.path_skip_level)
+    logging.basicConfig(level=logging.INFO)
+    scan_and_parse(scan_path=args.scan_path, output_csv=args.output_csv, path_skip_level=args.path_skip_level,
+        processes=args.processes, probe_cache_path=args.probe_cache_path)
     export_to_sqlite(input_csv=args.output_csv, output_sqlite=args.output_sqlite)
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 """ Simple tool to list all device.
+
+Ports are probed one by one by default, or concurrently with "--workers N". Each port has a deadline
+("--port-timeout") for all the probes, and the last known device info of each port can be cached with
+"--cache-file" and "--cache-ttl", so ports probed recently are not accessed again. Use "--json" to print
+the result in JSON for inventory scripts.
 """
 __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 
@@ -7,21 +12,99 @@ __author__ = "Estvan Huang <Estvan.Huang@wdc.com>"
 import argparse
 import json
 import os
+import Queue
 import sys
 import telnetlib
+import threading
 import time
 import re
 
+
+OUTPUT = sys.stdout # Stream of messages, messages are printed to stderr if JSON is printed to stdout.
+SHOW_PROGRESS = True # Progress messages are disabled when ports are probed concurrently.
+print_lock = threading.Lock()
+
+
+class ProbeTimeout(Exception):
+    pass
+
+
+class DeadlineTelnet(telnetlib.Telnet):
+    """ Telnet which stops reading at the deadline of the port. """
+
+    def __init__(self, host, port, deadline=None, connect_timeout=10):
+        self.deadline = deadline
+        telnetlib.Telnet.__init__(self, host, port, timeout=self.get_timeout(connect_timeout))
+
+    def get_timeout(self, timeout):
+        if not self.deadline:
+            return timeout
+        left = self.deadline - time.time()
+        if left <= 0:
+            raise ProbeTimeout('Port deadline exceeded')
+        return left if timeout is None else min(timeout, left)
+
+    def read_until(self, match, timeout=None):
+        return telnetlib.Telnet.read_until(self, match, self.get_timeout(timeout))
+
+
+class DeviceCache(object):
+    """ Last known device info of each port with TTL, saved in JSON file. """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.records = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as fp:
+                    self.records = json.load(fp)
+            except ValueError:
+                pass
+
+    def key(self, server_ip, port):
+        return '{}:{}'.format(server_ip, port)
+
+    def get(self, server_ip, port):
+        """ Return (port, platform, ip, mac) if the record is not expired. """
+        record = self.records.get(self.key(server_ip, port))
+        if not record or time.time() - record['time'] > self.ttl:
+            return None
+        return port, record['platform'], record['ip'], record['mac']
+
+    def set(self, server_ip, port, platform, ip, mac):
+        with self.lock:
+            self.records[self.key(server_ip, port)] = {'platform': platform, 'ip': ip, 'mac': mac, 'time': time.time()}
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            with open(self.path, 'w') as fp:
+                json.dump(self.records, fp, indent=2, sort_keys=True)
+
+
 def print_without_new_line(msg):
-    print '\r'+' '*90+'\r',
-    sys.stdout.flush()
-    print msg,
-    sys.stdout.flush()
+    if not SHOW_PROGRESS:
+        return
+    print_result(msg)
+
+def print_result(msg):
+    with print_lock:
+        if SHOW_PROGRESS:
+            print >> OUTPUT, '\r'+' '*90+'\r',
+        else: # Print result line by line.
+            msg = msg.strip('\r')
+        OUTPUT.flush()
+        print >> OUTPUT, msg,
+        OUTPUT.flush()
 
-def show_device_info(server_ip, port, console_password=None):
+def show_device_info(server_ip, port, console_password=None, deadline=None):
+    tn = None
     try:
         print_without_new_line('Port {0}: connecting...'.format(port))
-        tn = telnetlib.Telnet(server_ip, port)
+        tn = DeadlineTelnet(server_ip, port, deadline=deadline)
         print_without_new_line('\rPort {0}: accessing device...'.format(port))
         mtype = guess_model_by_PS(tn, console_password)
         if mtype == 0:
@@ -45,13 +128,57 @@ def show_device_info(server_ip, port, console_password=None):
             ip = 'Unknown'
             mac = 'Unknown'
         tn.close()
-        print_without_new_line('\rPort {0} => {1}: {2} ({3})\n'.format(port, platform, ip, mac))
+        print_result('\rPort {0} => {1}: {2} ({3})\n'.format(port, platform, ip, mac))
         return port, platform, ip, mac.upper()
+    except ProbeTimeout:
+        print_result('\rPort {0}: no response before deadline.\n'.format(port))
+        return None
     except:
         #import traceback
         #print traceback.format_exc()
-        print_without_new_line('\rPort {0}: might occupied by someone.\n'.format(port))
+        print_result('\rPort {0}: might occupied by someone.\n'.format(port))
         return None
+    finally:
+        if tn: tn.close()
+
+def probe_devices(server_ip, ports, console_password=None, workers=1, port_timeout=None, cache=None):
+    """ Probe ports with a pool of workers, return {port: (port, platform, ip, mac) or None}.
+
+    :param port_timeout: Seconds for all probes of one port, counting from the port is started.
+    :param cache: DeviceCache to skip ports probed recently.
+    """
+    results = {}
+    port_queue = Queue.Queue()
+    for port in ports:
+        cached = cache.get(server_ip, port) if cache else None
+        if cached:
+            print_result('\rPort {0} => {1}: {2} ({3}) [cached]\n'.format(*cached))
+            results[port] = cached
+        else:
+            port_queue.put(port)
+
+    def worker():
+        while True:
+            try:
+                port = port_queue.get_nowait()
+            except Queue.Empty:
+                return
+            deadline = time.time() + port_timeout if port_timeout else None
+            ret = show_device_info(server_ip, port=port, console_password=console_password, deadline=deadline)
+            results[port] = ret
+            if ret and cache and ret[1] != 'Unknown':
+                cache.set(server_ip, *ret)
+
+    threads = [threading.Thread(target=worker) for _ in xrange(max(1, min(workers, port_queue.qsize())))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive(): # join() with timeout, so KeyboardInterrupt works.
+            thread.join(1)
+    if cache:
+        cache.save()
+    return results
 
 def read_until(tn, re_pattern=None, timeout=10, raise_error=True, ignore_ps_line=False):
     start_time = time.time()
@@ -222,30 +349,34 @@ def read_portfile(path):
     return usb_ports
 
 def get_all_devices_from_serial_server(
-        server_ip, start_port=0, portfile=None, scan_with_ttyUSB=False, total_device=0, console_password='adminadmin'):
+        server_ip, start_port=0, portfile=None, scan_with_ttyUSB=False, total_device=0, console_password='adminadmin',
+        workers=1, port_timeout=None, cache_file=None, cache_ttl=0):
     if total_device:
         usb_ports = xrange(total_device)
     elif scan_with_ttyUSB: # Get all ttyUSB
         usb_ports = scan_ttyUSB()
     else: # Get all records.
         if not os.path.exists(portfile):
-            print 'Portfile', portfile, 'does not exist.'
+            print >> OUTPUT, 'Portfile', portfile, 'does not exist.'
             sys.exit(1)
         usb_ports = read_portfile(portfile)
         # Records have already added start port number.
         start_port = 0
 
-    print 'Total devices:', len(usb_ports)
+    print >> OUTPUT, 'Total devices:', len(usb_ports)
+
+    global SHOW_PROGRESS
+    if workers > 1:
+        SHOW_PROGRESS = False
 
     devices = {}
-    # Get device IP one by one.
-    for port in usb_ports:
-        connect_port = port + start_port
-        ret = show_device_info(server_ip, port=connect_port, console_password=console_password)
-        if ret:
-            devices[ret[3]] = {'ip': ret[2], 'port': ret[0], 'platform': ret[1]}
+    cache = DeviceCache(cache_file, cache_ttl) if cache_file and cache_ttl else None
+    results = probe_devices(server_ip, [port + start_port for port in usb_ports], console_password=console_password,
+        workers=workers, port_timeout=port_timeout, cache=cache)
+    for ret in sorted(filter(None, results.values())):
+        devices[ret[3]] = {'ip': ret[2], 'port': ret[0], 'platform': ret[1]}
 
-    return devices 
+    return devices
 
 
 if __name__ == '__main__':
@@ -257,6 +388,11 @@ if __name__ == '__main__':
     parser.add_argument('-swtty', '--scan-with-ttyUSB', help='List all device with scan local ttyUSB notes', action='store_true', default=False)
     parser.add_argument('-td', '--total-device', help='Total device on server for remote access (not need port file)', type=int, default=0)
     parser.add_argument('-cp', '--console-password', help='Password for console', default='adminadmin')
+    parser.add_argument('-w', '--workers', help='Number of ports probed concurrently', type=int, default=1)
+    parser.add_argument('-pt', '--port-timeout', help='Seconds for probing one port', type=int, default=120)
+    parser.add_argument('-cf', '--cache-file', help='JSON file to cache device info of each port', default=None)
+    parser.add_argument('-ct', '--cache-ttl', help='Seconds to use cached device info', type=int, default=600)
+    parser.add_argument('-j', '--json', help='Print result in JSON to stdout, messages are printed to stderr', action='store_true', default=False)
 
     args = parser.parse_args()
     start_port = args.start_port
@@ -265,6 +401,11 @@ if __name__ == '__main__':
     scan_with_ttyUSB = args.scan_with_ttyUSB
     total_device = args.total_device
     console_password = args.console_password
+    if args.json:
+        OUTPUT = sys.stderr
 
-    devices = get_all_devices_from_serial_server(server_ip, start_port, portfile, scan_with_ttyUSB, total_device, console_password)
-    print 'done.'
+    devices = get_all_devices_from_serial_server(server_ip, start_port, portfile, scan_with_ttyUSB, total_device, console_password,
+        workers=args.workers, port_timeout=args.port_timeout, cache_file=args.cache_file, cache_ttl=args.cache_ttl)
+    if args.json:
+        print json.dumps(devices, indent=2, sort_keys=True)
+    print >> OUTPUT, 'done.'
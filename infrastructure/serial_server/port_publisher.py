@@ -11,11 +11,19 @@ Multi-port serial<->TCP/IP forwarder.
 - each forwarder creates a server socket and opens the serial port
 - serial ports are opened only once. network connect/disconnect
   does not influence serial port
-- only one client per connection
+- only one client per connection by default, or fan-out serial output to
+  several clients (--max-clients)
 
 20171103 (Estvan Huang):
 - Added port history to fix port number for each USB slots.
+
+- epoll event loop with batched reads and per-client write buffers with
+  backpressure.
+- Ring log of recent serial output on disk (--ring-log-dir), which can be
+  replayed by connecting to telnet port + --replay-port-offset.
 """
+import collections
+import fcntl
 import json
 import os
 import select
@@ -35,6 +43,15 @@ import dbus
 from servercli import run_server
 
 DEFAULT_BAUD_RATE = 115200
+# read everything available up to this size in one call
+READ_SIZE = 65536
+# stop reading from clients if data to serial port is more than this size
+NET2SER_HIGH_WATER = 2048
+# serial port is always read (tty buffer overflows and ring log stops otherwise),
+# a client drops the oldest data if its buffer is more than high water
+SER2NET_HIGH_WATER = 256 * 1024
+# disconnect a client which dropped this size of data without sending anything
+SER2NET_MAX_DROP = 4 * 1024 * 1024
 
 
 # Try to import the avahi service definitions properly. If the avahi module is
@@ -100,30 +117,255 @@ class ZeroconfService:
         return "{!r} @ {}:{} ({})".format(self.name, self.host, self.port, self.stype)
 
 
-class Forwarder(ZeroconfService):
+class EventLoop(object):
+    """\
+    epoll (or poll if epoll is not available) loop which calls handlers by
+    events of registered files. Interest of each file is updated only when it
+    is changed, instead of building select maps in every loop.
+    """
+
+    def __init__(self):
+        self.poller = select.epoll() if hasattr(select, 'epoll') else select.poll()
+        self.handlers = {}  # fd: (read handler, write handler, error handler)
+        self.masks = {}  # fd: event mask
+        self.callbacks = collections.deque()  # callbacks from other threads
+        # pipe to wake up the loop for callbacks
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.register(self.wakeup_r, on_read=self.handle_wakeup)
+
+    @staticmethod
+    def _mask(read, write):
+        return (select.POLLIN if read else 0) | (select.POLLOUT if write else 0) | select.POLLERR | select.POLLHUP
+
+    def register(self, fileobj, on_read=None, on_write=None, on_error=None, read=True, write=False):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        self.handlers[fd] = (on_read, on_write, on_error)
+        self.masks[fd] = self._mask(read, write)
+        self.poller.register(fd, self.masks[fd])
+        return fd
+
+    def modify(self, fd, read, write):
+        """Update interest of fd, do nothing if it's not changed"""
+        mask = self._mask(read, write)
+        if fd in self.masks and self.masks[fd] != mask:
+            self.masks[fd] = mask
+            self.poller.modify(fd, mask)
+
+    def unregister(self, fd):
+        if self.handlers.pop(fd, None) is not None:
+            self.masks.pop(fd, None)
+            try:
+                self.poller.unregister(fd)
+            except (IOError, OSError, KeyError, ValueError):
+                pass  # already closed
+
+    def call_soon(self, callback):
+        """Run callback in the loop thread, it's safe to call from other threads"""
+        self.callbacks.append(callback)
+        try:
+            os.write(self.wakeup_w, b'x')
+        except OSError:
+            pass  # pipe is full, the loop will wake up anyway
+
+    def handle_wakeup(self):
+        try:
+            os.read(self.wakeup_r, 4096)
+        except OSError:
+            pass
+
+    def run_once(self, timeout):
+        # epoll takes seconds but poll takes milliseconds
+        events = self.poller.poll(timeout if hasattr(select, 'epoll') else timeout * 1000)
+        for fd, event in events:
+            # look up handlers every time since the previous handlers may unregister them
+            if event & (select.POLLERR | select.POLLHUP) and not event & select.POLLIN:
+                handlers = self.handlers.get(fd)
+                if handlers and handlers[2]:
+                    handlers[2]()
+                continue
+            if event & (select.POLLIN | select.POLLHUP):
+                handlers = self.handlers.get(fd)
+                if handlers and handlers[0]:
+                    handlers[0]()
+            if event & select.POLLOUT:
+                handlers = self.handlers.get(fd)
+                if handlers and handlers[1]:
+                    handlers[1]()
+        while self.callbacks:
+            callback = self.callbacks.popleft()
+            try:
+                callback()
+            except Exception:
+                traceback.print_exc()
+
+
+class RingLog(object):
+    """\
+    On-disk log of recent output of a serial port. Data is appended to the
+    file, which is rotated to "<path>.1" when it reaches half of max size, so
+    the last max_size/2 to max_size bytes are kept on disk for replay.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.fd = None
+        self.size = 0
+
+    def open(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self.size = os.fstat(self.fd).st_size
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, data):
+        if self.fd is None:
+            return
+        data = data[-(self.max_size // 2):]
+        if self.size + len(data) > self.max_size // 2:
+            self.close()
+            os.rename(self.path, self.path + '.1')
+            self.open()
+        os.write(self.fd, data)
+        self.size += len(data)
+
+    def read(self):
+        """Return recent data in the log"""
+        data = []
+        for path in (self.path + '.1', self.path):
+            try:
+                with open(path, 'rb') as f:
+                    data.append(f.read())
+            except IOError:
+                pass
+        return b''.join(data)
+
+
+class ReplayConnection(object):
+    """\
+    Client of replay port, which receives the recent output in ring log and
+    then is closed.
+    """
+
+    def __init__(self, loop, sock, data, log=None):
+        self.loop = loop
+        self.socket = sock
+        self.socket.setblocking(0)
+        self.buffer = bytearray(data)
+        self.log = log
+        self.fd = self.loop.register(self.socket, on_read=self.handle_read, on_write=self.handle_write,
+                                     on_error=self.close, read=True, write=True)
+
+    def handle_read(self):
+        # data from client is ignored, empty read indicates disconnection
+        try:
+            if not self.socket.recv(READ_SIZE):
+                self.close()
+        except socket.error:
+            self.close()
+
+    def handle_write(self):
+        try:
+            count = self.socket.send(self.buffer)
+            del self.buffer[:count]
+        except socket.error:
+            if self.log is not None:
+                self.log.exception('Error writing replay data...')
+            self.buffer = bytearray()
+        if not self.buffer:
+            self.close()
+
+    def close(self):
+        if self.socket is not None:
+            self.loop.unregister(self.fd)
+            self.socket.close()
+            self.socket = None
+
+
+class ClientConnection(object):
     """\
-    Single port serial<->TCP/IP forarder that depends on an external select
-    loop.
-    - Buffers for serial -> network and network -> serial
+    One network client of Forwarder.
+    - Buffer for serial -> network
     - RFC 2217 state
+    """
+
+    def __init__(self, forwarder, sock, addr):
+        self.forwarder = forwarder
+        self.socket = sock
+        self.addr = addr
+        self.buffer = bytearray()  # serial -> network
+        self.dropped = 0
+        self.stalled_drop = 0  # dropped since the last send
+        self.fd = None
+        if forwarder.log is not None:
+            self.rfc2217 = serial.rfc2217.PortManager(forwarder.serial, self, logger=log.getChild(forwarder.device))
+        else:
+            self.rfc2217 = serial.rfc2217.PortManager(forwarder.serial, self)
+
+    def write(self, data):
+        """the write method is used by serial.rfc2217.PortManager. it has to
+        write to the network."""
+        self.buffer += data
+
+    def put_serial_data(self, data):
+        """Buffer serial data, return False if the client is stuck and should be disconnected"""
+        # escape outgoing data (Telnet IAC (0xff) character)
+        self.buffer += data.replace(serial.rfc2217.IAC, serial.rfc2217.IAC + serial.rfc2217.IAC)
+        # a slow client drops the oldest data instead of stalling serial port and the other clients
+        excess = len(self.buffer) - SER2NET_HIGH_WATER
+        if excess > 0:
+            if not self.dropped and self.forwarder.log is not None:
+                self.forwarder.log.warning('{}: Client {}:{} is too slow, dropping data'.format(
+                    self.forwarder.device, self.addr[0], self.addr[1]))
+            del self.buffer[:excess]
+            self.dropped += excess
+            self.stalled_drop += excess
+        return self.stalled_drop <= SER2NET_MAX_DROP
+
+    def sent(self, count):
+        del self.buffer[:count]
+        if count:
+            self.stalled_drop = 0
+
+
+class Forwarder(ZeroconfService):
+    """\
+    Single port serial<->TCP/IP forarder that runs in an external EventLoop.
+    - Buffers for serial -> network (per client) and network -> serial
+    - Backpressure: stop reading clients if serial buffer is full, a slow
+      client drops the oldest serial data and a stuck one is disconnected
+    - Fan-out serial output to up to max_clients clients
+    - Ring log on disk and replay port for recent output
     - Zeroconf publish/unpublish on open/close.
     """
 
-    def __init__(self, device, location, name, network_port, baudrate, on_close=None, log=None):
+    def __init__(self, device, location, name, network_port, baudrate, on_close=None, log=None, loop=None,
+                 max_clients=1, ring_log=None, replay_port=None):
         ZeroconfService.__init__(self, name, network_port, stype='_serial_port._tcp')
         self.alive = False
         self.network_port = network_port
         self.on_close = on_close
         self.log = log
+        self.loop = loop
+        self.max_clients = max_clients
+        self.ring_log = ring_log
+        self.replay_port = replay_port
         self.location = location
         self.device = device
         self.serial = serial.Serial()
         self.serial.port = device
         self.serial.baudrate = baudrate
         self.serial.timeout = 0
-        self.socket = None
+        self.clients = []
         self.server_socket = None
-        self.rfc2217 = None  # instantiate later, when connecting
+        self.replay_socket = None
+        self.serial_fd = None
 
     def __del__(self):
         try:
@@ -132,10 +374,26 @@ class Forwarder(ZeroconfService):
         except:
             pass  # XXX errors on shutdown
 
+    def _listen(self, port):
+        # XXX add IPv6 support: use getaddrinfo for socket options, bind to multiple sockets?
+        #       info_list = socket.getaddrinfo(None, port, 0, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(
+            socket.SOL_SOCKET,
+            socket.SO_REUSEADDR,
+            server_socket.getsockopt(
+                socket.SOL_SOCKET,
+                socket.SO_REUSEADDR
+            ) | 1
+        )
+        server_socket.setblocking(0)
+        server_socket.bind(('', port))
+        server_socket.listen(5)
+        return server_socket
+
     def open(self):
         """open serial port, start network server and publish service"""
         self.buffer_net2ser = bytearray()
-        self.buffer_ser2net = bytearray()
 
         # open serial port
         try:
@@ -143,28 +401,24 @@ class Forwarder(ZeroconfService):
             self.serial.open()
         except Exception as msg:
             self.handle_serial_error(msg)
+            return
 
         self.serial_settings_backup = self.serial.get_settings()
+        self.serial_fd = self.loop.register(self.serial, on_read=self.handle_serial_read,
+                                            on_write=self.handle_serial_write, on_error=self.handle_serial_error)
+        if self.ring_log is not None:
+            self.ring_log.open()
 
         # start the socket server
-        # XXX add IPv6 support: use getaddrinfo for socket options, bind to multiple sockets?
-        #       info_list = socket.getaddrinfo(None, port, 0, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(
-            socket.SOL_SOCKET,
-            socket.SO_REUSEADDR,
-            self.server_socket.getsockopt(
-                socket.SOL_SOCKET,
-                socket.SO_REUSEADDR
-            ) | 1
-        )
-        self.server_socket.setblocking(0)
         try:
-            self.server_socket.bind(('', self.network_port))
-            self.server_socket.listen(1)
+            self.server_socket = self._listen(self.network_port)
+            self.loop.register(self.server_socket, on_read=self.handle_connect, on_error=self.handle_server_error)
+            if self.replay_port:
+                self.replay_socket = self._listen(self.replay_port)
+                self.loop.register(self.replay_socket, on_read=self.handle_replay_connect)
         except socket.error as msg:
             self.handle_server_error()
-            #~ raise
+            return
         if self.log is not None:
             self.log.info("{}({})(baud rate: {}): Waiting for connection on {}...".format(
                 self.device, self.location, self.serial.baudrate, self.network_port))
@@ -178,67 +432,69 @@ class Forwarder(ZeroconfService):
         # now we are ready
         self.alive = True
 
-    def close(self):
+    def _close(self):
         """Close all resources and unpublish service"""
         if self.log is not None:
             self.log.info("{}({})(baud rate: {}): closing port: {}...".format(
                 self.device, self.location, self.serial.baudrate, self.network_port))
         self.alive = False
         self.unpublish()
-        if self.server_socket:
-            self.server_socket.close()
-        if self.socket:
-            self.handle_disconnect()
+        for server_socket in (self.server_socket, self.replay_socket):
+            if server_socket:
+                self.loop.unregister(server_socket.fileno())
+                server_socket.close()
+        self.server_socket = self.replay_socket = None
+        for client in list(self.clients):
+            self.handle_disconnect(client)
+        if self.serial_fd is not None:
+            self.loop.unregister(self.serial_fd)
+            self.serial_fd = None
         self.serial.close()
+        if self.ring_log is not None:
+            self.ring_log.close()
+
+    def close(self):
+        self._close()
         if self.on_close is not None:
             # ensure it is only called once
             callback = self.on_close
             self.on_close = None
             callback(self)
 
-    def write(self, data):
-        """the write method is used by serial.rfc2217.PortManager. it has to
-        write to the network."""
-        self.buffer_ser2net += data
-
-    def update_select_maps(self, read_map, write_map, error_map):
-        """Update dictionaries for select call. insert fd->callback mapping"""
-        if self.alive:
-            # always handle serial port reads
-            read_map[self.serial] = self.handle_serial_read
-            error_map[self.serial] = self.handle_serial_error
-            # handle serial port writes if buffer is not empty
-            if self.buffer_net2ser:
-                write_map[self.serial] = self.handle_serial_write
-            # handle network
-            if self.socket is not None:
-                # handle socket if connected
-                # only read from network if the internal buffer is not
-                # already filled. the TCP flow control will hold back data
-                if len(self.buffer_net2ser) < 2048:
-                    read_map[self.socket] = self.handle_socket_read
-                # only check for write readiness when there is data
-                if self.buffer_ser2net:
-                    write_map[self.socket] = self.handle_socket_write
-                error_map[self.socket] = self.handle_socket_error
-            else:
-                # no connection, ensure clear buffer
-                self.buffer_ser2net = bytearray()
-            # check the server socket
-            read_map[self.server_socket] = self.handle_connect
-            error_map[self.server_socket] = self.handle_server_error
+    def restart(self, baudrate=None):
+        """Close and open port again without unpublish callback"""
+        self._close()
+        if baudrate:
+            self.serial.baudrate = baudrate
+        self.open()
+
+    def update_events(self):
+        """Update interest of serial port and clients by buffers"""
+        if not self.alive:
+            return
+        self.loop.modify(self.serial_fd, read=True, write=bool(self.buffer_net2ser))
+        # only read from network if the internal buffer is not
+        # already filled. the TCP flow control will hold back data
+        read_network = len(self.buffer_net2ser) < NET2SER_HIGH_WATER
+        for client in self.clients:
+            self.loop.modify(client.fd, read=read_network, write=bool(client.buffer))
 
     def handle_serial_read(self):
         """Reading from serial port"""
         try:
-            data = os.read(self.serial.fileno(), 1024)
+            # read everything available in one call
+            data = os.read(self.serial.fileno(), READ_SIZE)
             if data:
-                # store data in buffer if there is a client connected
-                if self.socket is not None:
-                    # escape outgoing data when needed (Telnet IAC (0xff) character)
-                    if self.rfc2217:
-                        data = serial.to_bytes(self.rfc2217.escape(data))
-                    self.buffer_ser2net.extend(data)
+                if self.ring_log is not None:
+                    self.ring_log.write(data)
+                # store data in buffers of connected clients
+                for client in list(self.clients):
+                    if not client.put_serial_data(data):
+                        if self.log is not None:
+                            self.log.warning('{}: Client {}:{} is stuck, dropped {} bytes'.format(
+                                self.device, client.addr[0], client.addr[1], client.dropped))
+                        self.handle_disconnect(client)
+                self.update_events()
             else:
                 self.handle_serial_error()
         except Exception as msg:
@@ -248,9 +504,10 @@ class Forwarder(ZeroconfService):
         """Writing to serial port"""
         try:
             # write a chunk
-            n = os.write(self.serial.fileno(), bytes(self.buffer_net2ser))
+            n = os.write(self.serial.fileno(), self.buffer_net2ser)
             # and see how large that chunk was, remove that from buffer
-            self.buffer_net2ser = self.buffer_net2ser[n:]
+            del self.buffer_net2ser[:n]
+            self.update_events()
         except Exception as msg:
             self.handle_serial_error(msg)
 
@@ -259,95 +516,118 @@ class Forwarder(ZeroconfService):
         # terminate connection
         self.close()
 
-    def handle_socket_read(self):
+    def handle_socket_read(self, client):
         """Read from socket"""
         try:
             # read a chunk from the serial port
-            data = self.socket.recv(1024)
+            data = client.socket.recv(READ_SIZE)
             if data:
                 # Process RFC 2217 stuff when enabled
-                if self.rfc2217:
-                    data = b''.join(self.rfc2217.filter(data))
+                if client.rfc2217:
+                    data = b''.join(client.rfc2217.filter(data))
                 # add data to buffer
                 self.buffer_net2ser.extend(data)
+                self.update_events()
             else:
                 # empty read indicates disconnection
-                self.handle_disconnect()
+                self.handle_disconnect(client)
         except socket.error:
             if self.log is not None:
                 self.log.exception("{}: error reading...".format(self.device))
-            self.handle_socket_error()
+            self.handle_socket_error(client)
 
-    def handle_socket_write(self):
+    def handle_socket_write(self, client):
         """Write to socket"""
         try:
             # write a chunk
-            count = self.socket.send(bytes(self.buffer_ser2net))
+            count = client.socket.send(client.buffer)
             # and remove the sent data from the buffer
-            self.buffer_ser2net = self.buffer_ser2net[count:]
+            client.sent(count)
+            self.update_events()
         except socket.error:
             if self.log is not None:
                 self.log.exception("{}: error writing...".format(self.device))
-            self.handle_socket_error()
+            self.handle_socket_error(client)
 
-    def handle_socket_error(self):
+    def handle_socket_error(self, client):
         """Socket connection fails"""
-        self.handle_disconnect()
+        self.handle_disconnect(client)
 
     def handle_connect(self):
         """Server socket gets a connection"""
         # accept a connection in any case, close connection
         # below if already busy
-        connection, addr = self.server_socket.accept()
-        if self.socket is None:
-            self.socket = connection
+        try:
+            connection, addr = self.server_socket.accept()
+        except socket.error:
+            return
+        if len(self.clients) < self.max_clients:
             # More quickly detect bad clients who quit without closing the
             # connection: After 1 second of idle, start sending TCP keep-alive
             # packets every 1 second. If 3 consecutive keep-alive packets
             # fail, assume the client is gone and close the connection.
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-            self.socket.setblocking(0)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            connection.setblocking(0)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             if self.log is not None:
                 self.log.warning('{}: Connected by {}:{}'.format(self.device, addr[0], addr[1]))
-            self.serial.rts = True
-            self.serial.dtr = True
-            if self.log is not None:
-                self.rfc2217 = serial.rfc2217.PortManager(self.serial, self, logger=log.getChild(self.device))
-            else:
-                self.rfc2217 = serial.rfc2217.PortManager(self.serial, self)
+            if not self.clients:
+                self.serial.rts = True
+                self.serial.dtr = True
+            client = ClientConnection(self, connection, addr)
+            client.fd = self.loop.register(
+                connection,
+                on_read=lambda: self.handle_socket_read(client),
+                on_write=lambda: self.handle_socket_write(client),
+                on_error=lambda: self.handle_socket_error(client))
+            self.clients.append(client)
+            self.update_events()
         else:
-            # reject connection if there is already one
+            # reject connection if there are already max clients
             connection.close()
             if self.log is not None:
                 self.log.warning('{}: Rejecting connect from {}:{}'.format(self.device, addr[0], addr[1]))
 
+    def handle_replay_connect(self):
+        """Replay socket gets a connection, send recent output in ring log to it"""
+        try:
+            connection, addr = self.replay_socket.accept()
+        except socket.error:
+            return
+        if self.log is not None:
+            self.log.info('{}: Replay log to {}:{}'.format(self.device, addr[0], addr[1]))
+        ReplayConnection(self.loop, connection, self.ring_log.read() if self.ring_log else b'', log=self.log)
+
     def handle_server_error(self):
         """Socket server fails"""
         self.close()
 
-    def handle_disconnect(self):
+    def handle_disconnect(self, client):
         """Socket gets disconnected"""
-        # signal disconnected terminal with control lines
+        if client not in self.clients:
+            return
+        self.clients.remove(client)
+        self.loop.unregister(client.fd)
+        # stop RFC 2217 state machine
+        client.rfc2217 = None
         try:
-            self.serial.rts = False
-            self.serial.dtr = False
+            if not self.clients:
+                # signal disconnected terminal with control lines
+                try:
+                    self.serial.rts = False
+                    self.serial.dtr = False
+                finally:
+                    # restore original port configuration in case it was changed
+                    self.serial.apply_settings(self.serial_settings_backup)
         finally:
-            # restore original port configuration in case it was changed
-            self.serial.apply_settings(self.serial_settings_backup)
-            # stop RFC 2217 state machine
-            self.rfc2217 = None
-            # clear send buffer
-            self.buffer_ser2net = bytearray()
             # close network connection
-            if self.socket is not None:
-                self.socket.close()
-                self.socket = None
-                if self.log is not None:
-                    self.log.warning('{}: Disconnected'.format(self.device))
+            client.socket.close()
+            if self.log is not None:
+                self.log.warning('{}: Disconnected {}:{}'.format(self.device, client.addr[0], client.addr[1]))
+            self.update_events()
 
 
 class TelnetPortManager(object):
@@ -445,11 +725,11 @@ def test():
     service.unpublish()
 
 
-def start_cmd_handler(forwarder_map, brm, log):
+def start_cmd_handler(forwarder_map, brm, log, loop):
     server = run_server() # Fork a process. Use server.shutdown() to stop it.
     log.info('Command manager process start...')
     cmd_queue = server.get_queue()
-    ce = CommandExector(cmd_queue, forwarder_map)
+    ce = CommandExector(cmd_queue, forwarder_map, loop)
     # Fork a thread to handle commands.
     ce.start()
     return ce
@@ -457,11 +737,12 @@ def start_cmd_handler(forwarder_map, brm, log):
 
 class CommandExector(threading.Thread):
 
-    def __init__(self, cmd_queue, forwarder_map):
+    def __init__(self, cmd_queue, forwarder_map, loop):
         threading.Thread.__init__(self)
         self.running = True
         self.cmd_queue = cmd_queue
         self.forwarder_map = forwarder_map
+        self.loop = loop # Forwarders are only touched in the loop thread.
 
     def run(self):
         log.info('execute_cmd thread start...')
@@ -476,11 +757,10 @@ class CommandExector(threading.Thread):
                 if cmd_dict['cmd'] in 'restart_port':
                     port = cmd_dict['value']
                     # Find forwarder object by telnet port and restart it.
-                    for forwarder in self.forwarder_map.itervalues():
+                    for forwarder in self.forwarder_map.values():
                         if forwarder.network_port == port:
                             log.warning('Restart forwarder by telnet port: {}...'.format(port))
-                            forwarder.close()
-                            forwarder.open()
+                            self.loop.call_soon(forwarder.restart)
                             cmd_done = True
                             break
                     if not cmd_done:
@@ -495,13 +775,12 @@ class CommandExector(threading.Thread):
                         log.warning('Not found a forwarder by USB ID: {}...'.format(usb_id))
                         continue
                     log.warning('Restart forwarder by USB ID: {}...'.format(usb_id))
-                    forwarder.close()
-                    forwarder.open()
+                    self.loop.call_soon(forwarder.restart)
 
                 # Reattach a ttyUSB node by device port.
                 elif cmd_dict['cmd'] in 'reattach_port':
                     port = cmd_dict['value']
-                    for forwarder in self.forwarder_map.itervalues():
+                    for forwarder in self.forwarder_map.values():
                         if forwarder.network_port == port:
                             log.warning('Reattach ttyUSB node by telnet port: {}...'.format(port))
                             reattach_usbtty(usb_id=forwarder.location)
@@ -524,12 +803,10 @@ class CommandExector(threading.Thread):
                     if rate in [DEFAULT_BAUD_RATE, 0]:
                         rate = DEFAULT_BAUD_RATE
 
-                    for forwarder in self.forwarder_map.itervalues():
+                    for forwarder in self.forwarder_map.values():
                         if forwarder.network_port == port:
                             log.warning('Set port: {} to baud rate: {}...'.format(port, rate))
-                            forwarder.close()
-                            forwarder.serial.baudrate = rate
-                            forwarder.open()
+                            self.loop.call_soon(lambda forwarder=forwarder, rate=rate: forwarder.restart(baudrate=rate))
                             brm.set_baud_rate(port, rate, commit=True)
                             cmd_done = True
                             break
@@ -574,8 +851,9 @@ If running as daemon, write to syslog. Otherwise write to stdout.
         epilog="""\
 NOTE: no security measures are implemented. Anyone can remotely connect
 to this service over the network.
-Only one connection at once, per port, is supported. When the connection is
-terminated, it waits for the next connect.
+Only one connection at once, per port, is supported by default (see
+--max-clients). When the connection is terminated, it waits for the next
+connect.
 """)
 
     group = parser.add_argument_group("serial port settings")
@@ -596,6 +874,33 @@ terminated, it waits for the next connect.
         type=int,
         metavar="PORT")
 
+    group.add_argument(
+        "--max-clients",
+        help="specify max clients of one port, serial output is sent to all of them (default: %(default)s)",
+        default=1,
+        type=int,
+        metavar="NUM")
+
+    group.add_argument(
+        "--ring-log-dir",
+        help="specify a folder to keep recent serial output of each port (default: disabled)",
+        default=None,
+        metavar="DIR")
+
+    group.add_argument(
+        "--ring-log-size",
+        help="specify max bytes of recent serial output kept for each port (default: %(default)s)",
+        default=1024 * 1024,
+        type=int,
+        metavar="BYTES")
+
+    group.add_argument(
+        "--replay-port-offset",
+        help="replay ring log to clients connecting to telnet port + OFFSET (default: disabled)",
+        default=None,
+        type=int,
+        metavar="OFFSET")
+
     group = parser.add_argument_group("daemon")
 
     group.add_argument(
@@ -767,7 +1072,11 @@ terminated, it waits for the next connect.
     else:
         log.info("Not clean registry table")
 
-    sch = start_cmd_handler(forwarder_map=published, brm=brm, log=logging.getLogger('cmd'))
+    if args.ring_log_dir and not os.path.exists(args.ring_log_dir):
+        os.makedirs(args.ring_log_dir)
+
+    loop = EventLoop()
+    sch = start_cmd_handler(forwarder_map=published, brm=brm, log=logging.getLogger('cmd'), loop=loop)
     def stop_sch(sig, frame):
         sch.running = False
         sys.exit(0)
@@ -795,7 +1104,7 @@ terminated, it waits for the next connect.
                 # Handle devices that are published, but no longer connected
                 for device_location in set(published).difference(connected):
                     log.info("unpublish: {}({})".format(published[device_location], device_location))
-                    unpublish(published[device_location])
+                    published[device_location].close()
                 # Handle devices that are connected but not yet published
                 for device_location in sorted(set(connected).difference(published)):
                     # Use registered port or find the first available port(starting from specified number)
@@ -809,7 +1118,12 @@ terminated, it waits for the next connect.
                         port,
                         baudrate,
                         on_close=unpublish,
-                        log=log)
+                        log=log,
+                        loop=loop,
+                        max_clients=args.max_clients,
+                        ring_log=RingLog(os.path.join(args.ring_log_dir, 'port_{}.log'.format(port)),
+                                         args.ring_log_size) if args.ring_log_dir else None,
+                        replay_port=port + args.replay_port_offset if args.replay_port_offset else None)
                     log.warning("publish: {}({})".format(published[device_location], device_location))
                     published[device_location].open()
 
@@ -818,26 +1132,7 @@ terminated, it waits for the next connect.
                 log.warning("clean registry table...")
                 tpm.clear_unuse_port(brm)
 
-            # select_start = time.time()
-            read_map = {}
-            write_map = {}
-            error_map = {}
-            for publisher in published.values():
-                publisher.update_select_maps(read_map, write_map, error_map)
-            readers, writers, errors = select.select(
-                read_map.keys(),
-                write_map.keys(),
-                error_map.keys(),
-                5)
-            # select_end = time.time()
-            # print "select used %.3f s" % (select_end - select_start)
-            for reader in readers:
-                read_map[reader]()
-            for writer in writers:
-                write_map[writer]()
-            for error in errors:
-                error_map[error]()
-            # print "operation used %.3f s" % (time.time() - select_end)
+            loop.run_once(timeout=5)
         except KeyboardInterrupt:
             alive = False
             sys.stdout.write('\n')